@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 valid_sources = {'binance'}
@@ -13,6 +14,7 @@ comparison_operators = {'<', '>', '==', '>=', '<=', '!=', '|>', '<|'}
 flow_operators = {'and', 'or', 'not', 'is', 'is not', '|', '&'}
 valid_timeframes = {'1m', '5m', '15m', '30m', '1h', '2h', '4h', '8h', '12h', '1d'}
 valid_timezones = {'UTC', 'Africa/Johannesburg'}
+valid_pruners = {'median', 'successive_halving', 'hyperband'}
 
 
 class SubConfig:
@@ -27,10 +29,51 @@ class BaseConfig:
     max_trigger_len = 300
     max_periods_in_testing_period = 1000
     max_indicators = 10
-    data_batch_len = 200
+    data_batch_len = 1000  # klines per exchange request
+    max_trial_batch_size = 500
+    max_keep_top_k = 10
+    max_symbols = 8
+    max_pruning_segments = 20
+    pruner_startup_trials = 5
+    job_max_workers = 2
+    # processes a job's CV folds / study trials run in, the cores are shared between the jobs running at once
+    cv_max_workers = max(1, (os.cpu_count() or 1) // job_max_workers)
+    process_start_method = 'spawn'
+    study_n_jobs = max(1, (os.cpu_count() or 1) // job_max_workers)
+    indicator_run_cache_max_bytes = 512 * 1024 ** 2
+    slow_bar_alignment = 'closed'  # 'closed' | 'open'
+    remove_compacted_chunk_files = False
+    exchange_api_url = 'https://api.binance.com'
+    exchange_weight_limit_per_minute = 4800  # binance allows 6000, headroom for other clients
+    klines_request_weight = 2
+    fetch_max_concurrency = 8
+    fetch_max_retries = 5
+    fetch_backoff_seconds = 0.5
+    fetch_timeout_seconds = 30
+    job_queue_max_depth = 32
+    job_history_len = 256
+    progress_poll_seconds = 0.5
+    result_cache_max_bytes = 1024 ** 3
+    result_cache_open_ended_ttl = 5 * 60  # seconds
+    visuals_max_points = 2000  # per trace, about a chart's width in pixels
+    live_max_sessions = 32
+    data_warmer_enabled = False  # fetches from the exchange on app start, enable in deployments
+    data_warmer_watchlist = None  # [(symbol, timeframe)], None for every valid symbol and timeframe
+    data_warmer_interval_seconds = 60
+    data_warmer_history_days = 30  # how far back a pair that was never stored starts
+    tracing_enabled = True
+    metrics_histogram_buckets = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)  # seconds
+    metrics_window_len = 1024  # traced requests the /metrics histograms roll over
+    # per request, split across its study/CV worker processes, None to only measure. job_max_workers requests run
+    # at once, so size it to the machine's memory / job_max_workers
+    memory_budget_bytes = 4 * 1024 ** 3
+    memory_soft_limit_fraction = 0.8  # of the budget, past it caches are evicted and trial batches shrunk
 
     resources = SubConfig(
-        local_data=Path('resources/local_data')
+        local_data=Path('resources/local_data'),
+        studies=Path('resources/studies'),
+        jobs=Path('resources/jobs'),
+        result_cache=Path('resources/result_cache'),
     )
 
 
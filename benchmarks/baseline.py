@@ -0,0 +1,41 @@
+import json
+from pathlib import Path
+
+
+def get_result_key(result: dict) -> str:
+    if 'bars' not in result:  # startup measurements have no data case
+        return result['function']
+    return f"{result['function']}|{result['bars']}|{result['n_indicators']}|{'+'.join(result['timeframes'])}"
+
+
+def load_results(path: Path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(path: Path, results: dict):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    '''Compares each measurement's median against the baseline's for the same function and case, a ratio past
+    1 + tolerance is a regression. Measurements missing from either side aren't compared'''
+    baseline_medians = {get_result_key(result): result['median_seconds'] for result in baseline['results']}
+
+    comparisons = []
+    for result in results['results']:
+        baseline_median = baseline_medians.get(get_result_key(result))
+        if not baseline_median:
+            continue
+
+        ratio = result['median_seconds'] / baseline_median
+        comparisons.append({'key': get_result_key(result),
+                            'median_seconds': result['median_seconds'],
+                            'baseline_median_seconds': baseline_median,
+                            'ratio': ratio,
+                            'regression': ratio > 1 + tolerance})
+
+    return comparisons
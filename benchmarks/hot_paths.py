@@ -0,0 +1,117 @@
+import time
+from itertools import cycle
+
+import numpy as np
+import optuna
+import pandas as pd
+
+from base_config import BaseConfig
+from benchmarks.synthetic_data import benchmark_symbol, write_synthetic_data
+from engine.data.data_manager import fetch_datas, get_merged_data, get_fastest_timeframe_data
+from engine.process_requests import get_pf_and_strat_runs, get_timeframed_run_results, get_trigger_indicator_values, \
+    get_trigger_parameter_names
+from engine.process_study_result import get_standard_result_from_study, get_pf_figure
+from engine.trigger_parsing import compile_trigger
+from engine.visuals import downsample_figure
+from indicators.indicator_run_caching import clear_indicator_run_cache
+from models import BtRequest, RestIndicator, TestingPeriod
+
+# cycled through when a case asks for more indicators than listed
+benchmark_indicators = ('ema', 'rsi', 'macd', 'bbands', 'atr', 'mfi', 'adx', 'mom', 'ma')
+hot_path_functions = ('get_merged_data', 'get_indicator_run_results', 'trigger_evaluate', 'get_pf_and_strat_runs',
+                      'get_standard_result_from_study', 'pf_figure_html')
+
+
+def get_benchmark_request(n_indicators: int, timeframes: list, start_ns: int, end_ns: int) -> BtRequest:
+    '''Indicators spread over the timeframes, triggers referencing every one of them so each is run'''
+    indicators = [RestIndicator(alias=f'ind{i}', indicator=indicator, timeframe=timeframe)
+                  for i, indicator, timeframe in zip(range(n_indicators), cycle(benchmark_indicators),
+                                                     cycle(timeframes))]
+    aliases = [indicator.alias for indicator in indicators]
+    testing_period = TestingPeriod(start=pd.Timestamp(start_ns, tz='UTC').strftime('%Y-%m-%d %H:%M'),
+                                   end=pd.Timestamp(end_ns - 1, tz='UTC').strftime('%Y-%m-%d %H:%M'),
+                                   tz='UTC')
+
+    return BtRequest(symbol=benchmark_symbol,
+                     testing_period=testing_period,
+                     indicators=indicators,
+                     custom_ranges={},
+                     trigger_pairs=[{'alias': 'bench',
+                                     'entry': ' or '.join(f'{alias}#diff.1 > 0' for alias in aliases),
+                                     'exit': ' and '.join(f'{alias}#diff.1 < 0' for alias in aliases)}],
+                     cross_validate=None)
+
+
+def time_call(function, repeats: int) -> list:
+    '''Wall clock seconds of repeats calls after one untimed warm up call (jit compilation, imports)'''
+    function()
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return durations
+
+
+def get_uncached_run_results(timeframed_data, bt_request):
+    clear_indicator_run_cache()
+    return get_timeframed_run_results(timeframed_data, bt_request.indicators)
+
+
+def evaluate_compiled_triggers(bt_request, operands: dict, length: int):
+    '''Compiles without the trigger cache, then evaluates, the successor of formatting and eval'ing triggers'''
+    indicator_values = get_trigger_indicator_values(bt_request.indicators)
+    parameter_names = get_trigger_parameter_names(bt_request)
+    for trigger in (bt_request.trigger_pairs[0].entry, bt_request.trigger_pairs[0].exit):
+        compile_trigger(trigger, indicator_values, parameter_names).evaluate(operands, params={}, length=length)
+
+
+def get_pf_figure_html(pf, strat_runs):
+    fig = downsample_figure(get_pf_figure(pf, strat_runs), BaseConfig.visuals_max_points)
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+def run_case(n_bars: int, n_indicators: int, timeframes: list, repeats: int, functions=hot_path_functions) -> list:
+    '''Times the hot path functions on synthetic bars, n_bars of the finest timeframe'''
+    start_ns, end_ns = write_synthetic_data(n_bars, timeframes)
+    bt_request = get_benchmark_request(n_indicators, timeframes, start_ns, end_ns)
+    timeframed_data = fetch_datas(source=bt_request.source, symbol=bt_request.symbol, timeframes=timeframes,
+                                  testing_period=bt_request.testing_period)
+    fastest_timeframe_data, fastest_timeframe = get_fastest_timeframe_data(timeframed_data)
+
+    operands = {'close': np.asarray(fastest_timeframe_data.close, dtype=np.float64).reshape(-1)}
+    for timeframe_run_results in get_uncached_run_results(timeframed_data, bt_request).values():
+        for alias, run_results in timeframe_run_results.items():
+            for run_value, run_result in run_results.items():
+                operands[f'{alias}.{run_value}'] = run_result['shaped_run_result']
+
+    pf, strat_runs = get_pf_and_strat_runs(timeframed_data, bt_request=bt_request, add_strat_runs=False)
+    study = optuna.create_study(direction='maximize')
+    study.add_trial(optuna.trial.create_trial(params={}, distributions={}, value=0.))
+    top_trial_runs = [{'number': 0, 'params': {}, 'value': 0., 'pf': pf, 'strat_runs': strat_runs,
+                       'symbol_values': None}]
+
+    calls = {
+        'get_merged_data': lambda: [get_merged_data(testing_period=bt_request.testing_period, timeframe=timeframe,
+                                                    symbol=bt_request.symbol) for timeframe in timeframes],
+        'get_indicator_run_results': lambda: get_uncached_run_results(timeframed_data, bt_request),
+        'trigger_evaluate': lambda: evaluate_compiled_triggers(bt_request, operands, len(operands['close'])),
+        'get_pf_and_strat_runs': lambda: get_pf_and_strat_runs(timeframed_data, bt_request=bt_request,
+                                                               add_strat_runs=False),
+        'get_standard_result_from_study': lambda: get_standard_result_from_study(study, bt_request, top_trial_runs),
+        'pf_figure_html': lambda: get_pf_figure_html(pf, strat_runs),
+    }
+
+    results = []
+    for function in functions:
+        durations = time_call(calls[function], repeats)
+        results.append({'function': function,
+                        'bars': n_bars,
+                        'n_indicators': n_indicators,
+                        'timeframes': list(timeframes),
+                        'repeats': repeats,
+                        'median_seconds': float(np.median(durations)),
+                        'min_seconds': float(np.min(durations))})
+
+    return results
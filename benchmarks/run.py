@@ -0,0 +1,91 @@
+'''Times the hot paths over synthetic bars and compares against a baseline, run from the repo root:
+
+    python -m benchmarks.run --quick
+    python -m benchmarks.run --bars 100000 1000000 --indicators 4 --output benchmarks/results/latest.json
+    python -m benchmarks.run --update-baseline
+
+Exits 1 when a measurement regressed past the tolerance'''
+import argparse
+import platform
+import sys
+import time
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+import optuna
+import pandas as pd
+
+from benchmarks.baseline import compare_to_baseline, load_results, save_results
+from benchmarks.hot_paths import hot_path_functions, run_case
+
+default_bars = [10_000, 100_000, 1_000_000, 5_000_000]
+default_indicators = [1, 4, 8]
+default_timeframe_mixes = ['1m', '1m,1h', '1m,15m,4h']
+default_baseline = Path(__file__).parent / 'baseline.json'
+
+
+def get_meta() -> dict:
+    import vectorbtpro as vbt
+
+    return {'created': pd.Timestamp.now(tz='UTC').isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'optuna': optuna.__version__,
+                         'vectorbtpro': vbt.__version__}}
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Benchmarks the data, indicator, trigger, portfolio, result '
+                                                 'and visuals hot paths')
+    parser.add_argument('--bars', type=int, nargs='+', default=default_bars)
+    parser.add_argument('--indicators', type=int, nargs='+', default=default_indicators)
+    parser.add_argument('--timeframes', nargs='+', default=default_timeframe_mixes,
+                        help='timeframe mixes, comma separated, bars are counted in the finest timeframe')
+    parser.add_argument('--functions', nargs='+', default=list(hot_path_functions), choices=hot_path_functions)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='10k and 100k bars, 3 repeats')
+    parser.add_argument('--output', type=Path, default=None, help='json results path')
+    parser.add_argument('--baseline', type=Path, default=default_baseline)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown of a median, 0.25 is 25%%')
+    parser.add_argument('--update-baseline', action='store_true', help='writes the results as the new baseline')
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = get_parser().parse_args(argv)
+    if args.quick:
+        args.bars, args.repeats = [bars for bars in args.bars if bars <= 100_000] or [10_000], 3
+
+    results = {'meta': get_meta(), 'results': []}
+    for n_bars, n_indicators, timeframe_mix in product(args.bars, args.indicators, args.timeframes):
+        start = time.perf_counter()
+        case_results = run_case(n_bars, n_indicators, timeframe_mix.split(','), args.repeats, args.functions)
+        results['results'].extend(case_results)
+        print(f'{n_bars} bars, {n_indicators} indicators, {timeframe_mix}: '
+              f'{time.perf_counter() - start:.1f}s', file=sys.stderr)
+        for result in case_results:
+            print(f"  {result['function']:<32} median {result['median_seconds']:.4f}s "
+                  f"min {result['min_seconds']:.4f}s", file=sys.stderr)
+
+    if args.update_baseline:
+        save_results(args.baseline, results)
+    elif args.baseline.exists():
+        results['comparisons'] = compare_to_baseline(results, load_results(args.baseline), args.tolerance)
+    else:
+        print(f'No baseline at {args.baseline}, run with --update-baseline to create one', file=sys.stderr)
+
+    if args.output:
+        save_results(args.output, results)
+
+    regressions = [comparison for comparison in results.get('comparisons', []) if comparison['regression']]
+    for comparison in regressions:
+        print(f"Regression {comparison['key']}: {comparison['baseline_median_seconds']:.4f}s -> "
+              f"{comparison['median_seconds']:.4f}s ({comparison['ratio']:.2f}x)", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
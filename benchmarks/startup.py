@@ -0,0 +1,116 @@
+'''Times process startup, each measurement in a fresh interpreter, and compares against a baseline, run from the
+repo root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeats 10 --output benchmarks/results/startup.json
+    python -m benchmarks.startup --update-baseline
+
+Exits 1 when a measurement regressed past the tolerance'''
+import argparse
+import platform
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.baseline import compare_to_baseline, load_results, save_results
+
+repo_folder = Path(__file__).parent.parent
+default_baseline = Path(__file__).parent / 'startup_baseline.json'
+
+# measured code per case, run after the interpreter started, the time it takes is printed as seconds
+startup_cases = {
+    # request validation, what an API worker needs before it touches the engine
+    'import_models': 'import models',
+    # what a job or study pool worker loads to unpickle its task
+    'import_process_requests': 'import engine.process_requests',
+    # API worker cold start, the app with every route
+    'import_main': 'import main',
+    # the first indicator factory a worker builds, deferred from import to first use
+    'first_indicator': 'from indicators.indicator_registry import get_vbt_indicator\n'
+                       'get_vbt_indicator("rsi")',
+    # a job pool spinning up one worker up to it being ready to run a study
+    'pool_spin_up': 'import multiprocessing\n'
+                    'from concurrent.futures import ProcessPoolExecutor\n'
+                    'from base_config import BaseConfig\n'
+                    'with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('
+                    'BaseConfig.process_start_method)) as pool:\n'
+                    '    pool.submit(exec, "import engine.process_requests").result()',
+}
+# setup run before the timer starts, so a case only times its own code
+case_setups = {
+    'first_indicator': 'import indicators.indicator_library',
+}
+
+timed_script = '''import time
+{setup}
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+'''
+
+
+def time_startup_case(case: str) -> float:
+    '''Seconds the case's code takes in a fresh interpreter started in the repo folder'''
+    script = timed_script.format(setup=case_setups.get(case, ''), code=startup_cases[case])
+    completed = subprocess.run([sys.executable, '-c', script], cwd=repo_folder, capture_output=True, text=True,
+                               check=True)
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+def run_startup_case(case: str, repeats: int) -> dict:
+    seconds = [time_startup_case(case) for _ in range(repeats)]
+
+    return {'function': case,
+            'repeats': repeats,
+            'median_seconds': statistics.median(seconds),
+            'min_seconds': min(seconds)}
+
+
+def get_meta() -> dict:
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor()}
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Benchmarks the import and pool spin up time of fresh processes')
+    parser.add_argument('--cases', nargs='+', default=list(startup_cases), choices=startup_cases)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', type=Path, default=None, help='json results path')
+    parser.add_argument('--baseline', type=Path, default=default_baseline)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown of a median, 0.25 is 25%%')
+    parser.add_argument('--update-baseline', action='store_true', help='writes the results as the new baseline')
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = get_parser().parse_args(argv)
+
+    results = {'meta': get_meta(), 'results': []}
+    for case in args.cases:
+        result = run_startup_case(case, args.repeats)
+        results['results'].append(result)
+        print(f"{case:<32} median {result['median_seconds']:.4f}s min {result['min_seconds']:.4f}s",
+              file=sys.stderr)
+
+    if args.update_baseline:
+        save_results(args.baseline, results)
+    elif args.baseline.exists():
+        results['comparisons'] = compare_to_baseline(results, load_results(args.baseline), args.tolerance)
+    else:
+        print(f'No baseline at {args.baseline}, run with --update-baseline to create one', file=sys.stderr)
+
+    if args.output:
+        save_results(args.output, results)
+
+    regressions = [comparison for comparison in results.get('comparisons', []) if comparison['regression']]
+    for comparison in regressions:
+        print(f"Regression {comparison['key']}: {comparison['baseline_median_seconds']:.4f}s -> "
+              f"{comparison['median_seconds']:.4f}s ({comparison['ratio']:.2f}x)", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from base_config import BaseConfig
+from engine.data.data_manager import aggregate_ohlcv_arrays, get_timeframe_ns, get_minutes_from_timeframe
+from engine.data.local_store import get_local_store
+
+benchmark_symbol = 'SYNTHUSDT'  # never a real symbol, benchmarks must not overwrite fetched bars
+benchmark_start = pd.Timestamp('2010-01-01', tz='UTC')
+
+
+def get_synthetic_ohlcv(n_bars: int, timeframe: str, start_ns: int, seed: int = 0) -> tuple:
+    '''Deterministic geometric random walk bars: the same arguments always give the same open times and OHLCV'''
+    rng = np.random.default_rng(seed)
+    timeframe_ns = get_timeframe_ns(timeframe)
+    volatility = 0.001 * np.sqrt(get_minutes_from_timeframe(timeframe))
+
+    close = 100 * np.exp(np.cumsum(rng.normal(0, volatility, n_bars)))
+    open_ = np.concatenate([[100.], close[:-1]])
+    wick = np.abs(rng.normal(0, volatility / 2, n_bars)) * close
+
+    timestamps = start_ns + np.arange(n_bars, dtype=np.int64) * timeframe_ns
+    return timestamps, {'open': open_,
+                        'high': np.maximum(open_, close) + wick,
+                        'low': np.minimum(open_, close) - wick,
+                        'close': close,
+                        'volume': rng.lognormal(3, 1, n_bars)}
+
+
+def write_synthetic_data(n_bars: int, timeframes: list, symbol: str = benchmark_symbol, seed: int = 0,
+                         base_folder: Path = None) -> tuple:
+    '''Writes n_bars of the finest timeframe, and the same span aggregated for the coarser ones, to the local
+    store under symbol. Spans a store already covers are left alone, so repeated runs reuse their bars.
+    Returns the [start, end) nanoseconds written'''
+    base_folder = base_folder or BaseConfig.resources.local_data
+    timeframes = sorted(timeframes, key=get_minutes_from_timeframe)
+    start_ns = benchmark_start.value
+    end_ns = start_ns + n_bars * get_timeframe_ns(timeframes[0])
+
+    finest_bars = None
+    for timeframe in timeframes:
+        local_store = get_local_store(symbol, timeframe, base_folder)
+        if not local_store.get_missing_intervals(start_ns, end_ns):
+            continue
+
+        if finest_bars is None:
+            finest_bars = get_synthetic_ohlcv(n_bars, timeframes[0], start_ns, seed=seed)
+        timestamps, ohlcv = finest_bars
+        if timeframe != timeframes[0]:
+            arrays = aggregate_ohlcv_arrays({'timestamp': timestamps, **ohlcv}, get_timeframe_ns(timeframe))
+            timestamps = arrays.pop('timestamp')
+            ohlcv = arrays
+        local_store.write(timestamps, ohlcv, covered_intervals=[[start_ns, end_ns]])
+
+    return start_ns, end_ns
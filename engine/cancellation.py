@@ -0,0 +1,38 @@
+import os
+from pathlib import Path
+
+# set in a job's worker process, inherited by every study/fold process it spawns
+cancel_path_env_var = 'BT_JOB_CANCEL_PATH'
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+def set_job_cancel_path(cancel_path: Path = None):
+    if cancel_path is None:
+        os.environ.pop(cancel_path_env_var, None)
+    else:
+        os.environ[cancel_path_env_var] = str(cancel_path)
+
+
+def request_job_cancel(cancel_path: Path):
+    '''Flags the job as cancelled, a file so processes at any depth of the job see it without shared state'''
+    cancel_path.parent.mkdir(parents=True, exist_ok=True)
+    cancel_path.touch()
+
+
+def is_job_cancelled() -> bool:
+    cancel_path = os.environ.get(cancel_path_env_var)
+    return bool(cancel_path) and os.path.exists(cancel_path)
+
+
+def raise_if_job_cancelled():
+    if is_job_cancelled():
+        raise JobCancelledError('Job cancelled')
+
+
+def stop_study_if_job_cancelled(study, trial):
+    '''Optuna callback, stops study.optimize after the current trial once the job is cancelled'''
+    if is_job_cancelled():
+        study.stop()
@@ -1,12 +1,18 @@
-import os
-from datetime import datetime
+import shutil
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
 import numpy as np
 import pandas as pd
 import vectorbtpro as vbt
-from base_config import BaseConfig
+from base_config import BaseConfig, valid_timeframes
+from engine.data.kline_fetcher import fetch_klines_to_store, run_coroutine
+from engine.data.local_store import LocalOhlcvStore, get_local_store, ohlcv_fields
 
 
 data_library = {}
+alignment_indexes = OrderedDict()
+max_alignment_indexes = 256
 
 
 def convert_std_timeframe_to_pandas_timeframe(timeframe: str):
@@ -29,6 +35,62 @@ def reshape_slow_timeframe_data_to_fast(slow_timeframe_data, fastest_timeframe_i
     return slow_timeframe_data
 
 
+def get_index_ns(index) -> np.ndarray:
+    return pd.DatetimeIndex(index).as_unit('ns').asi8
+
+
+def get_timeframe_alignment_index(slow_index, fast_index, slow_timeframe: str, fast_timeframe: str,
+                                  alignment: str = None) -> np.ndarray:
+    '''Returns, for every fast bar, the position of the slow bar whose value it may use, -1 when there is none yet.
+    With 'closed' alignment a slow bar is only used once it has closed by the fast bar's close
+    (slow open + slow timeframe <= fast open + fast timeframe), so a 12h bar's value reaches the 4h bars
+    after it and never the ones inside it. 'open' reproduces the legacy forward fill from the slow bar's open,
+    which leaks the slow bar's close into the fast bars it spans. Cached per index pair, so a request or
+    CV fold computes it once and every indicator on that timeframe pair reuses it'''
+    alignment = alignment or BaseConfig.slow_bar_alignment
+    if alignment not in ('closed', 'open'):
+        raise ValueError(f'Invalid alignment {alignment}, expecting closed or open')
+
+    slow_ns = get_index_ns(slow_index)
+    fast_ns = get_index_ns(fast_index)
+
+    key = (slow_timeframe, fast_timeframe, alignment,
+           len(slow_ns), int(slow_ns[0]) if len(slow_ns) else None, int(slow_ns[-1]) if len(slow_ns) else None,
+           len(fast_ns), int(fast_ns[0]) if len(fast_ns) else None, int(fast_ns[-1]) if len(fast_ns) else None)
+    if key in alignment_indexes:
+        alignment_indexes.move_to_end(key)
+        return alignment_indexes[key]
+
+    if alignment == 'closed':
+        slow_available_ns = slow_ns + get_timeframe_ns(slow_timeframe)
+        fast_reference_ns = fast_ns + get_timeframe_ns(fast_timeframe)
+    else:
+        slow_available_ns = slow_ns
+        fast_reference_ns = fast_ns
+
+    alignment_index = np.searchsorted(slow_available_ns, fast_reference_ns, side='right') - 1
+    alignment_index.flags.writeable = False
+
+    alignment_indexes[key] = alignment_index
+    if len(alignment_indexes) > max_alignment_indexes:
+        alignment_indexes.popitem(last=False)
+
+    return alignment_index
+
+
+def align_slow_values_to_fast(slow_values, alignment_index: np.ndarray) -> np.ndarray:
+    '''Gathers slow timeframe rows (1d or 2d, one row per slow bar) onto the fast index, NaN before the first
+    usable slow bar'''
+    slow_values = np.asarray(slow_values, dtype=np.float64)
+    if not len(slow_values):
+        return np.full((len(alignment_index),) + slow_values.shape[1:], np.nan)
+
+    fast_values = np.take(slow_values, np.maximum(alignment_index, 0), axis=0)
+    fast_values[alignment_index < 0] = np.nan
+
+    return fast_values
+
+
 def reshape_vbt_data_to_fast(slow_timeframe_data, fastest_timeframe_index, symbol, tz: str):
     ''' Extend slow timeframe data to match the index of the fastest timeframe data '''
 
@@ -67,6 +129,10 @@ def get_minutes_from_timeframe(timeframe: str):
         return int(timeframe.replace('d', '')) * 60 * 24
 
 
+def get_timeframe_ns(timeframe: str) -> int:
+    return get_minutes_from_timeframe(timeframe) * 60 * 10 ** 9
+
+
 def get_fastest_timeframe_data(timeframed_data: dict) -> tuple:
     """ Get the fastest timeframe data from a dict of timeframed data """
     fastest_timeframe_mins = 0
@@ -84,89 +150,210 @@ def get_fastest_timeframe_data(timeframed_data: dict) -> tuple:
 
     return timeframed_data[fastest_timeframe], fastest_timeframe
 
-def get_merged_data(testing_period, timeframe, symbol, source='binance'):  # todo customize for sources & different tzs
-    base_local_data_folder = BaseConfig.resources.local_data
+def parse_legacy_chunk_name(name: str) -> tuple:
+    '''Returns the (start, end) of a legacy '{start}_{end}.pickle' chunk, None for anything else'''
+    try:
+        start_str, end_str = name.split('_')
+        return (datetime.strptime(start_str, '%Y-%m-%d %H-%M-%S'),
+                datetime.strptime(end_str.split('.')[0], '%Y-%m-%d %H-%M-%S'))
+    except ValueError:
+        return None
+
+
+def compact_legacy_chunks(symbol_timeframe_data_folder: Path, local_store: LocalOhlcvStore, timeframe: str):
+    '''Merges the legacy per batch vbt pickles of a symbol/timeframe into its columnar store in one write,
+    each chunk covering [chunk start, chunk end + timeframe). Compacted chunks are recorded in the manifest
+    and only removed with BaseConfig.remove_compacted_chunk_files'''
+    compacted_files = set(local_store.read_manifest()['compacted_files'])
+    timeframe_ns = get_timeframe_ns(timeframe)
+
+    chunk_paths = []
+    covered_intervals = []
+    for chunk_path in sorted(symbol_timeframe_data_folder.glob('*')):
+        chunk_range = parse_legacy_chunk_name(chunk_path.name)
+        if chunk_range is None or chunk_path.name in compacted_files:
+            continue
 
+        chunk_paths.append(chunk_path)
+        chunk_start, chunk_end = (pd.Timestamp(chunk_edge, tz='UTC').value for chunk_edge in chunk_range)
+        covered_intervals.append([chunk_start, chunk_end + timeframe_ns])
+
+    if not chunk_paths:
+        return
+
+    data_pieces = []
+    for chunk_path in chunk_paths:
+        # some chunks were saved as a folder holding the pickle
+        load_path = next(chunk_path.glob('*.pickle')) if chunk_path.is_dir() else chunk_path
+        data_pieces.append(vbt.BinanceData.load(load_path))
+
+    data = vbt.BinanceData.merge(data_pieces) if len(data_pieces) > 1 else data_pieces[0]
+    local_store.write(get_index_ns(data.index),
+                      {field: np.asarray(getattr(data, field), dtype=np.float64).reshape(-1)
+                       for field in ohlcv_fields},
+                      covered_intervals=covered_intervals,
+                      compacted_files=[chunk_path.name for chunk_path in chunk_paths])
+
+    if BaseConfig.remove_compacted_chunk_files:
+        for chunk_path in chunk_paths:
+            shutil.rmtree(chunk_path) if chunk_path.is_dir() else chunk_path.unlink()
+
+
+def fetch_missing_intervals(local_store: LocalOhlcvStore, symbol: str, timeframe: str, start_ns: int, end_ns: int):
+    '''Fetches the parts of [start_ns, end_ns) the store doesn't cover from the exchange, see
+    fetch_klines_to_store. Waits for another process's fetch into the store and only fetches what it left missing'''
+    if not local_store.get_missing_intervals(start_ns, end_ns):
+        return
+
+    with local_store.fetch_locked():
+        missing_intervals = local_store.get_missing_intervals(start_ns, end_ns)
+        if missing_intervals:
+            run_coroutine(fetch_klines_to_store(local_store, symbol, timeframe, missing_intervals,
+                                                get_timeframe_ns(timeframe)))
+
+
+def aggregate_ohlcv_arrays(arrays: dict, timeframe_ns: int) -> dict:
+    '''Aggregates sorted finer bars into the bars of a coarser timeframe, bucketed on multiples of timeframe_ns
+    since the epoch the way the exchange opens them'''
+    bucket_ns = arrays['timestamp'] // timeframe_ns * timeframe_ns
+    if not len(bucket_ns):
+        return {field: np.empty(0, dtype=values.dtype) for field, values in arrays.items()}
+
+    starts = np.flatnonzero(np.diff(bucket_ns, prepend=bucket_ns[0] - 1))
+    ends = np.append(starts[1:], len(bucket_ns)) - 1
+
+    return {'timestamp': bucket_ns[starts],
+            'open': arrays['open'][starts],
+            'high': np.maximum.reduceat(arrays['high'], starts),
+            'low': np.minimum.reduceat(arrays['low'], starts),
+            'close': arrays['close'][ends],
+            'volume': np.add.reduceat(arrays['volume'], starts)}
+
+
+def get_derivation_base_timeframe(symbol: str, timeframe: str, start_ns: int, end_ns: int,
+                                  fetchable_base_timeframes=(), base_folder: Path = None) -> str:
+    '''Returns the finer timeframe to build timeframe's [start_ns, end_ns) bars from: a local store that
+    already covers the span, else one of the fetchable_base_timeframes, None when neither exists.
+    Every finer timeframe that divides timeframe aggregates to the same bars, so the coarsest one is used'''
+    timeframe_minutes = get_minutes_from_timeframe(timeframe)
+    base_timeframes = sorted((base_timeframe for base_timeframe in valid_timeframes
+                              if get_minutes_from_timeframe(base_timeframe) < timeframe_minutes
+                              and timeframe_minutes % get_minutes_from_timeframe(base_timeframe) == 0),
+                             key=get_minutes_from_timeframe, reverse=True)
+
+    for base_timeframe in base_timeframes:
+        base_store = get_local_store(symbol, base_timeframe, base_folder or BaseConfig.resources.local_data)
+        if not base_store.get_missing_intervals(start_ns, end_ns):
+            return base_timeframe
+
+    for base_timeframe in base_timeframes:
+        if base_timeframe in fetchable_base_timeframes:
+            return base_timeframe
+
+    return None
+
+
+def derive_missing_intervals(local_store: LocalOhlcvStore, symbol: str, timeframe: str, start_ns: int, end_ns: int,
+                             fetchable_base_timeframes=(), now_ns: int = None, base_folder: Path = None):
+    '''Fills the parts of [start_ns, end_ns) the store doesn't cover by aggregating finer bars, fetching any base
+    bars still missing only for a base in fetchable_base_timeframes. Only coarse bars closed by now_ns (now by
+    default) are derived, the open one would be stored as final. The derived bars are written to the store, so
+    later requests load them directly. Base stores are read from base_folder, the local data folder by default'''
+    base_folder = base_folder or BaseConfig.resources.local_data
+    timeframe_ns = get_timeframe_ns(timeframe)
+    now_ns = pd.Timestamp.now(tz='UTC').value if now_ns is None else now_ns
+    closed_end_ns = now_ns // timeframe_ns * timeframe_ns
+
+    for missing_start, missing_end in local_store.get_missing_intervals(start_ns, end_ns):
+        # whole closed coarse bars only, a partial bucket would aggregate to a wrong bar
+        missing_start -= missing_start % timeframe_ns
+        missing_end = min(missing_end + -missing_end % timeframe_ns, closed_end_ns)
+        if missing_end <= missing_start:
+            continue
+
+        base_timeframe = get_derivation_base_timeframe(symbol, timeframe, missing_start, missing_end,
+                                                       fetchable_base_timeframes, base_folder)
+        if base_timeframe is None:
+            continue
+
+        base_store = get_local_store(symbol, base_timeframe, base_folder)
+        fetch_missing_intervals(base_store, symbol, base_timeframe, missing_start, missing_end)
+
+        bars = aggregate_ohlcv_arrays(base_store.load_arrays(missing_start, missing_end), timeframe_ns)
+        local_store.write(bars.pop('timestamp'), bars, covered_intervals=[[missing_start, missing_end]])
+
+
+def get_testing_period_ns(testing_period) -> tuple:
+    '''Returns the testing period's start and end as UTC nanoseconds, now for open ended periods'''
     testing_period_start = datetime.strptime(testing_period.start, '%Y-%m-%d %H:%M')
-    if testing_period.end :
+    if testing_period.end:
         testing_period_end = datetime.strptime(testing_period.end, '%Y-%m-%d %H:%M')
     else:
-        testing_period_end = datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M')
+        testing_period_end = datetime.now(timezone.utc).replace(tzinfo=None)
 
-    pd_timeframe = convert_std_timeframe_to_pandas_timeframe(timeframe)
+    return pd.Timestamp(testing_period_start, tz='UTC').value, pd.Timestamp(testing_period_end, tz='UTC').value
 
-    required_files = set()
-    period_index = pd.date_range(start=testing_period_start, end=testing_period_end, freq=pd_timeframe,
-                                 inclusive='left')
-    periods_required_sr = pd.Series(data=np.full(len(period_index), False), index=period_index)
 
+def get_merged_data(testing_period, timeframe, symbol, source='binance', base_timeframes=()):  # todo customize for sources & different tzs
+    '''Returns the symbol's bars from the testing period start up to and including its end, served from the
+    columnar local store. Intervals its manifest doesn't cover yet are derived from finer bars, see
+    derive_missing_intervals, with base_timeframes allowed to be fetched for it, and fetched otherwise'''
+    base_local_data_folder = BaseConfig.resources.local_data
     symbol_timeframe_data_folder = base_local_data_folder / f'{symbol}/{timeframe}'
-    local_data_files = symbol_timeframe_data_folder.glob('*')
-
-    for filename in local_data_files:
-        start_str = filename.name.split('_')[0]
-        end_str = filename.name.split('_')[1].split('.')[0]
-        file_start = datetime.strptime(start_str, '%Y-%m-%d %H-%M-%S')
-        file_end = datetime.strptime(end_str, '%Y-%m-%d %H-%M-%S')
-
-        if file_start > testing_period_end or file_end < testing_period_start:
-            continue
+    local_store = get_local_store(symbol, timeframe, base_local_data_folder)
 
-        file_range = pd.date_range(start=file_start, end=file_end, freq=pd_timeframe)
+    timeframe_ns = get_timeframe_ns(timeframe)
+    start_ns, end_ns = get_testing_period_ns(testing_period)
+    # the bar still open now isn't final, never record it as covered
+    last_closed_ns = pd.Timestamp.now(tz='UTC').value // timeframe_ns * timeframe_ns - timeframe_ns
 
-        file_needed = False
-        for period in file_range:
-            if period in period_index and periods_required_sr.loc[period] == False:
-                file_needed = True
-                periods_required_sr.loc[period] = True
+    if symbol_timeframe_data_folder.exists():
+        compact_legacy_chunks(symbol_timeframe_data_folder, local_store, timeframe)
 
-        if file_needed:
-            required_files.add(symbol_timeframe_data_folder / filename.name)  # todo <- add timezone to this when we turn into public api...
+    required_end_ns = min(end_ns, last_closed_ns + timeframe_ns)
+    derive_missing_intervals(local_store, symbol, timeframe, start_ns, required_end_ns, base_timeframes)
+    fetch_missing_intervals(local_store, symbol, timeframe, start_ns, required_end_ns)
 
-        if periods_required_sr.all():
-            break
+    return convert_ohlcv_to_vbt_data(local_store.load_df(start_ns, end_ns + 1), symbol, tz=None)
 
-    periods_still_needed = periods_required_sr[~periods_required_sr].index
 
-    if len(periods_still_needed):
-        end_period = periods_still_needed[-1] + pd.Timedelta(pd_timeframe)
-        total_period = pd.date_range(start=periods_still_needed[0], end=end_period, freq=pd_timeframe)
-
-        period_chunks = [total_period[i:i + BaseConfig.data_batch_len] for i in range(0, len(total_period),
-                                                                                      BaseConfig.data_batch_len)]
+def align_symbol_datas(symbol_datas: dict) -> dict:
+    '''Trims every symbol's timeframes to the bars all symbols have, so each timeframe stacks into aligned
+    (bars, symbols) columns. Symbols listed later than the testing period start shorten it for all'''
+    timeframes = list(next(iter(symbol_datas.values())))
+    for timeframe in timeframes:
+        timeframe_datas = [timeframed_data[timeframe] for timeframed_data in symbol_datas.values()]
+        if any(not len(timeframe_data.index) for timeframe_data in timeframe_datas):
+            raise ValueError(f'No {timeframe} bars for some symbols in the testing period')
 
-        for period_chunk in period_chunks:
-            data = vbt.BinanceData.fetch([symbol],
-                                         start=period_chunk[0],
-                                         end=period_chunk[-1],
-                                         timeframe=timeframe,
-                                         execute_kwargs={'engine': 'threadpool'})
-            filename = f'{period_chunk[0]}_{period_chunk[-1]}'.replace(':', '-')
-            full_file_path = symbol_timeframe_data_folder / filename
-            if not os.path.exists(symbol_timeframe_data_folder):
-                symbol_timeframe_data_folder.mkdir(parents=True)
+        start = max(timeframe_data.index[0] for timeframe_data in timeframe_datas)
+        end = min(timeframe_data.index[-1] for timeframe_data in timeframe_datas)
+        for timeframed_data in symbol_datas.values():
+            timeframed_data[timeframe] = timeframed_data[timeframe].loc[start:end]
 
-            data.save(full_file_path)
-            required_files.add(full_file_path)
+        if len({len(timeframed_data[timeframe].index) for timeframed_data in symbol_datas.values()}) > 1:
+            raise ValueError(f'Symbols have different {timeframe} bars between {start} and {end}')
 
-    data_pieces = []
-    for full_file_path in required_files:
-        data_piece = vbt.BinanceData.load(full_file_path)
-        data_pieces.append(data_piece)
+    return symbol_datas
 
-    data = vbt.BinanceData.merge(data_pieces)
 
-    return data.loc[testing_period_start.strftime('%Y-%m-%d %H:%M'):testing_period_end.strftime('%Y-%m-%d %H:%M')]
+def fetch_symbol_datas(source, symbols: list, timeframes: list, testing_period) -> dict:
+    '''Returns the timeframed data of every symbol, aligned on the bars they share'''
+    return align_symbol_datas({symbol: fetch_datas(source=source, symbol=symbol, timeframes=timeframes,
+                                                   testing_period=testing_period)
+                               for symbol in symbols})
 
 
 def fetch_datas(source, symbol, timeframes: list, testing_period):
     datas = {}
 
-    for timeframe in timeframes:
+    # finest first, so every coarser timeframe can be derived from bars already fetched
+    for timeframe in sorted(timeframes, key=get_minutes_from_timeframe):
         data = get_merged_data(testing_period=testing_period,
                                timeframe=timeframe,
                                symbol=symbol,
-                               source=source)
+                               source=source,
+                               base_timeframes=tuple(datas))
         datas[timeframe] = data
 
     return datas
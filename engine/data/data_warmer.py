@@ -0,0 +1,169 @@
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from base_config import BaseConfig, valid_symbols, valid_timeframes
+from engine.data.data_manager import get_timeframe_ns, derive_missing_intervals
+from engine.data.kline_fetcher import fetch_klines_to_store, run_coroutine
+from engine.data.local_store import get_local_store
+
+day_ns = 24 * 60 * 60 * 10 ** 9
+
+
+def get_default_watchlist() -> list:
+    '''Every valid symbol and timeframe, finest timeframes first'''
+    return [(symbol, timeframe) for symbol in sorted(valid_symbols)
+            for timeframe in sorted(valid_timeframes, key=get_timeframe_ns)]
+
+
+def get_iso_datetime(ns: int) -> str:
+    return datetime.fromtimestamp(ns / 10 ** 9, tz=timezone.utc).isoformat() if ns is not None else None
+
+
+class DataWarmer:
+    '''Background scheduler appending the newly closed bars of a watchlist of (symbol, timeframe) pairs to the
+    local store every interval_seconds, so requests, open ended ones included, find their bars stored.
+    Only a symbol's finest watched timeframe is fetched from the exchange, the coarser ones it divides are
+    derived from its bars, see derive_missing_intervals. Pairs never stored start history_days back. A pair is
+    never warmed twice at once: a pass reaching a pair still being warmed, or one another process is fetching,
+    skips it'''
+
+    def __init__(self, base_folder: Path, watchlist: list = None, interval_seconds: float = 60,
+                 history_days: float = 30, transport: httpx.AsyncBaseTransport = None):
+        self.base_folder = Path(base_folder)
+        self.watchlist = [tuple(pair) for pair in watchlist] if watchlist else get_default_watchlist()
+        self.interval_seconds = interval_seconds
+        self.history_days = history_days
+        self.transport = transport
+        self.lock = threading.Lock()
+        self.in_progress = set()
+        self.status = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def get_base_timeframe(self, symbol: str, timeframe: str):
+        '''The symbol's finest watched timeframe when it is finer than timeframe and divides it, else None'''
+        timeframe_ns = get_timeframe_ns(timeframe)
+        base_timeframes = [watched_timeframe for watched_symbol, watched_timeframe in self.watchlist
+                           if watched_symbol == symbol and get_timeframe_ns(watched_timeframe) < timeframe_ns
+                           and timeframe_ns % get_timeframe_ns(watched_timeframe) == 0]
+
+        return min(base_timeframes, key=get_timeframe_ns) if base_timeframes else None
+
+    def get_target_interval(self, local_store, timeframe: str, now_ns: int, base_store=None) -> tuple:
+        '''[start, end) of the bars to append: from the end of the last covered interval, or history_days back,
+        up to the bar still open now. A never stored pair derived from base_store starts with its first whole
+        bar in the base's current stretch of bars, so the derivation covers it'''
+        timeframe_ns = get_timeframe_ns(timeframe)
+        end_ns = now_ns // timeframe_ns * timeframe_ns
+        covered_intervals = local_store.get_covered_intervals()
+        if covered_intervals:
+            return covered_intervals[-1][1], end_ns
+
+        start_ns = (end_ns - int(self.history_days * day_ns)) // timeframe_ns * timeframe_ns
+        base_covered_intervals = base_store.get_covered_intervals() if base_store is not None else []
+        if base_covered_intervals:
+            start_ns = max(start_ns, -(-base_covered_intervals[-1][0] // timeframe_ns) * timeframe_ns)
+
+        return start_ns, end_ns
+
+    def warm(self, symbol: str, timeframe: str, now_ns: int = None) -> int:
+        '''Appends the pair's newly closed bars, returns the number of chunks fetched, None when the pair is
+        already being warmed or the fetch failed, see get_freshness for the error'''
+        key = (symbol, timeframe)
+        with self.lock:
+            if key in self.in_progress:
+                return None
+            self.in_progress.add(key)
+
+        try:
+            now_ns = now_ns or time.time_ns()
+            local_store = get_local_store(symbol, timeframe, self.base_folder)
+            base_timeframe = self.get_base_timeframe(symbol, timeframe)
+            base_store = get_local_store(symbol, base_timeframe, self.base_folder) if base_timeframe else None
+            start_ns, end_ns = self.get_target_interval(local_store, timeframe, now_ns, base_store)
+
+            n_chunks = 0
+            with local_store.fetch_locked(blocking=False) as fetch_lock_acquired:
+                if not fetch_lock_acquired:
+                    return None
+
+                if base_store is not None and start_ns < end_ns:
+                    derive_missing_intervals(local_store, symbol, timeframe, start_ns, end_ns, now_ns=now_ns,
+                                             base_folder=self.base_folder)
+
+                # fetched only for the finest timeframe, or what the base's bars didn't cover
+                missing_intervals = local_store.get_missing_intervals(start_ns, end_ns) if start_ns < end_ns else []
+                if missing_intervals:
+                    n_chunks = run_coroutine(fetch_klines_to_store(local_store, symbol, timeframe, missing_intervals,
+                                                                   get_timeframe_ns(timeframe),
+                                                                   transport=self.transport))
+
+            self.status[key] = {'last_warmed_ns': now_ns, 'last_error': None}
+            return n_chunks
+        except Exception as e:
+            self.status[key] = {**self.status.get(key, {'last_warmed_ns': None}), 'last_error': repr(e)}
+            return None
+        finally:
+            with self.lock:
+                self.in_progress.discard(key)
+
+    def warm_all(self, now_ns: int = None):
+        # finest timeframes first, the coarser ones derive from their bars
+        for symbol, timeframe in sorted(self.watchlist, key=lambda pair: get_timeframe_ns(pair[1])):
+            if self.stop_event.is_set():
+                return
+            self.warm(symbol, timeframe, now_ns=now_ns)
+
+    def get_freshness(self, now_ns: int = None) -> list:
+        '''Per pair: the last stored bar, the last closed bar, how many closed bars are missing in between and
+        when the pair was last warmed'''
+        now_ns = now_ns or time.time_ns()
+        freshness = []
+        for symbol, timeframe in self.watchlist:
+            timeframe_ns = get_timeframe_ns(timeframe)
+            covered_intervals = get_local_store(symbol, timeframe, self.base_folder).get_covered_intervals()
+            end_ns = now_ns // timeframe_ns * timeframe_ns
+            last_bar_ns, lag_bars = None, None
+            if covered_intervals:
+                last_bar_ns = covered_intervals[-1][1] - timeframe_ns
+                lag_bars = (end_ns - covered_intervals[-1][1]) // timeframe_ns
+            status = self.status.get((symbol, timeframe), {})
+
+            freshness.append({'symbol': symbol,
+                              'timeframe': timeframe,
+                              'last_bar': get_iso_datetime(last_bar_ns),
+                              'last_closed_bar': get_iso_datetime(end_ns - timeframe_ns),
+                              'lag_bars': lag_bars,
+                              'is_fresh': lag_bars == 0,
+                              'warming': (symbol, timeframe) in self.in_progress,
+                              'last_warmed': get_iso_datetime(status.get('last_warmed_ns')),
+                              'last_error': status.get('last_error')})
+
+        return freshness
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.warm_all()
+            self.stop_event.wait(self.interval_seconds)
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='data-warmer', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = None):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+data_warmer = DataWarmer(BaseConfig.resources.local_data, watchlist=BaseConfig.data_warmer_watchlist,
+                         interval_seconds=BaseConfig.data_warmer_interval_seconds,
+                         history_days=BaseConfig.data_warmer_history_days)
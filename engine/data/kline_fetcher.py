@@ -0,0 +1,189 @@
+import asyncio
+import random
+import threading
+import time
+
+import httpx
+import numpy as np
+
+from base_config import BaseConfig
+from engine.data.local_store import LocalOhlcvStore, ohlcv_fields
+
+klines_path = '/api/v3/klines'
+retry_status_codes = {418, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    '''Async token bucket, capacity tokens refilled at refill_per_second, one token per unit of request weight'''
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    async def acquire(self, weight: float = 1):
+        async with self.lock:
+            self.refill()
+            while self.tokens < weight:
+                await asyncio.sleep((weight - self.tokens) / self.refill_per_second)
+                self.refill()
+            self.tokens -= weight
+
+    def observe_used_weight(self, used_weight: float, weight_limit: float):
+        '''Drops tokens the exchange reports as already used this minute, e.g. by other clients on the same IP'''
+        self.refill()
+        self.tokens = min(self.tokens, self.capacity * (1 - used_weight / weight_limit))
+
+
+def plan_kline_chunks(intervals, timeframe_ns: int, bars_per_chunk: int) -> list:
+    '''Splits [start, end) nanosecond intervals into ordered chunks of at most bars_per_chunk bars'''
+    chunk_ns = bars_per_chunk * timeframe_ns
+    chunks = []
+    for start_ns, end_ns in intervals:
+        # align to bar opens so the recorded coverage matches the bars fetched
+        start_ns -= start_ns % timeframe_ns
+        for chunk_start in range(start_ns, end_ns, chunk_ns):
+            chunks.append((chunk_start, min(chunk_start + chunk_ns, end_ns)))
+
+    return chunks
+
+
+def parse_klines(klines: list) -> tuple:
+    '''Returns the open times in ns and the OHLCV arrays of raw exchange kline rows'''
+    if not klines:
+        return np.empty(0, dtype=np.int64), {field: np.empty(0) for field in ('open', 'high', 'low', 'close',
+                                                                               'volume')}
+
+    rows = np.asarray([kline[:6] for kline in klines], dtype=np.float64)
+    timestamps = np.asarray([kline[0] for kline in klines], dtype=np.int64) * 10 ** 6
+
+    return timestamps, {'open': rows[:, 1], 'high': rows[:, 2], 'low': rows[:, 3], 'close': rows[:, 4],
+                        'volume': rows[:, 5]}
+
+
+def get_retry_delay(attempt: int, response: httpx.Response = None) -> float:
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        return float(retry_after)
+
+    return BaseConfig.fetch_backoff_seconds * 2 ** attempt * (1 + random.random())
+
+
+async def fetch_kline_chunk(client: httpx.AsyncClient, token_bucket: TokenBucket, symbol: str, interval: str,
+                            chunk_start: int, chunk_end: int) -> list:
+    '''Fetches the klines opening in [chunk_start, chunk_end), retrying rate limits, server and transport errors
+    with exponential backoff'''
+    params = {'symbol': symbol,
+              'interval': interval,
+              'startTime': chunk_start // 10 ** 6,
+              'endTime': (chunk_end - 1) // 10 ** 6,
+              'limit': BaseConfig.data_batch_len}
+
+    for attempt in range(BaseConfig.fetch_max_retries + 1):
+        await token_bucket.acquire(BaseConfig.klines_request_weight)
+        response = None
+        try:
+            response = await client.get(klines_path, params=params)
+        except httpx.TransportError:
+            if attempt == BaseConfig.fetch_max_retries:
+                raise
+        else:
+            used_weight = response.headers.get('X-MBX-USED-WEIGHT-1m')
+            if used_weight:
+                token_bucket.observe_used_weight(float(used_weight), BaseConfig.exchange_weight_limit_per_minute)
+
+            if response.status_code not in retry_status_codes or attempt == BaseConfig.fetch_max_retries:
+                response.raise_for_status()
+                return response.json()
+
+        await asyncio.sleep(get_retry_delay(attempt, response))
+
+
+async def fetch_klines_to_store(local_store: LocalOhlcvStore, symbol: str, timeframe: str, intervals,
+                                timeframe_ns: int, transport: httpx.AsyncBaseTransport = None) -> int:
+    '''Fetches the chunks of intervals concurrently over one pooled client and streams them into local_store.
+    Chunks complete in any order but are written in chunk order, so chunks after the last stored bar are in place
+    appends, each with the interval it covers. Chunks backfilling before it are buffered and merged in one write
+    once fetching stops, rather than copying the store once per chunk. Returns the number of chunks fetched'''
+    chunks = plan_kline_chunks(intervals, timeframe_ns, BaseConfig.data_batch_len)
+    if not chunks:
+        return 0
+
+    token_bucket = TokenBucket(capacity=BaseConfig.exchange_weight_limit_per_minute,
+                               refill_per_second=BaseConfig.exchange_weight_limit_per_minute / 60)
+    semaphore = asyncio.Semaphore(BaseConfig.fetch_max_concurrency)
+    limits = httpx.Limits(max_connections=BaseConfig.fetch_max_concurrency,
+                          max_keepalive_connections=BaseConfig.fetch_max_concurrency)
+
+    completed = {}
+    next_chunk = 0
+    last_stored_ns = local_store.get_last_timestamp()
+    backfill_chunks = []
+
+    def write_completed():
+        nonlocal next_chunk
+        while next_chunk in completed:
+            chunk_start, chunk_end = chunks[next_chunk]
+            timestamps, ohlcv = parse_klines(completed.pop(next_chunk))
+            in_chunk = (timestamps >= chunk_start) & (timestamps < chunk_end)
+            chunk_bars = (timestamps[in_chunk], {field: values[in_chunk] for field, values in ohlcv.items()},
+                          [chunk_start, chunk_end])
+            if last_stored_ns is not None and chunk_start <= last_stored_ns:
+                backfill_chunks.append(chunk_bars)
+            else:
+                local_store.write(*chunk_bars[:2], covered_intervals=[chunk_bars[2]])
+            next_chunk += 1
+
+    def write_backfill_chunks():
+        if backfill_chunks:
+            local_store.write(np.concatenate([timestamps for timestamps, _, _ in backfill_chunks]),
+                              {field: np.concatenate([ohlcv[field] for _, ohlcv, _ in backfill_chunks])
+                               for field in ohlcv_fields},
+                              covered_intervals=[interval for _, _, interval in backfill_chunks])
+
+    async def fetch_chunk(chunk_index: int):
+        async with semaphore:
+            completed[chunk_index] = await fetch_kline_chunk(client, token_bucket, symbol, timeframe,
+                                                             *chunks[chunk_index])
+        write_completed()
+
+    async with httpx.AsyncClient(base_url=BaseConfig.exchange_api_url, limits=limits, transport=transport,
+                                 timeout=BaseConfig.fetch_timeout_seconds) as client:
+        try:
+            await asyncio.gather(*(fetch_chunk(chunk_index) for chunk_index in range(len(chunks))))
+        finally:
+            # keeps the backfill fetched before a failure
+            write_backfill_chunks()
+
+    return len(chunks)
+
+
+def run_coroutine(coroutine):
+    '''Runs coroutine to completion from sync code, in a helper thread when this thread already runs a loop'''
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    result = {}
+
+    def run():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+
+    return result['value']
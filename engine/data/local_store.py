@@ -0,0 +1,259 @@
+import json
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # windows, stores are only locked between the threads of a process
+    fcntl = None
+
+ohlcv_fields = ('open', 'high', 'low', 'close', 'volume')
+store_folder_name = 'columnar'
+manifest_name = 'manifest.json'
+lock_name = 'store.lock'
+fetch_lock_name = 'fetch.lock'
+
+store_locks = {}
+store_locks_lock = threading.Lock()
+
+
+def merge_intervals(intervals) -> list:
+    '''Merges overlapping or touching [start, end) intervals'''
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+def subtract_intervals(start: int, end: int, covered_intervals) -> list:
+    '''Returns the parts of [start, end) not covered by the sorted, merged covered_intervals'''
+    missing = []
+    cursor = start
+    for covered_start, covered_end in covered_intervals:
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            missing.append([cursor, covered_start])
+        cursor = max(cursor, covered_end)
+        if cursor >= end:
+            break
+
+    if cursor < end:
+        missing.append([cursor, end])
+
+    return missing
+
+
+def get_store_lock(store_path: Path) -> threading.Lock:
+    with store_locks_lock:
+        return store_locks.setdefault(str(store_path.resolve()), threading.Lock())
+
+
+class LocalOhlcvStore:
+    '''Append-only columnar OHLCV store for one symbol/timeframe.
+    One raw int64 file of UTC nanosecond bar open times plus one float64 file per OHLCV field, always sorted
+    by time, read through memory maps. manifest.json is the commit point: it holds the generation of the column
+    files, the number of committed rows and the [start, end) intervals known to be covered. Appends only write
+    past the committed rows and merges write a new generation, so readers never see a half written write.
+    Writers hold an exclusive lock on store.lock across processes, readers a shared one while they map columns'''
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self.lock = get_store_lock(self.folder)
+        self.fetch_lock = get_store_lock(self.folder / fetch_lock_name)
+
+    def get_column_path(self, field: str, generation: int = 0) -> Path:
+        return self.folder / (f'{field}.bin' if not generation else f'{field}.{generation}.bin')
+
+    @contextmanager
+    def locked(self, shared: bool = False):
+        '''Holds the store's lock, shared between readers, exclusive for a writer's read-modify-write'''
+        if shared and not self.folder.exists():
+            yield
+            return
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with (self.lock if not shared else nullcontext()), open(self.folder / lock_name, 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    @contextmanager
+    def fetch_locked(self, blocking: bool = True):
+        '''Held across fetching bars into the store, so processes don't fetch the same missing bars at once.
+        Yields whether it was acquired, False only when not blocking and another fetch holds it'''
+        if not self.fetch_lock.acquire(blocking):
+            yield False
+            return
+
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            with open(self.folder / fetch_lock_name, 'a+b') as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        yield False
+                        return
+                yield True
+        finally:
+            self.fetch_lock.release()
+
+    def read_manifest(self) -> dict:
+        manifest_path = self.folder / manifest_name
+        if not manifest_path.exists():
+            return {'version': 1, 'generation': 0, 'n_rows': 0, 'intervals': [], 'compacted_files': []}
+
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest: dict):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        temp_path = self.folder / f'{manifest_name}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self.folder / manifest_name)
+
+    def get_covered_intervals(self) -> list:
+        return self.read_manifest()['intervals']
+
+    def get_missing_intervals(self, start_ns: int, end_ns: int) -> list:
+        '''Returns the [start, end) nanosecond ranges of the request that the store doesn't cover'''
+        return subtract_intervals(start_ns, end_ns, self.get_covered_intervals())
+
+    def get_column(self, field: str, manifest: dict, dtype) -> np.ndarray:
+        if not manifest['n_rows']:
+            return np.empty(0, dtype=dtype)
+
+        return np.memmap(self.get_column_path(field, manifest.get('generation', 0)), dtype=dtype, mode='r',
+                         shape=(manifest['n_rows'],))
+
+    def get_arrays(self, start_ns: int, end_ns: int, manifest: dict) -> dict:
+        timestamps = self.get_column('timestamp', manifest, np.int64)
+        first, last = np.searchsorted(timestamps, [start_ns, end_ns], side='left')
+
+        arrays = {'timestamp': timestamps[first:last]}
+        for field in ohlcv_fields:
+            arrays[field] = self.get_column(field, manifest, np.float64)[first:last]
+
+        return arrays
+
+    def load_arrays(self, start_ns: int, end_ns: int) -> dict:
+        '''Returns zero-copy memory mapped views of the bars with start_ns <= open time < end_ns. The views stay
+        valid after later writes, a merge replaces the column files rather than writing into them'''
+        with self.locked(shared=True):
+            return self.get_arrays(start_ns, end_ns, self.read_manifest())
+
+    def get_last_timestamp(self):
+        '''Open time of the last stored bar, None for an empty store'''
+        with self.locked(shared=True):
+            manifest = self.read_manifest()
+            timestamps = self.get_column('timestamp', manifest, np.int64)
+            return int(timestamps[-1]) if len(timestamps) else None
+
+    def load_df(self, start_ns: int, end_ns: int) -> pd.DataFrame:
+        arrays = self.load_arrays(start_ns, end_ns)
+        index = pd.DatetimeIndex(arrays['timestamp'].astype('datetime64[ns]')).tz_localize('UTC')
+
+        return pd.DataFrame({field.capitalize(): arrays[field] for field in ohlcv_fields}, index=index)
+
+    def write(self, timestamps: np.ndarray, ohlcv: dict, covered_intervals: list = (),
+              compacted_files: list = ()):
+        '''Adds bars and the intervals they cover. Bars after the last stored bar are appended in place,
+        anything older or overlapping merges with the stored bars into a new generation of column files, newer bars
+        win on duplicates. A merge copies the whole store, so backfills should arrive in as few writes as possible'''
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        ohlcv = {field: np.asarray(ohlcv[field], dtype=np.float64) for field in ohlcv_fields}
+
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        ohlcv = {field: values[order] for field, values in ohlcv.items()}
+        # keep the last of any duplicated timestamps within the new bars
+        keep = np.append(timestamps[1:] != timestamps[:-1], True) if len(timestamps) else np.empty(0, dtype=bool)
+        timestamps = timestamps[keep]
+        ohlcv = {field: values[keep] for field, values in ohlcv.items()}
+
+        with self.locked():
+            manifest = self.read_manifest()
+            manifest.setdefault('generation', 0)
+            n_rows = manifest['n_rows']
+            stored_timestamps = self.get_column('timestamp', manifest, np.int64)
+
+            replaced_generation = None
+            if not len(timestamps):
+                pass
+            elif not n_rows or timestamps[0] > stored_timestamps[-1]:
+                self.append_columns(timestamps, ohlcv, manifest)
+                n_rows += len(timestamps)
+            else:
+                replaced_generation = manifest['generation']
+                n_rows = self.merge_columns(timestamps, ohlcv, manifest)
+                manifest['generation'] = replaced_generation + 1
+
+            del stored_timestamps
+            manifest['n_rows'] = n_rows
+            manifest['intervals'] = merge_intervals(manifest['intervals'] + [list(interval)
+                                                                             for interval in covered_intervals])
+            manifest['compacted_files'] = sorted(set(manifest['compacted_files']) | set(compacted_files))
+            self.write_manifest(manifest)
+            if replaced_generation is not None:
+                self.remove_generation(replaced_generation)
+
+    def append_columns(self, timestamps: np.ndarray, ohlcv: dict, manifest: dict):
+        n_rows = manifest['n_rows']
+        for field, values in [('timestamp', timestamps)] + list(ohlcv.items()):
+            column_path = self.get_column_path(field, manifest['generation'])
+            with open(column_path, 'r+b' if column_path.exists() else 'wb') as f:
+                # drop any uncommitted tail left by an interrupted append
+                f.truncate(n_rows * values.itemsize)
+                f.seek(n_rows * values.itemsize)
+                f.write(values.tobytes())
+
+    def merge_columns(self, timestamps: np.ndarray, ohlcv: dict, manifest: dict) -> int:
+        '''Writes the stored bars merged with the new ones as the next generation's column files, which only the
+        manifest written after it commits. Returns the merged number of rows'''
+        stored = self.get_arrays(np.iinfo(np.int64).min, np.iinfo(np.int64).max, manifest)
+        # both sides are sorted, so a binary search finds the stored bars the new ones replace
+        positions = np.minimum(np.searchsorted(timestamps, stored['timestamp']), len(timestamps) - 1)
+        stored_only = timestamps[positions] != stored['timestamp']
+
+        merged_timestamps = np.concatenate([stored['timestamp'][stored_only], timestamps])
+        order = np.argsort(merged_timestamps, kind='stable')
+        merged = {'timestamp': merged_timestamps[order]}
+        for field in ohlcv_fields:
+            merged[field] = np.concatenate([stored[field][stored_only], ohlcv[field]])[order]
+
+        del stored
+        for field, values in merged.items():
+            values.tofile(self.get_column_path(field, manifest['generation'] + 1))
+
+        return len(merged['timestamp'])
+
+    def remove_generation(self, generation: int):
+        '''Removes a replaced generation's column files, readers still mapping them keep their views on POSIX.
+        Files that can't be removed yet (mapped on windows) are left for the next merge to retry'''
+        for path in self.folder.glob('*.bin'):
+            name_parts = path.name.split('.')
+            path_generation = int(name_parts[1]) if len(name_parts) == 3 and name_parts[1].isdigit() else 0
+            if path_generation <= generation:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+
+def get_local_store(symbol: str, timeframe: str, base_folder: Path) -> LocalOhlcvStore:
+    return LocalOhlcvStore(Path(base_folder) / symbol / timeframe / store_folder_name)
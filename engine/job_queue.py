@@ -0,0 +1,252 @@
+import multiprocessing
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import partial
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from base_config import BaseConfig
+from engine.cancellation import JobCancelledError, set_job_cancel_path, request_job_cancel
+from engine.process_requests import run_study
+from engine.progress import set_job_progress_path
+from engine.result_cache import result_cache, get_cached_result, cache_result, get_result_id, get_result_cache_key
+from engine.memory_budget import request_memory
+from engine.tracing import request_trace, trace_span, metrics_registry, get_trace_dict, get_trace_diagnostics
+from engine.visuals import save_visual_sources
+from engine.process_study_result import get_jsonable_result
+
+job_statuses = ('queued', 'running', 'completed', 'failed', 'cancelled')
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    job_id: str
+    cancel_path: Path
+    progress_path: Path
+    submitted_at: datetime
+    future: object = field(default=None, repr=False)
+    cancel_requested: bool = False
+    get_diagnostics: bool = False
+    request_key: str = None
+
+    @property
+    def status(self) -> str:
+        if not self.future.done():
+            return 'running' if self.future.running() else 'queued'
+        if self.future.cancelled():
+            return 'cancelled'
+
+        error = self.future.exception()
+        if error is None:
+            return 'completed'
+
+        return 'cancelled' if isinstance(error, JobCancelledError) else 'failed'
+
+    def get_status_dict(self) -> dict:
+        status = self.status
+        error = self.future.exception() if status == 'failed' else None
+
+        return {'job_id': self.job_id,
+                'status': status,
+                'submitted_at': self.submitted_at.isoformat(),
+                'cancel_requested': self.cancel_requested,
+                'error': f'{type(error).__name__}: {error}' if error else None}
+
+
+def run_job(bt_request, cancel_path: Path, progress_path: Path) -> dict:
+    '''Job worker entry point, runs the study and returns its JSON safe result along with the request's trace and
+    memory report, which aren't cached'''
+    set_job_cancel_path(cancel_path)
+    set_job_progress_path(progress_path)
+    try:
+        with request_trace() as trace, request_memory() as memory:
+            processed_result = run_study(bt_request)
+
+            result_id = get_result_id(bt_request)
+            save_visual_sources(result_cache.get_visuals_folder(result_id), processed_result.visual_sources)
+            with trace_span('result'):
+                payload = {'result_id': result_id, **get_jsonable_result(processed_result)}
+            cache_result(bt_request, payload, result_id=result_id)
+
+        return {**payload, 'trace': get_trace_dict(trace), 'memory': memory.to_dict()}
+    finally:
+        set_job_cancel_path(None)
+        set_job_progress_path(None)
+
+
+def observe_job_trace(future: Future):
+    '''Done callback of run_job futures, records the finished request's trace in the metrics registry'''
+    if not future.cancelled() and future.exception() is None:
+        metrics_registry.observe(future.result()['trace'])
+
+
+class JobQueue:
+    '''Runs backtest jobs on a bounded pool of worker processes, accepting at most max_workers running plus
+    max_depth queued jobs. Finished jobs are kept, oldest dropped first, up to history_len.
+
+    Queued jobs wait here rather than in the executor, which moves jobs into its call queue (and marks their futures
+    running) before a worker picks them up. A job's future is only set running once it is handed to a free worker,
+    so its status is accurate and a queued job can always be dropped'''
+
+    def __init__(self, max_workers: int, max_depth: int, history_len: int, jobs_folder: Path):
+        self.max_workers = max_workers
+        self.max_depth = max_depth
+        self.history_len = history_len
+        self.jobs_folder = Path(jobs_folder)
+        self.jobs = OrderedDict()
+        self.executor = None
+        self.pending = deque()
+        # reentrant, a job finishing at once calls dispatch_pending again from within it
+        self.lock = threading.RLock()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                mp_context=multiprocessing.get_context(
+                                                    BaseConfig.process_start_method))
+        return self.executor
+
+    def get_n_unfinished(self) -> int:
+        return sum(not job.future.done() for job in self.jobs.values())
+
+    def get_n_running(self) -> int:
+        return sum(job.future.running() for job in self.jobs.values())
+
+    def submit_to_executor(self, job: Job, bt_request) -> Future:
+        try:
+            return self.get_executor().submit(run_job, bt_request, job.cancel_path, job.progress_path)
+        except BrokenProcessPool:
+            # a worker died (e.g. out of memory), its jobs are failed, start a fresh pool for new ones
+            self.executor = None
+            return self.get_executor().submit(run_job, bt_request, job.cancel_path, job.progress_path)
+
+    def dispatch_pending(self):
+        '''Hands queued jobs to the executor while a worker is free, skipping the ones cancelled while queued'''
+        with self.lock:
+            while self.pending and self.get_n_running() < self.max_workers:
+                job, bt_request = self.pending.popleft()
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    executor_future = self.submit_to_executor(job, bt_request)
+                except Exception as e:
+                    job.future.set_exception(e)
+                    continue
+                executor_future.add_done_callback(partial(self.finish_job, job))
+
+    def finish_job(self, job: Job, executor_future: Future):
+        '''Done callback of executor futures, completes the job's future and starts the next queued job'''
+        if executor_future.cancelled():
+            job.future.set_exception(JobCancelledError('Job cancelled at shutdown'))
+        elif executor_future.exception() is not None:
+            job.future.set_exception(executor_future.exception())
+        else:
+            job.future.set_result(executor_future.result())
+
+        self.dispatch_pending()
+
+    def forget_finished_jobs(self):
+        finished_job_ids = [job_id for job_id, job in self.jobs.items() if job.future.done()]
+        for job_id in finished_job_ids[:max(0, len(finished_job_ids) - self.history_len)]:
+            job = self.jobs.pop(job_id)
+            job.cancel_path.unlink(missing_ok=True)
+            job.progress_path.unlink(missing_ok=True)
+
+    def get_in_flight_job(self, request_key: str) -> Optional[Job]:
+        '''The unfinished, not cancelled job of an identical request'''
+        return next((job for job in self.jobs.values() if job.request_key == request_key
+                     and not job.future.done() and not job.cancel_requested), None)
+
+    def submit(self, bt_request) -> Job:
+        '''Queues the request, or completes the job at once from the result cache. An identical request still
+        queued or running is joined rather than run twice, returning its job'''
+        cached_result = get_cached_result(bt_request)
+        request_key = get_result_cache_key(bt_request)
+
+        with self.lock:
+            in_flight_job = self.get_in_flight_job(request_key) if cached_result is None else None
+            if in_flight_job is not None:
+                return in_flight_job
+
+            if cached_result is None and self.get_n_unfinished() >= self.max_workers + self.max_depth:
+                raise JobQueueFullError(f'Job queue is full, at most {self.max_depth} jobs can wait')
+
+            job_id = uuid.uuid4().hex
+            job = Job(job_id=job_id, cancel_path=self.jobs_folder / f'{job_id}.cancel',
+                      progress_path=self.jobs_folder / f'{job_id}.progress.jsonl',
+                      submitted_at=datetime.now(timezone.utc), get_diagnostics=bool(bt_request.get_diagnostics),
+                      request_key=request_key)
+            self.jobs_folder.mkdir(parents=True, exist_ok=True)
+
+            job.future = Future()
+            if cached_result is not None:
+                job.future.set_result(cached_result)
+            else:
+                job.future.add_done_callback(observe_job_trace)
+                self.pending.append((job, bt_request))
+
+            self.jobs[job_id] = job
+            self.forget_finished_jobs()
+            self.dispatch_pending()
+
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        '''Drops a queued job, or flags a running one so its Optuna loop stops at the next batch or trial'''
+        job = self.get_job(job_id)
+        if job is None or job.future.done():
+            return job
+
+        job.cancel_requested = True
+        if not job.future.cancel():
+            request_job_cancel(job.cancel_path)
+
+        return job
+
+    def get_result(self, job_id: str) -> Optional[dict]:
+        job = self.get_job(job_id)
+        if job is None or job.status != 'completed':
+            return None
+
+        # jobs completed from the result cache carry neither trace nor memory report
+        result = job.future.result()
+        payload = {key: value for key, value in result.items() if key != 'trace'}
+        if job.get_diagnostics:
+            payload['diagnostics'] = {'result_cache_hit': 'trace' not in result,
+                                      **get_trace_diagnostics(result.get('trace'))}
+
+        return payload
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+
+        return {status: statuses.count(status) for status in job_statuses}
+
+    def shutdown(self):
+        with self.lock:
+            for job in list(self.jobs.values()):
+                if not job.future.done():
+                    self.cancel(job.job_id)
+            self.pending.clear()
+
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+job_queue = JobQueue(max_workers=BaseConfig.job_max_workers, max_depth=BaseConfig.job_queue_max_depth,
+                     history_len=BaseConfig.job_history_len, jobs_folder=BaseConfig.resources.jobs)
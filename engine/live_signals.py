@@ -0,0 +1,334 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from base_config import BaseConfig
+from engine.data.data_manager import fetch_datas, get_merged_data, get_fastest_timeframe_data, \
+    get_minutes_from_timeframe, get_timeframe_ns, get_index_ns
+from engine.process_requests import get_compiled_trigger_pair, get_live_run_indicators, get_kwargs_to_add, \
+    get_params_run_kwargs
+from engine.trigger_parsing import Operand, Negate, Arithmetic, Comparison, Logical, Not, arithmetic_functions, \
+    comparison_functions, cross_operators, get_relation
+from indicators.incremental_indicators import RollingWindow, get_incremental_indicator
+from indicators.indicator_library import get_indicator_key_value
+from models import TestingPeriod
+
+ohlcv_fields = ('open', 'high', 'low', 'close', 'volume')
+
+
+class ProcessWindow:
+    '''Trailing window of a #diff/#mean/#median process, NaN for the warm-up bars like get_processed_array'''
+
+    def __init__(self, process: str, window: int):
+        if window < 1:
+            raise ValueError(f'Process window must be at least 1, got {window}')
+
+        self.process = process
+        self.values = RollingWindow(window + 1 if process == 'diff' else window)
+
+    def update(self, value: float) -> float:
+        self.values.append(value)
+        if len(self.values.values) < self.values.n:
+            return np.nan
+
+        if self.process == 'diff':
+            return value - self.values.values[0]
+        elif self.process == 'mean':
+            return self.values.mean()
+
+        return np.median(self.values.values)
+
+
+def get_indicator_window(run_kwargs: dict) -> int:
+    '''Longest window of an indicator's run kwargs, the bars of its timeframe it needs before its first value'''
+    return max([int(value) for key, value in run_kwargs.items() if key.endswith('window') or key == 'timeperiod'],
+               default=1)
+
+
+class LiveTrigger:
+    '''Evaluates a compiled trigger one bar at a time. Crosses keep the last relation of their sides that wasn't
+    equal and processes their trailing window, every node is evaluated once per bar so each state advances exactly
+    one bar'''
+
+    def __init__(self, compiled_trigger, params: dict):
+        self.root = compiled_trigger.root
+        self.params = params
+        self.node_states = {}
+
+    def update(self, operands: dict) -> bool:
+        return bool(self.evaluate(self.root, operands, {}))
+
+    def evaluate(self, node, operands: dict, bar_values: dict):
+        if node in bar_values:
+            return bar_values[node]
+
+        if isinstance(node, Operand):
+            value = operands[node.key]
+            if node.process:
+                if node not in self.node_states:
+                    window = node.window.evaluate(operands, self.params)
+                    if int(window) != window:
+                        raise ValueError(f'Process window for {node.key} must be a whole number, got {window}')
+                    self.node_states[node] = ProcessWindow(node.process, int(window))
+                value = self.node_states[node].update(value)
+        elif isinstance(node, Negate):
+            value = -self.evaluate(node.operand, operands, bar_values)
+        elif isinstance(node, Arithmetic):
+            left = self.evaluate(node.left, operands, bar_values)
+            right = self.evaluate(node.right, operands, bar_values)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = arithmetic_functions[node.operator](np.float64(left), right)
+        elif isinstance(node, Comparison):
+            left = self.evaluate(node.left, operands, bar_values)
+            right = self.evaluate(node.right, operands, bar_values)
+            if node.operator in cross_operators:
+                relation = float(get_relation(left, right))
+                carried_relation = self.node_states.get(node, np.nan)
+                # equal sides carry the last relation, see get_crossed
+                self.node_states[node] = carried_relation if relation == 0 else relation
+                side = 1. if node.operator == '|>' else -1.
+                value = relation == side and carried_relation == -side
+            else:
+                with np.errstate(invalid='ignore'):
+                    value = comparison_functions[node.operator](left, right)
+        elif isinstance(node, Logical):
+            # both sides every bar, their crosses and processes must not skip one
+            left = self.evaluate(node.left, operands, bar_values)
+            right = self.evaluate(node.right, operands, bar_values)
+            value = (left and right) if node.operator == 'and' else (left or right)
+        elif isinstance(node, Not):
+            value = not self.evaluate(node.operand, operands, bar_values)
+        else:
+            value = node.evaluate(operands, self.params)
+
+        bar_values[node] = value
+        return value
+
+
+class SlowBarAggregator:
+    '''Builds a slow timeframe's bars from the fastest timeframe's, a slow bar is complete with the fast bar that
+    closes at its end. Slow bars whose first fast bar wasn't seen are never emitted'''
+
+    def __init__(self, timeframe: str, fastest_timeframe: str):
+        self.timeframe_ns = get_timeframe_ns(timeframe)
+        self.fastest_timeframe_ns = get_timeframe_ns(fastest_timeframe)
+        self.open_ns = None
+        self.bar = None
+        self.is_whole = False
+
+    def update(self, fast_open_ns: int, bar: dict) -> tuple:
+        '''Returns the (open ns, bar) of the slow bar this fast bar completes, None otherwise'''
+        open_ns = fast_open_ns // self.timeframe_ns * self.timeframe_ns
+        if open_ns != self.open_ns:
+            self.open_ns = open_ns
+            self.bar = dict(bar)
+            self.is_whole = fast_open_ns == open_ns
+        else:
+            self.bar['high'] = max(self.bar['high'], bar['high'])
+            self.bar['low'] = min(self.bar['low'], bar['low'])
+            self.bar['close'] = bar['close']
+            self.bar['volume'] += bar['volume']
+
+        if self.is_whole and fast_open_ns + self.fastest_timeframe_ns == open_ns + self.timeframe_ns:
+            return open_ns, self.bar
+
+        return None
+
+
+class LiveSignalSession:
+    '''Entry/exit decisions of a request's first trigger pair with fixed params, one new fastest timeframe bar at
+    a time. Indicators, process windows, crosses, the slow bars being built and the position are kept between
+    bars, so each bar is processed in O(1) of the history instead of re-running the backtest. Mirrors
+    vbt's long only from_signals: an entry opens a position when flat, an exit closes it, both at once do neither'''
+
+    def __init__(self, bt_request, params: dict, timeframes: list):
+        if bt_request.is_multi_symbol():
+            raise ValueError('Live signal sessions follow a single symbol')
+
+        if BaseConfig.slow_bar_alignment != 'closed':
+            raise ValueError("Live signals need 'closed' slow bar alignment, 'open' uses slow bars before they close")
+
+        self.symbol = bt_request.symbol
+        self.source = bt_request.source
+        self.fastest_timeframe = min(timeframes, key=get_minutes_from_timeframe)
+        self.fastest_timeframe_ns = get_timeframe_ns(self.fastest_timeframe)
+        self.lock = threading.Lock()
+
+        run_kwargs = get_params_run_kwargs(params, get_kwargs_to_add(bt_request), bt_request)
+        self.indicators = get_live_run_indicators(bt_request, run_kwargs)
+        indicator_run_kwargs = {rest_indicator.alias: {**get_indicator_key_value(rest_indicator.indicator,
+                                                                                 'run_kwargs'),
+                                                       **(rest_indicator.run_kwargs or {})}
+                                for rest_indicator in self.indicators}
+        self.indicator_states = {
+            rest_indicator.alias: get_incremental_indicator(rest_indicator.indicator,
+                                                            indicator_run_kwargs[rest_indicator.alias])
+            for rest_indicator in self.indicators}
+        self.indicator_windows = {alias: get_indicator_window(alias_run_kwargs)
+                                  for alias, alias_run_kwargs in indicator_run_kwargs.items()}
+        # NaN until an indicator's timeframe closes its first bar, like the aligned backtest values
+        self.indicator_values = {rest_indicator.alias: dict.fromkeys(get_indicator_key_value(rest_indicator.indicator,
+                                                                                             'avlbl_values'), np.nan)
+                                 for rest_indicator in self.indicators}
+
+        compiled_entry, compiled_exit = get_compiled_trigger_pair(bt_request.trigger_pairs[0], bt_request)
+        self.entry_trigger = LiveTrigger(compiled_entry, run_kwargs)
+        self.exit_trigger = LiveTrigger(compiled_exit, run_kwargs)
+
+        slow_timeframes = {rest_indicator.timeframe for rest_indicator in self.indicators} - {self.fastest_timeframe}
+        self.slow_bar_aggregators = {timeframe: SlowBarAggregator(timeframe, self.fastest_timeframe)
+                                     for timeframe in slow_timeframes}
+        self.last_slow_bar_ns = {timeframe: None for timeframe in slow_timeframes}
+
+        self.position = 0
+        self.last_bar_ns = None
+        self.last_signal = {}
+
+    @classmethod
+    def from_history(cls, timeframed_data: dict, bt_request, params: dict):
+        '''Warms the session up on the request's history, the slow timeframes from their own bars as the
+        backtest does, then the fast bars of the slow bars still open are carried into the aggregators'''
+        session = cls(bt_request, params, list(timeframed_data))
+        session.validate_history(timeframed_data)
+        fastest_timeframe_data, _ = get_fastest_timeframe_data(timeframed_data)
+        fast_open_ns = get_index_ns(fastest_timeframe_data.index)
+        fast_bars = get_ohlcv_arrays(fastest_timeframe_data)
+
+        slow_histories = {}
+        for timeframe in session.slow_bar_aggregators:
+            slow_open_ns = get_index_ns(timeframed_data[timeframe].index)
+            slow_histories[timeframe] = (slow_open_ns + get_timeframe_ns(timeframe),
+                                         slow_open_ns, get_ohlcv_arrays(timeframed_data[timeframe]))
+        slow_positions = dict.fromkeys(slow_histories, 0)
+
+        for i, open_ns in enumerate(fast_open_ns):
+            close_ns = open_ns + session.fastest_timeframe_ns
+            for timeframe, (slow_close_ns, slow_open_ns, slow_bars) in slow_histories.items():
+                while slow_positions[timeframe] < len(slow_close_ns) and \
+                        slow_close_ns[slow_positions[timeframe]] <= close_ns:
+                    j = slow_positions[timeframe]
+                    session.update_slow_bar(timeframe, int(slow_open_ns[j]),
+                                            {field: float(slow_bars[field][j]) for field in ohlcv_fields})
+                    slow_positions[timeframe] += 1
+
+            session.update(int(open_ns), **{field: float(fast_bars[field][i]) for field in ohlcv_fields})
+
+        return session
+
+    def validate_history(self, timeframed_data: dict):
+        '''Raises ValueError unless every indicator's timeframe has at least its longest window of bars, polling
+        a session warmed up on less has nothing to follow'''
+        if not len(timeframed_data[self.fastest_timeframe].index):
+            raise ValueError('The testing period holds no bars to warm the live session up on')
+
+        for rest_indicator in self.indicators:
+            n_bars = len(timeframed_data[rest_indicator.timeframe].index)
+            window = self.indicator_windows[rest_indicator.alias]
+            if n_bars < window:
+                raise ValueError(f'The testing period holds {n_bars} {rest_indicator.timeframe} bars, '
+                                 f'{rest_indicator.alias} needs at least {window}')
+
+    def update_slow_bar(self, timeframe: str, open_ns: int, bar: dict):
+        if self.last_slow_bar_ns[timeframe] is not None and open_ns <= self.last_slow_bar_ns[timeframe]:
+            return
+
+        self.last_slow_bar_ns[timeframe] = open_ns
+        self.update_indicators(timeframe, bar)
+
+    def update_indicators(self, timeframe: str, bar: dict):
+        for rest_indicator in self.indicators:
+            if rest_indicator.timeframe == timeframe:
+                self.indicator_values[rest_indicator.alias] = self.indicator_states[rest_indicator.alias].update(bar)
+
+    def get_operands(self, bar: dict) -> dict:
+        operands = dict(bar)
+        for rest_indicator in self.indicators:
+            for run_value, value in self.indicator_values[rest_indicator.alias].items():
+                operands[f'{rest_indicator.alias}.{run_value}'] = (value / bar['close'] if rest_indicator.normalize
+                                                                   else value)
+
+        return operands
+
+    def update(self, open_ns: int, open: float, high: float, low: float, close: float, volume: float) -> dict:
+        '''Processes one closed fastest timeframe bar and returns its signal, bars at or before the last one
+        processed are ignored'''
+        with self.lock:
+            if self.last_bar_ns is not None and open_ns <= self.last_bar_ns:
+                return self.last_signal
+
+            bar = {'open': open, 'high': high, 'low': low, 'close': close, 'volume': volume}
+            for timeframe, slow_bar_aggregator in self.slow_bar_aggregators.items():
+                slow_bar = slow_bar_aggregator.update(open_ns, bar)
+                if slow_bar is not None:
+                    self.update_slow_bar(timeframe, *slow_bar)
+            self.update_indicators(self.fastest_timeframe, bar)
+
+            operands = self.get_operands(bar)
+            entry = self.entry_trigger.update(operands)
+            exit = self.exit_trigger.update(operands)
+
+            value = None
+            if entry and not exit and not self.position:
+                self.position, value = 1, 'Buy'
+            elif exit and not entry and self.position:
+                self.position, value = 0, 'Sell'
+
+            self.last_bar_ns = open_ns
+            self.last_signal = {'datetime': pd.Timestamp(open_ns, tz='UTC').isoformat(),
+                                'entry': entry,
+                                'exit': exit,
+                                'value': value,
+                                'price': close,
+                                'position': self.position}
+
+            return self.last_signal
+
+    def poll(self) -> list:
+        '''Processes the bars closed since the last one, loaded through the local store, returns their signals'''
+        start = pd.Timestamp(self.last_bar_ns + self.fastest_timeframe_ns, tz='UTC')
+        testing_period = TestingPeriod(start=start.strftime('%Y-%m-%d %H:%M'), end=None, tz='UTC')
+        data = get_merged_data(testing_period=testing_period, timeframe=self.fastest_timeframe, symbol=self.symbol,
+                               source=self.source)
+
+        bars = get_ohlcv_arrays(data)
+        return [self.update(int(open_ns), **{field: float(bars[field][i]) for field in ohlcv_fields})
+                for i, open_ns in enumerate(get_index_ns(data.index)) if open_ns > self.last_bar_ns]
+
+
+def get_ohlcv_arrays(data) -> dict:
+    return {field: np.asarray(getattr(data, field), dtype=np.float64).reshape(-1) for field in ohlcv_fields}
+
+
+live_sessions = OrderedDict()
+live_sessions_lock = threading.Lock()
+
+
+def create_live_session(bt_request, params: dict) -> str:
+    '''Warms a session up on the request's testing period and registers it, the oldest sessions are dropped
+    past BaseConfig.live_max_sessions'''
+    timeframed_data = fetch_datas(source=bt_request.source,
+                                  symbol=bt_request.symbol,
+                                  timeframes=[indicator.timeframe for indicator in bt_request.indicators],
+                                  testing_period=bt_request.testing_period)
+    session = LiveSignalSession.from_history(timeframed_data, bt_request, params)
+
+    session_id = uuid.uuid4().hex
+    with live_sessions_lock:
+        live_sessions[session_id] = session
+        while len(live_sessions) > BaseConfig.live_max_sessions:
+            live_sessions.popitem(last=False)
+
+    return session_id
+
+
+def get_live_session(session_id: str) -> LiveSignalSession:
+    with live_sessions_lock:
+        return live_sessions.get(session_id)
+
+
+def remove_live_session(session_id: str) -> bool:
+    with live_sessions_lock:
+        return live_sessions.pop(session_id, None) is not None
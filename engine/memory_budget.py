@@ -0,0 +1,235 @@
+import gc
+import os
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import vectorbtpro as vbt
+
+from base_config import BaseConfig
+from indicators.indicator_run_caching import get_nbytes, get_indicator_run_cache_stats, clear_indicator_run_cache
+
+# the memory accounting of the running request, None outside requests
+current_memory = ContextVar('current_memory', default=None)
+
+ohlcv_fields = ('open', 'high', 'low', 'close', 'volume')
+# per bar of a simulated trial column: entries and exits bools, and the float64 arrays a from_signals simulation
+# and its returns allocate
+signal_bytes_per_bar = 2
+portfolio_bytes_per_bar = 8 * 8
+
+
+class MemoryBudgetExceededError(Exception):
+    pass
+
+
+def get_rss_bytes() -> int:
+    '''Resident set size of this process, the peak so far where the current one can't be read (non Linux)'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return 0
+
+    # kilobytes on linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def get_mib(nbytes: int) -> str:
+    return f'{nbytes / 1024 ** 2:.0f} MiB'
+
+
+def get_data_nbytes(timeframed_data: dict) -> int:
+    '''Bytes of the OHLCV columns of timeframed data, or of every symbol's for multi symbol requests'''
+    nbytes = 0
+    for value in timeframed_data.values():
+        if isinstance(value, dict):
+            nbytes += get_data_nbytes(value)
+        else:
+            nbytes += get_nbytes([getattr(value, field) for field in ohlcv_fields])
+
+    return nbytes
+
+
+def get_column_nbytes(n_bars: int) -> int:
+    '''Estimated bytes a simulated trial column of n_bars holds'''
+    return n_bars * (signal_bytes_per_bar + portfolio_bytes_per_bar)
+
+
+def free_memory():
+    '''Drops everything this process can rebuild: indicator runs and shaped outputs and vbt's caches'''
+    clear_indicator_run_cache()
+    vbt.clear_cache()
+    gc.collect()
+
+
+class RequestMemory:
+    '''Memory accounting of one request in one process: the bytes it holds per category (data, indicator_cache,
+    signals, portfolios), the peak resident set size seen at its checkpoints and how it degraded to stay within
+    budget_bytes. Past soft_limit_bytes caches are evicted and trial batches shrunk, past budget_bytes the
+    request fails with MemoryBudgetExceededError. A None budget only measures.
+    The budget is checked against the process's resident set size, except in a shared_process serving other
+    requests too (the API process), where only the bytes the request accounted are its own and the process's
+    caches are never evicted for it'''
+
+    def __init__(self, budget_bytes: int = None, soft_limit_bytes: int = None, shared_process: bool = False):
+        self.budget_bytes = budget_bytes
+        self.soft_limit_bytes = soft_limit_bytes if soft_limit_bytes is not None else budget_bytes
+        self.shared_process = shared_process
+        self.held_bytes = {}
+        self.peak_held_bytes = {}
+        self.peak_rss_bytes = 0
+        self.cache_evictions = 0
+        self.evicted_bytes = 0
+        self.min_batch_size = None
+
+    def account(self, category: str, nbytes: int):
+        '''Sets the bytes the request currently holds in category'''
+        self.held_bytes[category] = int(nbytes)
+        self.peak_held_bytes[category] = max(self.peak_held_bytes.get(category, 0), int(nbytes))
+
+    def sample_rss(self) -> int:
+        rss_bytes = get_rss_bytes()
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss_bytes)
+        self.account('indicator_cache', get_indicator_run_cache_stats()['bytes'])
+
+        return rss_bytes
+
+    def get_used_bytes(self) -> int:
+        '''The bytes checked against the budget'''
+        rss_bytes = self.sample_rss()
+        if not self.shared_process:
+            return rss_bytes
+
+        # the indicator cache is shared with the process's other requests
+        return sum(nbytes for category, nbytes in self.held_bytes.items() if category != 'indicator_cache')
+
+    def get_held_summary(self) -> str:
+        return ', '.join(f'{category} {get_mib(nbytes)}' for category, nbytes in self.held_bytes.items())
+
+    def ensure_headroom(self, stage: str, nbytes: int = 0):
+        '''Makes sure nbytes more fit in the budget, evicting caches past the soft limit, raises
+        MemoryBudgetExceededError when they still don't'''
+        used_bytes = self.get_used_bytes()
+        if self.budget_bytes is None or used_bytes + nbytes <= self.soft_limit_bytes:
+            return
+
+        if not self.shared_process:
+            free_memory()
+            freed_bytes = self.get_used_bytes()
+            self.cache_evictions += 1
+            self.evicted_bytes += max(0, used_bytes - freed_bytes)
+            used_bytes = freed_bytes
+
+        if used_bytes + nbytes > self.budget_bytes:
+            raise MemoryBudgetExceededError(
+                f'Request exceeds the memory budget of {get_mib(self.budget_bytes)} at {stage}: '
+                f'{get_mib(used_bytes)} used after evicting caches and {get_mib(nbytes)} more needed '
+                f'(holding {self.get_held_summary()}). Shorten the testing period, use fewer indicators or '
+                f'coarser timeframes, or lower trial_batch_size')
+
+    def get_batch_size(self, stage: str, batch_size: int, column_nbytes: int) -> int:
+        '''The largest batch, up to batch_size, whose columns of column_nbytes each fit under the soft limit,
+        at least one column. A column that doesn't fit the budget raises MemoryBudgetExceededError'''
+        self.ensure_headroom(stage, column_nbytes)
+        if self.budget_bytes is None:
+            return batch_size
+
+        headroom_bytes = self.soft_limit_bytes - self.get_used_bytes()
+        fitting_batch_size = int(max(1, min(batch_size, headroom_bytes // max(column_nbytes, 1))))
+        if fitting_batch_size < batch_size:
+            self.min_batch_size = min(self.min_batch_size or batch_size, fitting_batch_size)
+
+        return fitting_batch_size
+
+    def get_worker_budget_bytes(self, n_workers: int):
+        '''Splits what the request has left of its budget between the n_workers processes it starts, so the
+        request as a whole stays within budget_bytes. None without a budget'''
+        if self.budget_bytes is None:
+            return None
+
+        return max(0, self.budget_bytes - self.get_used_bytes()) // n_workers
+
+    def merge(self, memory_dict: dict):
+        '''Adds a worker process's accounting, see to_dict, peaks are the largest of any process'''
+        self.peak_rss_bytes = max(self.peak_rss_bytes, memory_dict['peak_rss_bytes'])
+        for category, nbytes in memory_dict['peak_held_bytes'].items():
+            self.peak_held_bytes[category] = max(self.peak_held_bytes.get(category, 0), nbytes)
+        self.cache_evictions += memory_dict['cache_evictions']
+        self.evicted_bytes += memory_dict['evicted_bytes']
+        if memory_dict['min_batch_size'] is not None:
+            self.min_batch_size = min(self.min_batch_size or memory_dict['min_batch_size'],
+                                      memory_dict['min_batch_size'])
+
+    def to_dict(self) -> dict:
+        '''Peak usage and degradation report, min_batch_size is None when no batch was shrunk'''
+        return {'budget_bytes': self.budget_bytes,
+                'peak_rss_bytes': self.peak_rss_bytes,
+                'peak_held_bytes': dict(self.peak_held_bytes),
+                'cache_evictions': self.cache_evictions,
+                'evicted_bytes': self.evicted_bytes,
+                'min_batch_size': self.min_batch_size}
+
+
+@contextmanager
+def request_memory(budget_bytes: int = None, shared_process: bool = False):
+    '''Accounts the block's memory against budget_bytes, BaseConfig.memory_budget_bytes by default, yielding its
+    RequestMemory. Worker processes pass their share, see get_worker_memory_budget'''
+    budget_bytes = BaseConfig.memory_budget_bytes if budget_bytes is None else budget_bytes
+    soft_limit_bytes = int(budget_bytes * BaseConfig.memory_soft_limit_fraction) if budget_bytes is not None else None
+    memory = RequestMemory(budget_bytes, soft_limit_bytes, shared_process=shared_process)
+    token = current_memory.set(memory)
+    memory.sample_rss()
+    try:
+        yield memory
+    finally:
+        memory.sample_rss()
+        current_memory.reset(token)
+
+
+def account_memory(category: str, nbytes: int):
+    memory = current_memory.get()
+    if memory is not None:
+        memory.account(category, nbytes)
+
+
+def account_trial_columns(n_columns: int, n_bars: int):
+    '''Accounts the estimated signals and portfolios of n_columns simulated trial columns of n_bars'''
+    account_memory('signals', n_columns * n_bars * signal_bytes_per_bar)
+    account_memory('portfolios', n_columns * n_bars * portfolio_bytes_per_bar)
+
+
+def ensure_memory_headroom(stage: str, nbytes: int = 0):
+    '''See RequestMemory.ensure_headroom, a no-op outside requests'''
+    memory = current_memory.get()
+    if memory is not None:
+        memory.ensure_headroom(stage, nbytes)
+
+
+def get_memory_batch_size(stage: str, batch_size: int, n_bars: int) -> int:
+    '''See RequestMemory.get_batch_size for columns of n_bars, batch_size outside requests'''
+    memory = current_memory.get()
+    return batch_size if memory is None else memory.get_batch_size(stage, batch_size, get_column_nbytes(n_bars))
+
+
+def get_worker_memory_budget(n_workers: int):
+    '''Budget of each of the n_workers processes the current request starts, see
+    RequestMemory.get_worker_budget_bytes, an even split of BaseConfig.memory_budget_bytes outside requests'''
+    memory = current_memory.get()
+    if memory is not None:
+        return memory.get_worker_budget_bytes(n_workers)
+
+    budget_bytes = BaseConfig.memory_budget_bytes
+    return budget_bytes // n_workers if budget_bytes is not None else None
+
+
+def merge_worker_memory(memory_dict: dict):
+    '''Adds a worker process's accounting, see RequestMemory.to_dict, to the current request's'''
+    memory = current_memory.get()
+    if memory is not None and memory_dict is not None:
+        memory.merge(memory_dict)
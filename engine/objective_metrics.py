@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from numba import njit, prange
+
+year_timedelta = pd.Timedelta(days=365)
+
+
+@njit(cache=True)
+def get_mean_std_nb(returns):
+    '''NaN skipping mean and sample (ddof=1) standard deviation'''
+    count = 0
+    total = 0.
+    for value in returns:
+        if not np.isnan(value):
+            count += 1
+            total += value
+    if count < 2:
+        return np.nan, np.nan
+
+    mean = total / count
+    squared_deviations = 0.
+    for value in returns:
+        if not np.isnan(value):
+            squared_deviations += (value - mean) ** 2
+
+    return mean, np.sqrt(squared_deviations / (count - 1))
+
+
+@njit(cache=True)
+def get_equity_stats_nb(returns):
+    '''Compounded total return, number of returns and max drawdown (a positive fraction) of a returns column'''
+    count = 0
+    equity = 1.
+    peak = 1.
+    max_drawdown = 0.
+    for value in returns:
+        if np.isnan(value):
+            continue
+        count += 1
+        equity *= 1 + value
+        peak = max(peak, equity)
+        max_drawdown = max(max_drawdown, 1 - equity / peak)
+
+    return equity - 1, count, max_drawdown
+
+
+@njit(cache=True, parallel=True)
+def sharpe_ratio_nb(returns, ann_factor):
+    out = np.empty(returns.shape[1])
+    for col in prange(returns.shape[1]):
+        mean, std = get_mean_std_nb(returns[:, col])
+        out[col] = mean / std * np.sqrt(ann_factor) if std > 0 else np.nan
+
+    return out
+
+
+@njit(cache=True, parallel=True)
+def sortino_ratio_nb(returns, ann_factor):
+    out = np.empty(returns.shape[1])
+    for col in prange(returns.shape[1]):
+        count = 0
+        total = 0.
+        downside_squares = 0.
+        for value in returns[:, col]:
+            if not np.isnan(value):
+                count += 1
+                total += value
+                downside_squares += min(value, 0.) ** 2
+
+        if count and downside_squares > 0:
+            out[col] = total / count / np.sqrt(downside_squares / count) * np.sqrt(ann_factor)
+        else:
+            out[col] = np.nan
+
+    return out
+
+
+@njit(cache=True, parallel=True)
+def calmar_ratio_nb(returns, ann_factor):
+    out = np.empty(returns.shape[1])
+    for col in prange(returns.shape[1]):
+        total_return, count, max_drawdown = get_equity_stats_nb(returns[:, col])
+        if count and max_drawdown > 0 and total_return > -1:
+            out[col] = ((1 + total_return) ** (ann_factor / count) - 1) / max_drawdown
+        else:
+            out[col] = np.nan
+
+    return out
+
+
+@njit(cache=True, parallel=True)
+def omega_ratio_nb(returns, ann_factor):
+    out = np.empty(returns.shape[1])
+    for col in prange(returns.shape[1]):
+        gains = 0.
+        losses = 0.
+        for value in returns[:, col]:
+            if not np.isnan(value):
+                gains += max(value, 0.)
+                losses += max(-value, 0.)
+        out[col] = gains / losses if losses > 0 else np.nan
+
+    return out
+
+
+@njit(cache=True, parallel=True)
+def max_drawdown_nb(returns, ann_factor):
+    out = np.empty(returns.shape[1])
+    for col in prange(returns.shape[1]):
+        out[col] = get_equity_stats_nb(returns[:, col])[2]
+
+    return out
+
+
+@njit(cache=True, parallel=True)
+def total_return_nb(returns, ann_factor):
+    out = np.empty(returns.shape[1])
+    for col in prange(returns.shape[1]):
+        out[col] = get_equity_stats_nb(returns[:, col])[0]
+
+    return out
+
+
+# every objective get_direction_from_objective_value accepts, computed on a (bars, columns) returns array
+objective_metric_kernels = {'sharpe_ratio': sharpe_ratio_nb,
+                            'sortino': sortino_ratio_nb,
+                            'calmar': calmar_ratio_nb,
+                            'omega': omega_ratio_nb,
+                            'max_drawdown': max_drawdown_nb,
+                            'total_return': total_return_nb}
+
+
+def get_ann_factor(pf) -> float:
+    '''Periods per year of the portfolio's frequency, 365 day years like vbt's default year_freq'''
+    return year_timedelta / pd.Timedelta(pf.wrapper.freq)
+
+
+def get_returns_array(pf) -> np.ndarray:
+    returns = np.asarray(pf.returns, dtype=np.float64)
+    # column major, each kernel walks one column at a time
+    return np.asfortranarray(returns.reshape(len(returns), -1))
+
+
+def get_objective_metric(returns: np.ndarray, objective_value: str, ann_factor: float) -> np.ndarray:
+    '''Returns the objective for every column of returns. max_drawdown is a positive fraction, so minimizing it
+    favours the shallowest drawdown'''
+    if objective_value not in objective_metric_kernels:
+        raise ValueError(f'Invalid objective value: {objective_value}')
+
+    return objective_metric_kernels[objective_value](returns, ann_factor)
@@ -1,3 +1,23 @@
+import dataclasses
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import optuna
+from optuna.storages import JournalStorage, JournalFileStorage
+from optuna.trial import TrialState
+
+from base_config import BaseConfig
+
+try:
+    import fcntl
+except ImportError:  # windows, studies are only leased between the threads of a process
+    fcntl = None
+
+study_locks = {}
+study_locks_lock = threading.Lock()
 
 
 def get_suggested_value(trial, suggestion_key: str, value: list):
@@ -24,4 +44,104 @@ def get_suggested_value(trial, suggestion_key: str, value: list):
             raise ValueError(f'Invalid length of value: {value}')
 
     else:
-        raise ValueError(f'Invalid value_type: {value_type}')
\ No newline at end of file
+        raise ValueError(f'Invalid value_type: {value_type}')
+
+def get_request_hash(bt_request, exclude: tuple = (), extra: dict = None) -> str:
+    '''Returns a canonical hash of the request, independent of key order and of dataclass vs dict members'''
+    request_dict = dataclasses.asdict(bt_request)
+    for key in exclude:
+        request_dict.pop(key, None)
+
+    if extra:
+        request_dict['__extra__'] = extra
+
+    canonical_json = json.dumps(request_dict, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(canonical_json.encode('utf-8')).hexdigest()[:32]
+
+
+def get_study_storage_path(request_hash: str) -> Path:
+    studies_folder = BaseConfig.resources.studies
+    studies_folder.mkdir(parents=True, exist_ok=True)
+
+    return studies_folder / f'{request_hash}.log'
+
+
+def get_study_storage(storage_path: Path) -> JournalStorage:
+    '''Journal file storage, safe for several processes optimizing the same study'''
+    return JournalStorage(JournalFileStorage(str(storage_path)))
+
+
+def get_study_sampler(bt_request, worker_index: int = 0) -> optuna.samplers.BaseSampler:
+    '''TPE with constant liar so concurrent workers don't all sample around the same running trials'''
+    seed = None if bt_request.seed is None else bt_request.seed + worker_index
+    return optuna.samplers.TPESampler(constant_liar=True, seed=seed)
+
+
+def get_study_pruner(bt_request) -> optuna.pruners.BasePruner:
+    '''Pruner judging the intermediate values trials report once per pruning segment'''
+    if not bt_request.pruner:
+        return optuna.pruners.NopPruner()
+    elif bt_request.pruner == 'median':
+        return optuna.pruners.MedianPruner(n_startup_trials=BaseConfig.pruner_startup_trials)
+    elif bt_request.pruner == 'successive_halving':
+        return optuna.pruners.SuccessiveHalvingPruner()
+    elif bt_request.pruner == 'hyperband':
+        return optuna.pruners.HyperbandPruner(min_resource=1, max_resource=bt_request.pruning_segments - 1)
+    else:
+        raise ValueError(f'Invalid pruner: {bt_request.pruner}')
+
+
+def get_persistent_study(study_name: str, storage_path: Path, direction: str, bt_request,
+                         worker_index: int = 0) -> optuna.Study:
+    '''Creates the study, or loads it with its completed trials if it was already started'''
+    return optuna.create_study(study_name=study_name,
+                               storage=get_study_storage(storage_path),
+                               sampler=get_study_sampler(bt_request, worker_index),
+                               pruner=get_study_pruner(bt_request),
+                               direction=direction,
+                               load_if_exists=True)
+
+
+@contextmanager
+def study_leased(study_name: str, storage_path: Path):
+    '''Held by the attempt running the study's trials, across processes. Another attempt at the same study waits
+    for it instead of failing its running trials and adding trials of its own. The lease of an attempt whose
+    process died is released with it, so once leased every RUNNING trial of the study is stale'''
+    lease_path = Path(storage_path).parent / f'{study_name}.lock'
+    with study_locks_lock:
+        lock = study_locks.setdefault(str(lease_path.resolve()), threading.Lock())
+
+    with lock, open(lease_path, 'a+b') as lease_file:
+        if fcntl is not None:
+            fcntl.flock(lease_file, fcntl.LOCK_EX)
+        yield
+
+
+def fail_stale_running_trials(study: optuna.Study) -> int:
+    '''Marks trials left RUNNING by an earlier attempt whose worker died as FAIL, constant liar TPE would otherwise
+    keep treating them as in flight. Call holding the study's lease, see study_leased, before the attempt's workers
+    start. Returns the number failed'''
+    stale_trials = study.get_trials(deepcopy=False, states=(TrialState.RUNNING,))
+    for trial in stale_trials:
+        study.tell(trial.number, state=TrialState.FAIL)
+
+    return len(stale_trials)
+
+
+def get_n_remaining_trials(study: optuna.Study, n_trials: int) -> int:
+    '''Trials still to run, interrupted (RUNNING/FAIL) trials from earlier attempts are run again'''
+    finished_trials = study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED))
+    return max(n_trials - len(finished_trials), 0)
+
+
+def get_top_trials(study: optuna.Study, k: int) -> list:
+    '''Returns the k best completed trials of the study, best first'''
+    trials = study.get_trials(deepcopy=False, states=(TrialState.COMPLETE,))
+    maximize = study.direction == optuna.study.StudyDirection.MAXIMIZE
+
+    return sorted(trials, key=lambda trial: trial.value, reverse=maximize)[:k]
+
+
+def split_n_trials(n_trials: int, n_workers: int) -> list:
+    '''Spreads n_trials as evenly as possible over n_workers'''
+    return [n_trials // n_workers + (1 if i < n_trials % n_workers else 0) for i in range(n_workers)]
@@ -0,0 +1,106 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from base_config import BaseConfig
+from engine.data.data_manager import convert_ohlcv_to_vbt_data
+
+ohlcv_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# worker side state, filled by the pool initializer
+attached_timeframed_data = {}
+attached_shared_memories = []
+
+
+def create_shared_array(array: np.ndarray) -> shared_memory.SharedMemory:
+    '''Copies array into a new shared memory block'''
+    shared_memory_block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shared_memory_block.buf)[:] = array
+
+    return shared_memory_block
+
+
+def attach_shared_array(name: str, shape: tuple, dtype: str) -> np.ndarray:
+    '''Maps an existing shared memory block as a read only array without copying it'''
+    shared_memory_block = shared_memory.SharedMemory(name=name)
+    attached_shared_memories.append(shared_memory_block)
+
+    array = np.ndarray(shape, dtype=dtype, buffer=shared_memory_block.buf)
+    array.flags.writeable = False
+
+    return array
+
+
+def publish_timeframed_data(timeframed_data: dict, symbol: str) -> tuple:
+    '''Publishes each timeframe's OHLCV values and timestamps to shared memory,
+    returns picklable handles for the workers and the blocks the caller must release'''
+    handles = {}
+    shared_memory_blocks = []
+
+    for timeframe, timeframe_data in timeframed_data.items():
+        values = np.column_stack([np.asarray(getattr(timeframe_data, column.lower()), dtype=np.float64).reshape(-1)
+                                  for column in ohlcv_columns])
+        index = pd.DatetimeIndex(timeframe_data.index)
+        timestamps = index.as_unit('ns').asi8.copy()
+
+        values_block = create_shared_array(values)
+        timestamps_block = create_shared_array(timestamps)
+        shared_memory_blocks.extend([values_block, timestamps_block])
+
+        handles[timeframe] = {'symbol': symbol,
+                              'tz': str(index.tz) if index.tz else None,
+                              'values': (values_block.name, values.shape, values.dtype.str),
+                              'timestamps': (timestamps_block.name, timestamps.shape, timestamps.dtype.str)}
+
+    return handles, shared_memory_blocks
+
+
+def release_shared_memory_blocks(shared_memory_blocks: list):
+    for shared_memory_block in shared_memory_blocks:
+        shared_memory_block.close()
+        shared_memory_block.unlink()
+
+
+@contextmanager
+def shared_timeframed_data(timeframed_data: dict, symbol: str):
+    '''Publishes timeframed_data for the duration of the block and yields the worker handles'''
+    handles, shared_memory_blocks = publish_timeframed_data(timeframed_data, symbol)
+    try:
+        yield handles
+    finally:
+        release_shared_memory_blocks(shared_memory_blocks)
+
+
+def attach_timeframed_data(handles: dict):
+    '''Pool initializer, rebuilds the timeframed vbt data on top of the published shared memory'''
+    attached_timeframed_data.clear()
+
+    for timeframe, handle in handles.items():
+        values = attach_shared_array(*handle['values'])
+        timestamps = attach_shared_array(*handle['timestamps'])
+
+        index = pd.DatetimeIndex(timestamps.view('datetime64[ns]'))
+        if handle['tz']:
+            index = index.tz_localize('UTC').tz_convert(handle['tz'])
+
+        ohlcv_df = pd.DataFrame(values, index=index, columns=ohlcv_columns, copy=False)
+        attached_timeframed_data[timeframe] = convert_ohlcv_to_vbt_data(ohlcv_df, handle['symbol'], tz=handle['tz'])
+
+
+def get_attached_timeframed_data() -> dict:
+    if not attached_timeframed_data:
+        raise ValueError('No timeframed data attached, this must run inside a shared data process pool')
+
+    return attached_timeframed_data
+
+
+def get_shared_data_process_pool(max_workers: int, shared_data_handles: dict) -> ProcessPoolExecutor:
+    '''Returns a process pool whose workers attach the published timeframed data on start up'''
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context(BaseConfig.process_start_method),
+                               initializer=attach_timeframed_data,
+                               initargs=(shared_data_handles,))
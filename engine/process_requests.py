@@ -1,8 +1,6 @@
-import gc
-from datetime import datetime
-from math import isnan
 from collections import defaultdict
-from pathlib import Path
+from dataclasses import replace
+from itertools import repeat
 
 import pandas as pd
 import numpy as np
@@ -10,12 +8,24 @@ import vectorbtpro as vbt
 from sklearn.model_selection import KFold
 
 from backtesting.decorators import std_parameterized
-from engine.data.data_manager import fetch_datas, get_fastest_timeframe_data, reshape_slow_timeframe_data_to_fast
-from engine.optuna_processing import get_suggested_value
-from engine.process_study_result import get_standard_result_from_study, get_html_pf_plot, get_signal_dict_from_pf
+from base_config import BaseConfig
+from engine.cancellation import raise_if_job_cancelled, stop_study_if_job_cancelled
+from engine.objective_metrics import get_objective_metric, get_returns_array, get_ann_factor
+from engine.progress import emit_trial_progress, set_progress_phase
+from engine.tracing import trace_span, request_trace, get_trace_dict, merge_worker_trace
+from engine.memory_budget import request_memory, account_memory, account_trial_columns, ensure_memory_headroom, \
+    get_memory_batch_size, merge_worker_memory, get_column_nbytes, get_data_nbytes, get_worker_memory_budget
+from engine.data.data_manager import fetch_datas, fetch_symbol_datas, get_fastest_timeframe_data, \
+    reshape_slow_timeframe_data_to_fast
+from engine.optuna_processing import get_suggested_value, get_request_hash, get_study_storage_path, \
+    get_persistent_study, get_n_remaining_trials, split_n_trials, get_top_trials, \
+    fail_stale_running_trials, study_leased
+from engine.parallel_processing import shared_timeframed_data, get_shared_data_process_pool, \
+    get_attached_timeframed_data
+from engine.trigger_parsing import get_compiled_trigger
+from engine.process_study_result import get_standard_result_from_study, get_signal_dict_from_pf
 from indicators.indicator_library import indicator_library, get_indicator_key_value, get_indicator_run_results, \
     get_chart_options_value
-from indicators.indicator_run_caching import clear_indicator_run_cache
 from models import BtRequest, StratRun, CvResult, StandardResult
 import optuna
 
@@ -23,104 +33,85 @@ from splitters.splitter_definitions import get_default_splitter
 
 
 def get_live_run_indicators(bt_request, kwargs):
-    live_run_indicators = bt_request.indicators.copy()
-    for rest_indicator in live_run_indicators:
+    live_run_indicators = []
+    for rest_indicator in bt_request.indicators:
         if not rest_indicator.run_kwargs:
+            live_run_indicators.append(rest_indicator)
             continue
 
         rest_indicator_live_run_kwargs = {}
         for key in kwargs:
-            if key.startswith(rest_indicator.alias):
+            if key.startswith(f'{rest_indicator.alias}__'):
                 rest_indicator_live_run_kwargs[key.split('__')[1]] = kwargs[key]
 
-        rest_indicator.run_kwargs = rest_indicator_live_run_kwargs
+        # copy rather than mutate, the request's run_kwargs ranges are needed by every trial
+        live_run_indicators.append(replace(rest_indicator, run_kwargs=rest_indicator_live_run_kwargs))
 
     return live_run_indicators
 
 
-def handle_crossed_operator(operator_string):
-    operator_string = operator_string.replace('(', '( ').replace(')', ' )')
-    split_string = operator_string.split()
-    for i, word in enumerate(split_string):
-        if word == '|>':
-            split_string[i - 1] = 'pd.Series(' + split_string[i - 1] + f').vbt.crossed_above({split_string[i + 1]})'
-            split_string[i] = ''
-            split_string[i + 1] = ''
+def get_trigger_indicator_values(rest_indicators) -> dict:
+    '''Maps each indicator alias to its (default_value, avlbl_values) for trigger compilation'''
+    return {rest_indicator.alias: (get_indicator_key_value(rest_indicator.indicator, 'default_value'),
+                                   get_indicator_key_value(rest_indicator.indicator, 'avlbl_values'))
+            for rest_indicator in rest_indicators}
 
-        elif word == '<|':
-            split_string[i - 1] = 'pd.Series(' + split_string[i - 1] + f').vbt.crossed_below({split_string[i + 1]})'
-            split_string[i] = ''
-            split_string[i + 1] = ''
 
-    return ' '.join(split_string)
+def get_trigger_parameter_names(bt_request) -> set:
+    '''Returns every trial kwarg name a trigger may reference as a scalar'''
+    parameter_names = set(bt_request.custom_ranges or {})
+    for rest_indicator in bt_request.indicators:
+        for key in rest_indicator.run_kwargs or {}:
+            parameter_names.add(f'{rest_indicator.alias}__{key}')
 
+    return parameter_names | {'sl_stop', 'tp_stop', 'fee', 'slippage'}
 
-def format_action_string(action_string: str, indicator_aliases: list, indicator_run_results: dict):
-    '''Converts user-friendly action string to one that can be evaluated by eval()'''
 
-    action_string = action_string.replace('and', '&').replace('or', '|').replace('not', '~')
+def get_compiled_trigger_pair(trigger_pair, bt_request) -> tuple:
+    '''Returns the compiled (entry, exit) triggers, parsed once and then served from cache'''
+    indicator_values = get_trigger_indicator_values(bt_request.indicators)
+    parameter_names = get_trigger_parameter_names(bt_request)
 
-    fixed_action_string_words = []
+    return (get_compiled_trigger(trigger_pair.entry, indicator_values, parameter_names),
+            get_compiled_trigger(trigger_pair.exit, indicator_values, parameter_names))
 
-    for word in action_string.split():
-        left_brack = False
-        right_brack = False
-        if '(' in word:
-            left_brack = True
-        if ')' in word:
-            right_brack = True
 
-        word = word.replace('(', '').replace(')', '')
+def get_referenced_run_values(compiled_triggers, all_values: bool = False) -> dict:
+    '''Maps each indicator alias the triggers reference to the run values they use, None meaning all values'''
+    referenced_run_values = defaultdict(set)
+    for compiled_trigger in compiled_triggers:
+        for operand_key in compiled_trigger.operand_keys:
+            if '.' in operand_key:
+                alias, run_value = operand_key.split('.')
+                referenced_run_values[alias].add(run_value)
 
-        process, process_len = None, None
-        if '#' in word:
-            word, whole_process = word.split('#')
+    return {alias: None if all_values else sorted(run_values) for alias, run_values in referenced_run_values.items()}
 
-            if '.' not in whole_process:
-                raise ValueError('process not valid, validation at model level failed')
 
-            process, process_len = whole_process.split('.')
-
-        if word in indicator_run_results:
-            fixed_word = f'indicator_run_results["{word}"]'
-            if process and process_len:
-                fixed_word = f'np.array(pd.Series({fixed_word}).{process}({process_len}))'
-
-        elif word in indicator_aliases and '.' not in word:  # then this must intend to reference the default value
-            for key in indicator_run_results:
-                if word in key:
-                    fixed_word = f'indicator_run_results["{key}"]'
-                    if process and process_len:
-                        fixed_word = f'np.array(pd.Series({fixed_word}).{process}({process_len}))'
-                    break
-        else:
-            fixed_word = word
-
-        if left_brack:
-            fixed_word = '(' + fixed_word
-        if right_brack:
-            fixed_word = fixed_word + ')'
-
-        fixed_action_string_words.append(fixed_word)
-
-    fixed_action_string = ' '.join(fixed_action_string_words)
-    return fixed_action_string
-
-
-def get_timeframed_run_results(timeframed_data, rest_indicators):
+def get_timeframed_run_results(timeframed_data, rest_indicators, grid_rest_indicators=None,
+                               referenced_run_values: dict = None):
+    '''grid_rest_indicators are the request's indicators with their run_kwargs ranges, when given the
+    integer stepped ones are served from a precomputed parameter grid. With referenced_run_values only the
+    referenced aliases are run and only their referenced outputs are built'''
     timeframed_run_results = defaultdict(dict)
     fastest_timeframe_data, fastest_timeframe = get_fastest_timeframe_data(timeframed_data)
+    grid_rest_indicators = {rest_indicator.alias: rest_indicator for rest_indicator in grid_rest_indicators or []}
 
     for timeframe, timeframe_data in timeframed_data.items():
         for rest_indicator in rest_indicators:
             if rest_indicator.timeframe != timeframe:
                 continue
 
+            if referenced_run_values is not None and rest_indicator.alias not in referenced_run_values:
+                continue
+
             run_results = get_indicator_run_results(fastest_timeframe_data=fastest_timeframe_data,
                                                     fastest_timeframe=fastest_timeframe,
                                                     timeframe_data=timeframe_data,
                                                     rest_indicator=rest_indicator,
-                                                    run_kwargs=rest_indicator.run_kwargs)
+                                                    run_kwargs=rest_indicator.run_kwargs,
+                                                    grid_rest_indicator=grid_rest_indicators.get(rest_indicator.alias),
+                                                    run_values=(referenced_run_values or {}).get(rest_indicator.alias))
 
             timeframed_run_results[timeframe][rest_indicator.alias] = run_results
 
@@ -163,21 +154,329 @@ def get_trial_kwargs(trial, kwargs_to_add, bt_request):
     return trial_kwargs
 
 
+def get_kwargs_to_add(bt_request) -> list:
+    renamed_indicators = {}
+
+    for rest_indicator in bt_request.indicators:
+        if not rest_indicator.run_kwargs:
+            continue
+        for key, value in rest_indicator.run_kwargs.items():
+            renamed_indicators[f'{rest_indicator.alias}__{key}'] = value
+
+    kwargs_to_add = [renamed_indicators]
+    kwargs_to_add.append(bt_request.custom_ranges)
+
+    return kwargs_to_add
+
+
+def get_trial_objective_values(pf, objective_value) -> np.ndarray:
+    '''Returns one objective value per portfolio column straight from the returns array with the jitted kernels
+    of engine.objective_metrics'''
+    return get_returns_objective_values(get_returns_array(pf), objective_value, get_ann_factor(pf))
+
+
+def get_returns_objective_values(returns: np.ndarray, objective_value, ann_factor: float) -> np.ndarray:
+    '''Objective value per returns column, columns without returns variance (a NaN sharpe ratio, e.g. no trades)
+    or with a non finite objective score the worst value for the study direction'''
+    with trace_span('objective'):
+        objective_values = get_objective_metric(returns, objective_value, ann_factor)
+        sharpe_ratios = (objective_values if objective_value == 'sharpe_ratio'
+                         else get_objective_metric(returns, 'sharpe_ratio', ann_factor))
+
+    worst_value = -100000 if get_direction_from_objective_value(objective_value) == 'maximize' else 100000
+    return np.where(np.isnan(sharpe_ratios) | ~np.isfinite(objective_values), worst_value, objective_values)
+
+
+def get_n_bar_columns(action_data, bt_request) -> int:
+    '''Bars of the fastest timeframe times symbols, the bars a trial's signals and portfolio span'''
+    timeframed_data = action_data[bt_request.get_symbols()[0]] if bt_request.is_multi_symbol() else action_data
+    fastest_timeframe_data, _ = get_fastest_timeframe_data(timeframed_data)
+
+    return len(fastest_timeframe_data.index) * len(bt_request.get_symbols())
+
+
+def std_objective(trial, action_data, bt_request, kwargs_to_add):
+    n_bars = get_n_bar_columns(action_data, bt_request)
+    ensure_memory_headroom('trial', get_column_nbytes(n_bars))
+    account_trial_columns(1, n_bars)
+    run_kwargs = get_trial_kwargs(trial=trial, kwargs_to_add=kwargs_to_add, bt_request=bt_request)
+
+    if bt_request.pruner:
+        fastest_timeframed_data, fastest_timeframe = get_fastest_timeframe_data(action_data)
+        entries, exits, _ = get_signals_and_strat_runs(action_data, bt_request=bt_request, add_strat_runs=False,
+                                                       **run_kwargs)
+        objective_values, pruned = get_segmented_objective_values([trial], fastest_timeframed_data,
+                                                                  fastest_timeframe, np.asarray(entries).reshape(-1, 1),
+                                                                  np.asarray(exits).reshape(-1, 1), bt_request)
+        if pruned[0]:
+            raise optuna.TrialPruned()
+
+        return objective_values[0]
+
+    pf, _ = get_pf_and_strat_runs(action_data, bt_request=bt_request, add_strat_runs=False, **run_kwargs)
+    objective_values = get_trial_objective_values(pf, bt_request.objective_value)
+    if bt_request.is_multi_symbol():
+        return get_symbols_objective_value(trial, objective_values, bt_request)
+
+    return objective_values[0]
+
+
+def get_symbols_objective_value(trial, symbol_objective_values: np.ndarray, bt_request) -> float:
+    '''Records each symbol's objective value on the trial and returns their mean, the value the study optimizes'''
+    trial.set_user_attr('symbol_values', {symbol: float(symbol_objective_value) for symbol, symbol_objective_value
+                                          in zip(bt_request.get_symbols(), symbol_objective_values)})
+
+    return float(np.mean(symbol_objective_values))
+
+
+def get_multi_symbol_batch_objective_values(trials, symbol_datas, bt_request, kwargs_to_add) -> np.ndarray:
+    '''Simulates every (trial, symbol) pair of the batch as the columns of a single portfolio and returns
+    each trial's symbols objective value'''
+    close, fastest_timeframe = get_multi_symbol_close(symbol_datas)
+
+    batch_entries, batch_exits = [], []
+    for trial in trials:
+        run_kwargs = get_trial_kwargs(trial=trial, kwargs_to_add=kwargs_to_add, bt_request=bt_request)
+        entries, exits, _ = get_multi_symbol_signals_and_strat_runs(symbol_datas, bt_request=bt_request,
+                                                                    add_strat_runs=False, **run_kwargs)
+        batch_entries.append(entries)
+        batch_exits.append(exits)
+
+    keys = pd.Index([trial.number for trial in trials], name='trial')
+    with trace_span('simulate'):
+        pf = vbt.Portfolio.from_signals(close=pd.concat([close] * len(trials), axis=1, keys=keys),
+                                        entries=pd.concat(batch_entries, axis=1, keys=keys),
+                                        exits=pd.concat(batch_exits, axis=1, keys=keys),
+                                        freq=fastest_timeframe)
+    # columns are trial major, one row of symbol values per trial
+    symbol_objective_values = get_trial_objective_values(pf, bt_request.objective_value).reshape(len(trials), -1)
+
+    return np.array([get_symbols_objective_value(trial, trial_symbol_values, bt_request)
+                     for trial, trial_symbol_values in zip(trials, symbol_objective_values)])
+
+
+def get_segmented_objective_values(trials, fastest_timeframed_data, fastest_timeframe, entries: np.ndarray,
+                                   exits: np.ndarray, bt_request) -> tuple:
+    '''Simulates the (bars, trials) signals over pruning_segments contiguous segments, reporting each trial's
+    objective on the bars simulated so far and dropping the trials its pruner stops from later segments.
+    Every segment starts from the cash and position the previous one ended with, valued at its last close,
+    so a trial that is never pruned scores exactly as a single full period simulation.
+    Returns the final objective values, NaN for pruned trials, and the pruned mask'''
+    n_bars, n_columns = entries.shape
+    segment_bounds = np.linspace(0, n_bars, bt_request.pruning_segments + 1).astype(int)
+    close = np.asarray(fastest_timeframed_data.close, dtype=np.float64).reshape(-1)
+
+    returns = np.full((n_bars, n_columns), np.nan)
+    pruned = np.zeros(n_columns, dtype=bool)
+    objective_values = np.full(n_columns, np.nan)
+    init_cash = np.full(n_columns, np.nan)
+    init_position = np.zeros(n_columns)
+    ann_factor = None
+
+    for step, (start, end) in enumerate(zip(segment_bounds[:-1], segment_bounds[1:])):
+        columns = np.flatnonzero(~pruned)
+        segment_data = fastest_timeframed_data.iloc[start:end]
+        segment_kwargs = {}
+        if step:
+            segment_kwargs = dict(init_cash=init_cash[columns], init_position=init_position[columns],
+                                  init_price=np.full(len(columns), close[start - 1]))
+
+        with trace_span('simulate'):
+            pf = vbt.Portfolio.from_signals(segment_data,
+                                            entries=pd.DataFrame(entries[start:end, columns], index=segment_data.index),
+                                            exits=pd.DataFrame(exits[start:end, columns], index=segment_data.index),
+                                            freq=fastest_timeframe, **segment_kwargs)
+
+        returns[start:end, columns] = get_returns_array(pf)
+        init_cash[columns] = np.asarray(pf.cash, dtype=np.float64).reshape(end - start, -1)[-1]
+        init_position[columns] = np.asarray(pf.assets, dtype=np.float64).reshape(end - start, -1)[-1]
+        ann_factor = ann_factor or get_ann_factor(pf)
+
+        step_values = get_returns_objective_values(np.asfortranarray(returns[:end, columns]),
+                                                   bt_request.objective_value, ann_factor)
+        if end == n_bars:
+            objective_values[columns] = step_values
+            break
+
+        for column, step_value in zip(columns, step_values):
+            trials[column].report(float(step_value), step=step)
+            pruned[column] = trials[column].should_prune()
+
+        if pruned.all():
+            break
+
+    return objective_values, pruned
+
+
+def get_batch_objective_values(trials, action_data, bt_request, kwargs_to_add) -> tuple:
+    '''Simulates the batch's trials as the columns of a single portfolio, segment by segment when the request
+    prunes. Returns the objective values and the pruned mask'''
+    fastest_timeframed_data, fastest_timeframe = get_fastest_timeframe_data(action_data)
+
+    batch_entries, batch_exits = [], []
+    for trial in trials:
+        run_kwargs = get_trial_kwargs(trial=trial, kwargs_to_add=kwargs_to_add, bt_request=bt_request)
+        entries, exits, _ = get_signals_and_strat_runs(action_data, bt_request=bt_request,
+                                                       add_strat_runs=False, **run_kwargs)
+        batch_entries.append(entries)
+        batch_exits.append(exits)
+
+    columns = pd.Index([trial.number for trial in trials], name='trial')
+    entries = pd.DataFrame(np.column_stack(batch_entries), index=fastest_timeframed_data.index, columns=columns)
+    exits = pd.DataFrame(np.column_stack(batch_exits), index=fastest_timeframed_data.index, columns=columns)
+
+    if bt_request.pruner:
+        return get_segmented_objective_values(trials, fastest_timeframed_data, fastest_timeframe,
+                                              entries.to_numpy(), exits.to_numpy(), bt_request)
+
+    with trace_span('simulate'):
+        pf = vbt.Portfolio.from_signals(fastest_timeframed_data, entries=entries, exits=exits,
+                                        freq=fastest_timeframe)
+
+    return get_trial_objective_values(pf, bt_request.objective_value), np.zeros(len(trials), dtype=bool)
+
+
+def run_batched_trials(study, action_data, bt_request, kwargs_to_add, n_trials):
+    '''Asks trial_batch_size trials at a time, fewer when the memory budget runs short, and simulates them as the
+    columns of a single portfolio'''
+    n_bars = get_n_bar_columns(action_data, bt_request)
+    trials_left = n_trials
+    while trials_left > 0:
+        raise_if_job_cancelled()
+        batch_size = get_memory_batch_size('trial_batch', bt_request.trial_batch_size, n_bars)
+        trials = [study.ask() for _ in range(min(batch_size, trials_left))]
+        trials_left -= len(trials)
+        account_trial_columns(len(trials), n_bars)
+
+        try:
+            if bt_request.is_multi_symbol():
+                objective_values = get_multi_symbol_batch_objective_values(trials, action_data, bt_request,
+                                                                           kwargs_to_add)
+                pruned = np.zeros(len(trials), dtype=bool)
+            else:
+                objective_values, pruned = get_batch_objective_values(trials, action_data, bt_request,
+                                                                      kwargs_to_add)
+        except Exception:
+            for trial in trials:
+                study.tell(trial, state=optuna.trial.TrialState.FAIL)
+            raise
+
+        for i, trial in enumerate(trials):
+            if pruned[i]:
+                frozen_trial = study.tell(trial, state=optuna.trial.TrialState.PRUNED)
+            else:
+                frozen_trial = study.tell(trial, float(objective_values[i]))
+            emit_trial_progress(study, frozen_trial)
+
+
+def get_top_trial_runs(study, timeframed_data, bt_request, kwargs_to_add) -> list:
+    '''Re-simulates the keep_top_k best trials from their params, trials only keep params and objective values.
+    Simulations are deterministic so each portfolio is the one its trial was scored on'''
+    n_bars = get_n_bar_columns(timeframed_data, bt_request)
+    top_trial_runs = []
+    for trial in get_top_trials(study, bt_request.keep_top_k):
+        ensure_memory_headroom('top_trials', get_column_nbytes(n_bars))
+        account_trial_columns(len(top_trial_runs) + 1, n_bars)
+        run_kwargs = get_params_run_kwargs(trial.params, kwargs_to_add, bt_request)
+        pf, strat_runs = get_pf_and_strat_runs(timeframed_data, bt_request=bt_request, **run_kwargs)
+        top_trial_runs.append({'number': trial.number, 'params': trial.params, 'value': trial.value, 'pf': pf,
+                               'strat_runs': strat_runs, 'symbol_values': trial.user_attrs.get('symbol_values')})
+
+    return top_trial_runs
+
+
+def get_params_run_kwargs(params: dict, kwargs_to_add, bt_request) -> dict:
+    '''Rebuilds the full run kwargs of a finished trial, fixed values included, from its suggested params'''
+    return get_trial_kwargs(trial=optuna.trial.FixedTrial(params), kwargs_to_add=kwargs_to_add, bt_request=bt_request)
+
+
+def optimize_study(study, action_data, bt_request, kwargs_to_add, n_trials):
+    '''Adds n_trials to the study, raising JobCancelledError at the next batch or trial once its job is cancelled.
+    Finished trials stay in the persistent study, so resubmitting the job resumes it'''
+    if n_trials <= 0:
+        return
+
+    raise_if_job_cancelled()
+
+    if bt_request.trial_batch_size > 1:
+        run_batched_trials(study, action_data=action_data, bt_request=bt_request, kwargs_to_add=kwargs_to_add,
+                           n_trials=n_trials)
+        return
+
+    study.optimize(lambda trial: std_objective(trial, action_data=action_data, bt_request=bt_request,
+                                               kwargs_to_add=kwargs_to_add),
+                   n_trials=n_trials, callbacks=[stop_study_if_job_cancelled, emit_trial_progress])
+    raise_if_job_cancelled()
+
+
+def optimize_study_in_worker(study_name, storage_path, bt_request, kwargs_to_add, n_trials, worker_index,
+                            memory_budget_bytes: int = None):
+    '''Pool entry point, adds n_trials to the shared persistent study using the attached timeframed data within
+    the worker's share of the request's memory budget. Returns the worker's trace and memory accounting for the
+    request's'''
+    with request_trace('study_worker') as trace, request_memory(memory_budget_bytes) as memory:
+        study_direction = get_direction_from_objective_value(bt_request.objective_value)
+        study = get_persistent_study(study_name, storage_path=storage_path, direction=study_direction,
+                                     bt_request=bt_request, worker_index=worker_index)
+
+        optimize_study(study, action_data=get_attached_timeframed_data(), bt_request=bt_request,
+                       kwargs_to_add=kwargs_to_add, n_trials=n_trials)
+
+    return get_trace_dict(trace), memory.to_dict()
+
+
+def run_persistent_study(study_name, storage_path, timeframed_data, bt_request, kwargs_to_add,
+                         n_jobs: int = 1) -> optuna.Study:
+    '''Runs the trials the persistent study is still missing, spread over n_jobs worker processes. A concurrent
+    run of the same study waits for this one and then only runs what is still missing'''
+    study_direction = get_direction_from_objective_value(bt_request.objective_value)
+    with study_leased(study_name, storage_path):
+        study = get_persistent_study(study_name, storage_path=storage_path, direction=study_direction,
+                                     bt_request=bt_request)
+        fail_stale_running_trials(study)
+
+        n_trials = get_n_remaining_trials(study, bt_request.n_trials)
+        n_jobs = min(n_jobs, n_trials)
+        # shared memory publishes a single symbol's timeframes, multi symbol studies run in process
+        if n_jobs <= 1 or bt_request.is_multi_symbol():
+            optimize_study(study, action_data=timeframed_data, bt_request=bt_request, kwargs_to_add=kwargs_to_add,
+                           n_trials=n_trials)
+            return study
+
+        with shared_timeframed_data(timeframed_data, symbol=bt_request.symbol) as shared_data_handles:
+            memory_budget_bytes = get_worker_memory_budget(n_jobs)
+            with get_shared_data_process_pool(n_jobs, shared_data_handles) as executor:
+                futures = [executor.submit(optimize_study_in_worker, study_name, storage_path, bt_request,
+                                           kwargs_to_add, worker_n_trials, worker_index, memory_budget_bytes)
+                           for worker_index, worker_n_trials in enumerate(split_n_trials(n_trials, n_jobs))]
+                for future in futures:
+                    trace_dict, memory_dict = future.result()
+                    merge_worker_trace(trace_dict)
+                    merge_worker_memory(memory_dict)
+
+    return study
+
+
+def get_study_request_hash(bt_request, timeframed_data) -> str:
+    '''Key for the request's studies, only fields that change trial values count and
+    open ended testing periods are also keyed by their last bar so new data starts a new study.
+    n_trials and trial_batch_size only set how much work runs, a request raising n_trials extends the stored study'''
+    extra = None
+    if not bt_request.testing_period.end:
+        if bt_request.is_multi_symbol():
+            timeframed_data = timeframed_data[bt_request.get_symbols()[0]]
+        fastest_timeframe_data, _ = get_fastest_timeframe_data(timeframed_data)
+        extra = {'last_bar': str(fastest_timeframe_data.index[-1])}
+
+    return get_request_hash(bt_request, exclude=('get_visuals_html', 'get_signal', 'keep_top_k', 'get_diagnostics',
+                                                 'n_trials', 'trial_batch_size'),
+                            extra=extra)
+
+
 def get_pf_objective_value(pf, objective_value):
-    if objective_value == 'sharpe_ratio':
-        return pf.sharpe_ratio.iloc[0]
-    elif objective_value == 'sortino':
-        return pf.sortino_ratio.iloc[0]
-    elif objective_value == 'calmar':
-        return pf.calmar_ratio.iloc[0]
-    elif objective_value == 'omega':
-        return pf.omega_ratio.iloc[0]
-    elif objective_value == 'max_drawdown':
-        return pf.max_drawdown.iloc[0]
-    elif objective_value == 'total_return':
-        return pf.total_return.iloc[0] * 100
-    else:
-        raise ValueError(f'Objective value {objective_value} not recognized')  # todo <- add all pf.stats values here
+    '''Objective of a single column portfolio, the mean over the columns of a multi symbol one, in the study's
+    units (total_return is a fraction)'''
+    return np.mean(get_objective_metric(get_returns_array(pf), objective_value, get_ann_factor(pf)))
 
 
 def get_direction_from_objective_value(objective_value):
@@ -197,180 +496,214 @@ def get_direction_from_objective_value(objective_value):
         raise ValueError(f'Objective value {objective_value} not recognized')  # todo <- add all pf.stats values here
 
 
-def get_html_visuals(train_results_pfs, train_results_strat_runs, final_test_actual_pf, final_test_actual_strat_run,
-                     best_test_result_pfs, best_test_result_strat_runs):
-
-    html_visuals = {}
+def get_visual_sources(train_results_pfs, train_results_strat_runs, final_test_actual_pf, final_test_actual_strat_run,
+                       best_test_result_pfs, best_test_result_strat_runs) -> dict:
+    '''Returns the (pf, strat runs) of every split, see engine.visuals for the on demand rendering'''
+    visual_sources = {}
     for i, pf in train_results_pfs.items():
-        html_visuals[f'train_split_{i}'] = get_html_pf_plot(pf, train_results_strat_runs[i])
+        visual_sources[f'train_split_{i}'] = (pf, train_results_strat_runs[i])
 
-    html_visuals['final_test'] = get_html_pf_plot(final_test_actual_pf, final_test_actual_strat_run)
+    visual_sources['final_test'] = (final_test_actual_pf, final_test_actual_strat_run)
 
     for i, pf in best_test_result_pfs.items():
-        html_visuals[f'best_test_split_{i}'] = get_html_pf_plot(pf, best_test_result_strat_runs[i])
-
-    return html_visuals
-
-
-def run_study(bt_request: BtRequest) -> StandardResult | CvResult:
-    try:
-        timeframed_data = fetch_datas(source=bt_request.source,
-                                      symbol=bt_request.symbol,
-                                      timeframes=[indicator.timeframe for indicator in bt_request.indicators],
-                                      testing_period=bt_request.testing_period)
-
-        renamed_indicators = {}
-
-        for rest_indicator in bt_request.indicators:
-            if not rest_indicator.run_kwargs:
-                continue
-            for key, value in rest_indicator.run_kwargs.items():
-                renamed_indicators[f'{rest_indicator.alias}__{key}'] = value
+        visual_sources[f'best_test_split_{i}'] = (pf, best_test_result_strat_runs[i])
 
-        kwargs_to_add = [renamed_indicators]
-        kwargs_to_add.append(bt_request.custom_ranges)
+    return visual_sources
 
-        def std_objective(trial, action_data):
-            run_kwargs = get_trial_kwargs(trial=trial, kwargs_to_add=kwargs_to_add, bt_request=bt_request)
 
-            pf, strat_runs = get_pf_and_strat_runs(action_data, bt_request=bt_request, **run_kwargs)
-            trial.set_user_attr('pf', pf)
-            trial.set_user_attr('strat_runs', strat_runs)
+def get_folds_slices(timeframed_splitters) -> list:
+    '''Returns, per fold, the train and test slice of every timeframe'''
+    n_folds = min(len(splitter.splits) for splitter in timeframed_splitters.values())
 
-            if isnan(pf.sharpe_ratio.iloc[0]):
-                return -100000
+    folds_slices = []
+    for i in range(n_folds):
+        folds_slices.append({timeframe: {'train': splitter.splits['train'].iloc[i],
+                                         'test': splitter.splits['test'].iloc[i]}
+                             for timeframe, splitter in timeframed_splitters.items()})
 
-            if bt_request.objective_value == 'sharpe_ratio':
-                return pf.sharpe_ratio.values[0]
-            elif bt_request.objective_value == 'total_return':
-                return pf.total_return.values[0]
-            else:
-                raise ValueError(f'Invalid objective value: {bt_request.objective_value}')
+    return folds_slices
 
-        study_direction = get_direction_from_objective_value(bt_request.objective_value)
 
-        if not bt_request.cross_validate:
-            # region run standard study
-            study_name = 'cool_study12'
-            study = optuna.create_study(study_name=study_name, direction=study_direction)
-            # storage = "sqlite:///{}.db".format(study_name)
-            study.optimize(lambda trial: std_objective(trial, action_data=timeframed_data),
-                           n_trials=bt_request.n_trials)
-            return get_standard_result_from_study(study=study, bt_request=bt_request)
-            # endregion
+def run_cv_fold(timeframed_data, fold_index, fold_slices, bt_request, kwargs_to_add, request_hash) -> dict:
+    '''Optimizes the train and test sets of one fold and evaluates the best train params on the test set'''
+    storage_path = get_study_storage_path(request_hash)
+    ensure_memory_headroom('cv_fold')
 
-        else:
-            # region Run cross validated study
-            timeframed_splitters = {}
-            for timeframe, timeframe_data in timeframed_data.items():
-                timeframed_splitters[timeframe] = get_default_splitter(timeframe_data.index)
-            # Apply splitter to data
-
-            train_studies = []
-            test_studies = []
-
-            cv_df_results = []
+    train_data = {}
+    test_data = {}
+    for timeframe, timeframe_data in timeframed_data.items():
+        train_data[timeframe] = timeframe_data[fold_slices[timeframe]['train']]
+        test_data[timeframe] = timeframe_data[fold_slices[timeframe]['test']]
+
+    set_progress_phase('train_study', fold=fold_index)
+    train_study = run_persistent_study(f'{request_hash}_fold_{fold_index}_train', storage_path=storage_path,
+                                       timeframed_data=train_data, bt_request=bt_request, kwargs_to_add=kwargs_to_add)
+
+    set_progress_phase('test_study', fold=fold_index)
+    test_study = run_persistent_study(f'{request_hash}_fold_{fold_index}_test', storage_path=storage_path,
+                                      timeframed_data=test_data, bt_request=bt_request, kwargs_to_add=kwargs_to_add)
+
+    set_progress_phase('evaluation', fold=fold_index)
+    train_best_run_kwargs = get_params_run_kwargs(train_study.best_params, kwargs_to_add, bt_request)
+    test_best_run_kwargs = get_params_run_kwargs(test_study.best_params, kwargs_to_add, bt_request)
+
+    train_best_results_pf, train_best_results_strat_runs = get_pf_and_strat_runs(train_data,
+                                                                                 bt_request=bt_request,
+                                                                                 **train_best_run_kwargs)
+
+    actual_test_result_pf, actual_test_strat_runs = get_pf_and_strat_runs(test_data,
+                                                                          bt_request=bt_request,
+                                                                          **train_best_run_kwargs)
+    actual_pf_objective_value = get_pf_objective_value(actual_test_result_pf, bt_request.objective_value)
+
+    best_test_results_pf, best_test_results_strat_runs = get_pf_and_strat_runs(test_data,
+                                                                               bt_request=bt_request,
+                                                                               **test_best_run_kwargs)
+
+    actual_value_equals_best_train_value = actual_pf_objective_value == test_study.best_value
+
+    train_holding = train_data[list(train_data)[0]].run('from_holding', freq=list(timeframed_data)[0])
+    test_holding = test_data[list(test_data)[0]].run('from_holding', freq=list(timeframed_data)[0])
+
+    rounded_train_study_best_params = {k: round(v, 5) for k, v in train_study.best_params.items()}
+    rounded_test_study_best_params = {k: round(v, 5) for k, v in test_study.best_params.items()}
+
+    cv_df_row = {
+        'train_best': train_study.best_value,
+        'test_actual': actual_pf_objective_value,
+        'test_best': test_study.best_value,
+        'train_holding': get_pf_objective_value(pf=train_holding,
+                                                objective_value=bt_request.objective_value),
+        'test_holding': get_pf_objective_value(pf=test_holding,
+                                               objective_value=bt_request.objective_value),
+        'train_best_params': rounded_train_study_best_params,
+        'test_best_params': rounded_test_study_best_params if not actual_value_equals_best_train_value
+        else rounded_train_study_best_params
+    }
 
-            train_results_pfs = {}
-            train_results_strat_runs = {}
+    return {'cv_df_row': cv_df_row,
+            'train_pf': train_best_results_pf,
+            'train_strat_runs': train_best_results_strat_runs,
+            'actual_test_pf': actual_test_result_pf,
+            'actual_test_strat_runs': actual_test_strat_runs,
+            'best_test_pf': best_test_results_pf,
+            'best_test_strat_runs': best_test_results_strat_runs}
 
-            actual_test_result_pfs = []
-            actual_test_result_strat_runs = []
 
-            best_test_result_pfs = {}
-            best_test_result_strat_runs = {}
+def run_cv_fold_in_worker(fold_index, fold_slices, bt_request, kwargs_to_add, request_hash,
+                          memory_budget_bytes: int = None) -> dict:
+    '''Pool entry point, runs the fold over the timeframed data attached from shared memory within the worker's
+    share of the request's memory budget. The fold result carries the worker's trace and memory accounting for
+    the request's'''
+    with request_trace('cv_fold_worker') as trace, request_memory(memory_budget_bytes) as memory:
+        fold_result = run_cv_fold(get_attached_timeframed_data(), fold_index=fold_index, fold_slices=fold_slices,
+                                  bt_request=bt_request, kwargs_to_add=kwargs_to_add, request_hash=request_hash)
 
-            for i in range(len(timeframed_splitters) + 1):
-                train_data = {}
-                test_data = {}
-                for timeframe, timeframe_data in timeframed_data.items():
-                    timeframed_train_slice = timeframed_splitters[timeframe].splits['train'].iloc[i]
-                    timeframed_test_slice = timeframed_splitters[timeframe].splits['test'].iloc[i]
+    return {**fold_result, 'trace': get_trace_dict(trace), 'memory': memory.to_dict()}
 
-                    train_data[timeframe] = timeframe_data[timeframed_train_slice]
-                    test_data[timeframe] = timeframe_data[timeframed_test_slice]
 
-                train_study = optuna.create_study(direction=study_direction)
-                train_study.optimize(lambda trial: std_objective(trial, action_data=train_data),
-                                     n_trials=bt_request.n_trials)
-                train_studies.append(train_study)
+def run_cv_folds(timeframed_data, folds_slices: list, bt_request, kwargs_to_add, request_hash) -> list:
+    '''Runs every fold, in parallel worker processes when allowed, and returns the fold results in fold order'''
+    max_workers = min(BaseConfig.cv_max_workers, len(folds_slices))
+    if max_workers <= 1:
+        return [run_cv_fold(timeframed_data, fold_index=fold_index, fold_slices=fold_slices, bt_request=bt_request,
+                            kwargs_to_add=kwargs_to_add, request_hash=request_hash)
+                for fold_index, fold_slices in enumerate(folds_slices)]
 
-                test_study = optuna.create_study(direction=study_direction)
-                test_study.optimize(lambda trial: std_objective(trial, action_data=test_data),
-                                    n_trials=bt_request.n_trials)
-                test_studies.append(test_study)
+    with shared_timeframed_data(timeframed_data, symbol=bt_request.symbol) as shared_data_handles:
+        memory_budget_bytes = get_worker_memory_budget(max_workers)
+        with get_shared_data_process_pool(max_workers, shared_data_handles) as executor:
+            fold_results = list(executor.map(run_cv_fold_in_worker, range(len(folds_slices)), folds_slices,
+                                             repeat(bt_request), repeat(kwargs_to_add), repeat(request_hash),
+                                             repeat(memory_budget_bytes)))
 
-                train_best_results_pf, train_best_results_strat_runs = get_pf_and_strat_runs(train_data,
-                                                                                             bt_request=bt_request,
-                                                                                             **train_study.best_params)
+    for fold_result in fold_results:
+        merge_worker_trace(fold_result.pop('trace'))
+        merge_worker_memory(fold_result.pop('memory'))
 
-                train_results_pfs[i] = train_best_results_pf
-                train_results_strat_runs[i] = train_best_results_strat_runs
+    return fold_results
 
-                actual_test_result_pf, actual_test_strat_runs = get_pf_and_strat_runs(test_data,
-                                                                                      bt_request=bt_request,
-                                                                                      **train_study.best_params)
-                actual_pf_objective_value = get_pf_objective_value(actual_test_result_pf, bt_request.objective_value)
 
-                actual_test_result_pfs.append(actual_test_result_pf)
-                actual_test_result_strat_runs.append(actual_test_strat_runs)
+def run_study(bt_request: BtRequest) -> StandardResult | CvResult:
+    try:
+        set_progress_phase('fetch')
+        timeframes = [indicator.timeframe for indicator in bt_request.indicators]
+        with trace_span('fetch'):
+            if bt_request.is_multi_symbol():
+                # symbol -> timeframed data, aligned bar for bar
+                timeframed_data = fetch_symbol_datas(source=bt_request.source, symbols=bt_request.get_symbols(),
+                                                     timeframes=timeframes, testing_period=bt_request.testing_period)
+            else:
+                timeframed_data = fetch_datas(source=bt_request.source,
+                                              symbol=bt_request.symbol,
+                                              timeframes=timeframes,
+                                              testing_period=bt_request.testing_period)
+        account_memory('data', get_data_nbytes(timeframed_data))
+        ensure_memory_headroom('fetch')
 
-                best_test_results_pf, best_test_results_strat_runs = get_pf_and_strat_runs(test_data,
-                                                                                           bt_request=bt_request,
-                                                                                           **test_study.best_params)
+        kwargs_to_add = get_kwargs_to_add(bt_request)
+        request_hash = get_study_request_hash(bt_request, timeframed_data)
 
-                best_test_result_pfs[i] = best_test_results_pf
-                best_test_result_strat_runs[i] = best_test_results_strat_runs
+        if not bt_request.is_cross_validated():
+            # region run standard study
+            set_progress_phase('study')
+            with trace_span('study'):
+                study = run_persistent_study(request_hash, storage_path=get_study_storage_path(request_hash),
+                                             timeframed_data=timeframed_data, bt_request=bt_request,
+                                             kwargs_to_add=kwargs_to_add, n_jobs=BaseConfig.study_n_jobs)
+
+            set_progress_phase('evaluation')
+            with trace_span('top_trials'):
+                top_trial_runs = get_top_trial_runs(study, timeframed_data, bt_request=bt_request,
+                                                    kwargs_to_add=kwargs_to_add)
+            set_progress_phase('visuals')
+            with trace_span('result'):
+                return get_standard_result_from_study(study=study, bt_request=bt_request,
+                                                      top_trial_runs=top_trial_runs)
+            # endregion
 
-                actual_value_equals_best_train_value = actual_pf_objective_value == test_study.best_value
+        else:
+            # region Run cross validated study
+            timeframed_splitters = {}
+            for timeframe, timeframe_data in timeframed_data.items():
+                timeframed_splitters[timeframe] = get_default_splitter(timeframe_data.index)
 
-                fastest_timeframe_data, _ = get_fastest_timeframe_data(timeframed_data)
+            folds_slices = get_folds_slices(timeframed_splitters)
+            with trace_span('cv_folds'):
+                fold_results = run_cv_folds(timeframed_data, folds_slices=folds_slices, bt_request=bt_request,
+                                            kwargs_to_add=kwargs_to_add, request_hash=request_hash)
 
-                train_holding = train_data[list(train_data)[0]].run('from_holding', freq=list(timeframed_data)[0])
-                test_holding = test_data[list(test_data)[0]].run('from_holding', freq=list(timeframed_data)[0])
+            set_progress_phase('visuals')
+            cv_df_results = [fold_result['cv_df_row'] for fold_result in fold_results]
 
-                rounded_train_study_best_params = {k: round(v, 5) for k, v in train_study.best_params.items()}
-                rounded_test_study_best_params = {k: round(v, 5) for k, v in test_study.best_params.items()}
+            train_results_pfs = {i: fold_result['train_pf'] for i, fold_result in enumerate(fold_results)}
+            train_results_strat_runs = {i: fold_result['train_strat_runs']
+                                        for i, fold_result in enumerate(fold_results)}
 
-                cv_df_results.append({
-                    'train_best': train_study.best_value,
-                    'test_actual': actual_pf_objective_value,
-                    'test_best': test_study.best_value,
-                    'train_holding': get_pf_objective_value(pf=train_holding,
-                                                            objective_value=bt_request.objective_value),
-                    'test_holding': get_pf_objective_value(pf=test_holding,
-                                                           objective_value=bt_request.objective_value),
-                    'train_best_params': rounded_train_study_best_params,
-                    'test_best_params': rounded_test_study_best_params if not actual_value_equals_best_train_value
-                    else rounded_train_study_best_params
-                })
+            actual_test_result_pfs = [fold_result['actual_test_pf'] for fold_result in fold_results]
+            actual_test_result_strat_runs = [fold_result['actual_test_strat_runs'] for fold_result in fold_results]
 
-                vbt.clear_cache()
-                gc.collect()
+            best_test_result_pfs = {i: fold_result['best_test_pf'] for i, fold_result in enumerate(fold_results)}
+            best_test_result_strat_runs = {i: fold_result['best_test_strat_runs']
+                                           for i, fold_result in enumerate(fold_results)}
 
             cv_df = pd.DataFrame(cv_df_results)
 
             final_test_actual_pf = actual_test_result_pfs[-1]
             final_test_actual_strat_run = actual_test_result_strat_runs[-1]
 
-            html_visuals = get_html_visuals(train_results_pfs, train_results_strat_runs,
-                                            final_test_actual_pf, final_test_actual_strat_run,
-                                            best_test_result_pfs, best_test_result_strat_runs, )
+            visual_sources = {}
+            if bt_request.get_visuals_html:
+                visual_sources = get_visual_sources(train_results_pfs, train_results_strat_runs,
+                                                    final_test_actual_pf, final_test_actual_strat_run,
+                                                    best_test_result_pfs, best_test_result_strat_runs)
 
             signal_dict = get_signal_dict_from_pf(final_test_actual_pf, bt_request.get_signal)
 
-            clear_indicator_run_cache()
-
-            best_trial_pf_visuals_html = get_html_pf_plot(final_test_actual_pf, final_test_actual_strat_run)
-            if __debug__:
-                Path('temp').mkdir(exist_ok=True)
-                with open(f'temp/{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_pf_visuals.html', 'wb') as f:
-                    f.write(best_trial_pf_visuals_html.encode('utf-8'))
-
             return CvResult(cv_df=cv_df,
-                            final_test_best_pf=test_studies[-1].best_trial.user_attrs['pf'],
+                            final_test_best_pf=best_test_result_pfs[len(fold_results) - 1],
                             final_test_actual_pf=final_test_actual_pf,
-                            html_visuals=html_visuals,
+                            visual_sources=visual_sources,
                             signal=signal_dict)
             # endregion
     except Exception as e:
@@ -405,7 +738,61 @@ def get_strat_run(indicator_alias, run_value, shaped_run_result: np.array, indic
     return StratRun(style=style, run_object=indicator_run_object, y_val=y_val, add_to_orders=add_to_orders)
 
 
-def get_pf_and_strat_runs(timeframed_data, bt_request, **kwargs):
+def get_pf_and_strat_runs(timeframed_data, bt_request, add_strat_runs=True, **kwargs):
+    '''Multi symbol requests pass their symbol -> timeframed data and get a portfolio with one column
+    per symbol, along with the strat runs of each symbol'''
+    if bt_request.is_multi_symbol():
+        close, fastest_timeframe = get_multi_symbol_close(timeframed_data)
+        entries, exits, symbol_strat_runs = get_multi_symbol_signals_and_strat_runs(timeframed_data, bt_request,
+                                                                                    add_strat_runs=add_strat_runs,
+                                                                                    **kwargs)
+        with trace_span('simulate'):
+            pf = vbt.Portfolio.from_signals(close=close, entries=entries, exits=exits, freq=fastest_timeframe)
+
+        return pf, symbol_strat_runs
+
+    fastest_timeframed_data, fastest_timeframe = get_fastest_timeframe_data(timeframed_data)
+
+    entries, exits, indicator_strat_runs = get_signals_and_strat_runs(timeframed_data, bt_request,
+                                                                      add_strat_runs=add_strat_runs, **kwargs)
+
+    with trace_span('simulate'):
+        pf = vbt.Portfolio.from_signals(fastest_timeframed_data, entries=entries, exits=exits,
+                                        freq=fastest_timeframe)
+
+    return pf, indicator_strat_runs
+
+    # todo - delete stops that are 0 or negative from new pf run_kwargs - still to be built
+
+
+def get_multi_symbol_close(symbol_datas: dict) -> tuple:
+    '''Returns the fastest timeframe closes of every symbol as (bars, symbols) columns and that timeframe'''
+    closes = {}
+    for symbol, timeframed_data in symbol_datas.items():
+        fastest_timeframed_data, fastest_timeframe = get_fastest_timeframe_data(timeframed_data)
+        closes[symbol] = np.asarray(fastest_timeframed_data.close, dtype=np.float64).reshape(-1)
+
+    return pd.DataFrame(closes, index=fastest_timeframed_data.index).rename_axis(columns='symbol'), fastest_timeframe
+
+
+def get_multi_symbol_signals_and_strat_runs(symbol_datas: dict, bt_request, add_strat_runs=True, **kwargs):
+    '''Returns the entries and exits of every symbol as (bars, symbols) columns and the strat runs per symbol.
+    Indicator runs are cached per symbol data, so trials only evaluate their triggers on each symbol'''
+    symbol_entries, symbol_exits, symbol_strat_runs = {}, {}, {}
+    for symbol, timeframed_data in symbol_datas.items():
+        symbol_entries[symbol], symbol_exits[symbol], symbol_strat_runs[symbol] = get_signals_and_strat_runs(
+            timeframed_data, bt_request, add_strat_runs=add_strat_runs, **kwargs)
+
+    index = get_fastest_timeframe_data(timeframed_data)[0].index
+    entries = pd.DataFrame(symbol_entries, index=index).rename_axis(columns='symbol')
+    exits = pd.DataFrame(symbol_exits, index=index).rename_axis(columns='symbol')
+
+    return entries, exits, symbol_strat_runs
+
+
+def get_signals_and_strat_runs(timeframed_data, bt_request, add_strat_runs=True, **kwargs):
+    '''Returns the entry and exit arrays of the first trigger pair along with the strat runs to chart,
+    trials pass add_strat_runs=False since only the re-simulated best trials are charted'''
     fastest_timeframed_data, fastest_timeframe = get_fastest_timeframe_data(timeframed_data)
 
     open = fastest_timeframed_data.open.to_numpy().reshape(len(fastest_timeframed_data.close))
@@ -414,60 +801,40 @@ def get_pf_and_strat_runs(timeframed_data, bt_request, **kwargs):
     close = fastest_timeframed_data.close.to_numpy().reshape(len(fastest_timeframed_data.close))
     volume = fastest_timeframed_data.volume.to_numpy().reshape(len(fastest_timeframed_data.volume))
 
-    live_run_indicators = get_live_run_indicators(bt_request, kwargs)
-    live_run_aliases = [indicator.alias for indicator in live_run_indicators]
-    timeframed_run_results = get_timeframed_run_results(timeframed_data, live_run_indicators)
-
-    for trigger_pair in bt_request.trigger_pairs:
-        entry_string = trigger_pair.entry
-        exit_string = trigger_pair.exit
-        for key, value in kwargs.items():
-            entry_string = entry_string.replace(key, str(value))
-            exit_string = exit_string.replace(key, str(value))
-
-        indicator_run_results = {}
-        indicator_strat_runs = {}
-        indicator_aliases_added = set()
-        for timeframe, indicator_results in timeframed_run_results.items():
-            for indicator_alias, run_results in indicator_results.items():
-                for run_value, run_result in run_results.items():
-                    key_val = f'{indicator_alias}.{run_value}'
-                    indicator_run_results[key_val] = run_result['shaped_run_result']
-                    if bt_request.get_visuals_html:
-                        comparable_entry_string = entry_string.replace('(', '').replace(')', '')
-                        comparable_exit_string = exit_string.replace('(', '').replace(')', '')
-                        entry_string_primary_words = [word.split('.')[0] for word in comparable_entry_string.split()]
-                        exit_string_primary_words = [word.split('.')[0] for word in comparable_exit_string.split()]
-
-                        add_conditions = [
-                            indicator_alias in entry_string_primary_words,
-                            indicator_alias in exit_string_primary_words,
-                        ]
-                        if any(add_conditions) and indicator_alias not in indicator_aliases_added:
-                            indicator_strat_runs[key_val] = get_strat_run(indicator_alias=indicator_alias,
-                                                                          indicator_run_object=run_result[
-                                                                              'indicator_run_object'],
-                                                                          run_value=run_value,
-                                                                          data=timeframed_data[timeframe],
-                                                                          shaped_run_result=run_result['shaped_run_result'],
-                                                                          bt_request_indicators=bt_request.indicators)
-                            indicator_aliases_added.add(indicator_alias)
-
-        entry_string = format_action_string(entry_string, indicator_aliases=live_run_aliases,
-                                            indicator_run_results=indicator_run_results)
-
-        exit_string = format_action_string(exit_string, indicator_aliases=live_run_aliases,
-                                           indicator_run_results=indicator_run_results)
-
-        entry_string = handle_crossed_operator(entry_string)
-        exit_string = handle_crossed_operator(exit_string)
-
-        entries = np.where(eval(entry_string), True, False)
-        exits = np.where(eval(exit_string), True, False)
+    # only the first trigger pair is traded for now
+    compiled_entry, compiled_exit = get_compiled_trigger_pair(bt_request.trigger_pairs[0], bt_request)
 
-        pf = vbt.Portfolio.from_signals(fastest_timeframed_data, entries=entries, exits=exits,
-                                        freq=fastest_timeframe)
-
-        return pf, indicator_strat_runs
-
-        # todo - delete stops that are 0 or negative from new pf run_kwargs - still to be built
+    live_run_indicators = get_live_run_indicators(bt_request, kwargs)
+    add_strat_runs = add_strat_runs and bt_request.get_visuals_html
+    grid_rest_indicators = bt_request.indicators if bt_request.precompute_indicators and not add_strat_runs else None
+    # charts show the first output of each referenced indicator, so charted runs build every output
+    referenced_run_values = get_referenced_run_values([compiled_entry, compiled_exit], all_values=add_strat_runs)
+    with trace_span('indicators'):
+        timeframed_run_results = get_timeframed_run_results(timeframed_data, live_run_indicators,
+                                                            grid_rest_indicators=grid_rest_indicators,
+                                                            referenced_run_values=referenced_run_values)
+
+    operands = {'open': open, 'high': high, 'low': low, 'close': close, 'volume': volume}
+
+    indicator_strat_runs = {}
+    indicator_aliases_added = set()
+    for timeframe, indicator_results in timeframed_run_results.items():
+        for indicator_alias, run_results in indicator_results.items():
+            for run_value, run_result in run_results.items():
+                key_val = f'{indicator_alias}.{run_value}'
+                operands[key_val] = run_result['shaped_run_result']
+                if add_strat_runs and indicator_alias not in indicator_aliases_added:
+                    indicator_strat_runs[key_val] = get_strat_run(indicator_alias=indicator_alias,
+                                                                  indicator_run_object=run_result[
+                                                                      'indicator_run_object'],
+                                                                  run_value=run_value,
+                                                                  data=timeframed_data[timeframe],
+                                                                  shaped_run_result=run_result['shaped_run_result'],
+                                                                  bt_request_indicators=bt_request.indicators)
+                    indicator_aliases_added.add(indicator_alias)
+
+    with trace_span('triggers'):
+        entries = compiled_entry.evaluate(operands, params=kwargs, length=len(close))
+        exits = compiled_exit.evaluate(operands, params=kwargs, length=len(close))
+
+    return entries, exits, indicator_strat_runs
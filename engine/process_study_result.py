@@ -1,8 +1,9 @@
-from datetime import datetime
-from pathlib import Path
+import json
 import numpy as np
+import pandas as pd
 import vectorbtpro as vbt
-from models import StandardResult, BtRequest
+from engine.tracing import trace_span
+from models import StandardResult, CvResult, BtRequest
 
 
 def get_signal_dict_from_pf(pf: vbt.Portfolio, get_signal) -> dict:
@@ -19,37 +20,67 @@ def get_signal_dict_from_pf(pf: vbt.Portfolio, get_signal) -> dict:
     return {}
 
 
-def get_standard_result_from_study(study, bt_request: BtRequest) -> StandardResult:
+def get_pf_stats(pf: vbt.Portfolio, bt_request: BtRequest):
+    '''Stats of the portfolio, per symbol column for multi symbol requests'''
+    with trace_span('stats'):
+        if bt_request.is_multi_symbol():
+            return {symbol: pf[symbol].stats() for symbol in bt_request.get_symbols()}
 
+        return pf.stats()
+
+
+def get_pf_signal_dict(pf: vbt.Portfolio, bt_request: BtRequest) -> dict:
+    if bt_request.is_multi_symbol():
+        return {symbol: get_signal_dict_from_pf(pf[symbol], bt_request.get_signal)
+                for symbol in bt_request.get_symbols()}
+
+    return get_signal_dict_from_pf(pf, bt_request.get_signal)
+
+
+def get_pf_visual_sources(split: str, pf: vbt.Portfolio, strat_runs: dict, bt_request: BtRequest) -> dict:
+    '''The split's (pf, strat runs), one split per symbol column for multi symbol requests'''
+    if bt_request.is_multi_symbol():
+        return {f'{split}_{symbol}': (pf[symbol], strat_runs[symbol]) for symbol in bt_request.get_symbols()}
+
+    return {split: (pf, strat_runs)}
+
+
+def get_standard_result_from_study(study, bt_request: BtRequest, top_trial_runs: list) -> StandardResult:
+    '''top_trial_runs are the best trials re-simulated, best first, trials don't keep portfolios'''
     optuna_df = study.trials_dataframe()
-    best_trial = study.best_trial
     best_params = study.best_params
     best_objective_value = study.best_value
 
-    best_trial_pf = best_trial.user_attrs['pf']
-    best_trial_pf_stats = best_trial_pf.stats()
+    best_trial_pf = top_trial_runs[0]['pf']
+    best_trial_pf_stats = get_pf_stats(best_trial_pf, bt_request)
+
+    signal_dict = get_pf_signal_dict(best_trial_pf, bt_request)
 
-    signal_dict = get_signal_dict_from_pf(best_trial_pf, bt_request.get_signal)
+    top_trials = [{'number': top_trial_run['number'],
+                   'params': top_trial_run['params'],
+                   'value': top_trial_run['value'],
+                   'symbol_values': top_trial_run['symbol_values'],
+                   'pf_stats': get_pf_stats(top_trial_run['pf'], bt_request) if rank else best_trial_pf_stats}
+                  for rank, top_trial_run in enumerate(top_trial_runs)]
 
+    visual_sources = {}
     if bt_request.get_visuals_html:
-        strat_runs_dict = best_trial.user_attrs['strat_runs']
-        best_trial_pf_visuals_html = get_html_pf_plot(best_trial_pf, strat_runs_dict)
-        if __debug__:
-            Path('temp').mkdir(exist_ok=True)
-            with open(f'temp/{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_pf_visuals.html', 'wb') as f:
-                f.write(best_trial_pf_visuals_html.encode('utf-8'))
-    else:
-        best_trial_pf_visuals_html = None
+        visual_sources.update(get_pf_visual_sources('best_trial', best_trial_pf, top_trial_runs[0]['strat_runs'],
+                                                    bt_request))
+        for rank, top_trial_run in enumerate(top_trial_runs[1:], start=2):
+            visual_sources.update(get_pf_visual_sources(f'top_trial_{rank}', top_trial_run['pf'],
+                                                        top_trial_run['strat_runs'], bt_request))
 
     return StandardResult(optuna_df=optuna_df,
                           best_params=best_params,
                           best_objective_value=best_objective_value,
                           best_trial_pf_stats=best_trial_pf_stats,
-                          best_trial_pf_visuals_html=best_trial_pf_visuals_html,
+                          top_trials=top_trials,
+                          visual_sources=visual_sources,
                           signal=signal_dict)
 
 
-def get_html_pf_plot(pf: vbt.Portfolio, strat_runs_dict: dict) -> str:
+def get_pf_figure(pf: vbt.Portfolio, strat_runs_dict: dict):
 
     subplots = [('orders_v2', {'title': 'orders_v2'}),
                 'trade_pnl',
@@ -89,4 +120,47 @@ def get_html_pf_plot(pf: vbt.Portfolio, strat_runs_dict: dict) -> str:
         real_entries.vbt.signals.plot_as_entry_marks(fig=fig, y=strat_run.y_val, add_trace_kwargs=dict(row=i, col=1))
         real_exits.vbt.signals.plot_as_exit_marks(fig=fig, y=strat_run.y_val, add_trace_kwargs=dict(row=i, col=1))
 
-    return fig.to_html()
\ No newline at end of file
+    return fig
+
+
+def to_jsonable(value):
+    '''Converts result values (pandas objects, numpy scalars, timestamps, NaN) to plain JSON types'''
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return json.loads(value.to_json(orient='records' if isinstance(value, pd.DataFrame) else 'index',
+                                        date_format='iso', default_handler=str))
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(sub_value) for key, sub_value in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(sub_value) for sub_value in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+
+    return str(value)
+
+
+def get_jsonable_result(processed_result: StandardResult | CvResult) -> dict:
+    '''JSON safe summary of a study result, portfolios are reduced to their stats'''
+    if isinstance(processed_result, StandardResult):
+        return to_jsonable({'kind': 'standard',
+                            'best_params': processed_result.best_params,
+                            'best_objective_value': processed_result.best_objective_value,
+                            'best_trial_pf_stats': processed_result.best_trial_pf_stats,
+                            'top_trials': processed_result.top_trials,
+                            'optuna_df': processed_result.optuna_df,
+                            'visual_splits': list(processed_result.visual_sources),
+                            'signal': processed_result.signal})
+
+    with trace_span('stats'):
+        final_test_best_pf_stats = processed_result.final_test_best_pf.stats()
+        final_test_actual_pf_stats = processed_result.final_test_actual_pf.stats()
+
+    return to_jsonable({'kind': 'cv',
+                        'cv_df': processed_result.cv_df,
+                        'final_test_best_pf_stats': final_test_best_pf_stats,
+                        'final_test_actual_pf_stats': final_test_actual_pf_stats,
+                        'visual_splits': list(processed_result.visual_sources),
+                        'signal': processed_result.signal})
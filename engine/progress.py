@@ -0,0 +1,92 @@
+import json
+import math
+import os
+import time
+from pathlib import Path
+
+# set in a job's worker process, inherited by every study/fold process it spawns
+progress_path_env_var = 'BT_JOB_PROGRESS_PATH'
+progress_phase_env_var = 'BT_JOB_PROGRESS_PHASE'
+
+progress_phases = ('fetch', 'study', 'train_study', 'test_study', 'evaluation', 'visuals')
+
+
+def set_job_progress_path(progress_path: Path = None):
+    if progress_path is None:
+        os.environ.pop(progress_path_env_var, None)
+        os.environ.pop(progress_phase_env_var, None)
+    else:
+        os.environ[progress_path_env_var] = str(progress_path)
+
+
+def get_progress_phase() -> dict:
+    return json.loads(os.environ.get(progress_phase_env_var, '{"phase": null, "fold": null}'))
+
+
+def set_progress_phase(phase: str, fold: int = None):
+    '''Records the phase the trials of this process (and the processes it spawns) belong to and emits it'''
+    if phase not in progress_phases:
+        raise ValueError(f'Invalid progress phase: {phase}')
+    if not os.environ.get(progress_path_env_var):
+        return
+
+    os.environ[progress_phase_env_var] = json.dumps({'phase': phase, 'fold': fold})
+    emit_progress_event({'type': 'phase'})
+
+
+def emit_progress_event(event: dict):
+    '''Appends the event, stamped with the current phase and time, to the job's progress file.
+    One short line per O_APPEND write, so concurrent study processes never interleave events'''
+    progress_path = os.environ.get(progress_path_env_var)
+    if not progress_path:
+        return
+
+    line = json.dumps({**event, **get_progress_phase(), 'time': time.time()}, default=str) + '\n'
+    fd = os.open(progress_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+def get_finite(value):
+    return value if value is not None and math.isfinite(value) else None
+
+
+def emit_trial_progress(study, trial):
+    '''Optuna callback, also called after each tell of batched trials'''
+    if not os.environ.get(progress_path_env_var):
+        return
+
+    try:
+        best_value = study.best_value
+    except ValueError:
+        best_value = None
+
+    emit_progress_event({'type': 'trial',
+                         'study': study.study_name,
+                         'trial': trial.number,
+                         'state': trial.state.name,
+                         'params': trial.params,
+                         'value': get_finite(trial.value) if trial.values else None,
+                         'best_value': get_finite(best_value)})
+
+
+def read_progress_events(progress_path: Path, offset: int = 0) -> list:
+    '''Returns (end offset, event) for every complete event written after byte offset,
+    resuming from an event's end offset continues right after it'''
+    if not progress_path.exists():
+        return []
+
+    with open(progress_path, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read()
+
+    events = []
+    for line in chunk.splitlines(keepends=True):
+        if not line.endswith(b'\n'):
+            break
+        offset += len(line)
+        events.append((offset, json.loads(line)))
+
+    return events
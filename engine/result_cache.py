@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from base_config import BaseConfig
+from engine.data.data_manager import get_testing_period_ns
+from engine.data.local_store import get_local_store, ohlcv_fields
+from engine.optuna_processing import get_request_hash
+
+
+def get_data_version(bt_request) -> str:
+    '''Fingerprint of the stored bars a closed testing period's request runs on: row count and crc32 of the
+    timestamps and every OHLCV column of every timeframe. None when the period is open ended or a timeframe isn't stored
+    for the whole period yet, the request then has to run to know its data'''
+    if not bt_request.testing_period.end:
+        return None
+
+    start_ns, end_ns = get_testing_period_ns(bt_request.testing_period)
+    data_version = []
+    for symbol in bt_request.get_symbols():
+        for timeframe in sorted({indicator.timeframe for indicator in bt_request.indicators}):
+            local_store = get_local_store(symbol, timeframe, BaseConfig.resources.local_data)
+            if local_store.get_missing_intervals(start_ns, end_ns):
+                return None
+
+            arrays = local_store.load_arrays(start_ns, end_ns + 1)
+            crc = 0
+            for field in ('timestamp',) + ohlcv_fields:
+                crc = zlib.crc32(arrays[field], crc)
+            data_version.append(f'{symbol}:{timeframe}:{len(arrays["timestamp"])}:{crc}')
+
+    return '|'.join(data_version)
+
+
+def get_result_cache_key(bt_request, data_version: str = None) -> str:
+    return get_request_hash(bt_request, exclude=('get_diagnostics',), extra={'data_version': data_version})
+
+
+class ResultCache:
+    '''Disk cache of JSON result payloads, one file per key plus a folder of the result's visual sources,
+    evicting the least recently used entries past max_bytes. Entries with a ttl expire, the others only go by
+    eviction'''
+
+    def __init__(self, folder: Path, max_bytes: int):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_path(self, key: str) -> Path:
+        return self.folder / f'{key}.json'
+
+    def get_visuals_folder(self, key: str) -> Path:
+        return self.folder / f'{key}.visuals'
+
+    def remove(self, key: str):
+        self.get_path(key).unlink(missing_ok=True)
+        shutil.rmtree(self.get_visuals_folder(key), ignore_errors=True)
+
+    def get(self, key: str):
+        path = self.get_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        if entry['expires_at'] is not None and entry['expires_at'] < time.time():
+            self.remove(key)
+            self.misses += 1
+            return None
+
+        # mtime doubles as last use for eviction
+        os.utime(path)
+        self.hits += 1
+        return entry['payload']
+
+    def set(self, key: str, payload, ttl_seconds: float = None):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        entry = {'created_at': time.time(),
+                 'expires_at': time.time() + ttl_seconds if ttl_seconds is not None else None,
+                 'payload': payload}
+
+        temp_path = self.folder / f'{key}.json.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, self.get_path(key))
+
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for path in self.folder.glob('*.json'):
+                try:
+                    stat = path.stat()
+                    size = stat.st_size + sum(visuals_path.stat().st_size
+                                              for visuals_path in self.get_visuals_folder(path.stem).glob('*'))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, size, path.stem))
+
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, key in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                self.remove(key)
+                total_bytes -= size
+
+    def clear(self):
+        for path in self.folder.glob('*.json'):
+            self.remove(path.stem)
+
+    def get_stats(self) -> dict:
+        '''Lookups of this process, counters are kept by clear'''
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+result_cache = ResultCache(BaseConfig.resources.result_cache, max_bytes=BaseConfig.result_cache_max_bytes)
+
+
+def get_result_id(bt_request) -> str:
+    '''Result cache key of the request, call once its data is stored'''
+    return get_result_cache_key(bt_request, get_data_version(bt_request))
+
+
+def get_cached_result(bt_request):
+    '''Returns the cached payload of an identical earlier request on identical data, None on a miss'''
+    data_version = get_data_version(bt_request)
+    if data_version is None and bt_request.testing_period.end:
+        return None
+
+    return result_cache.get(get_result_cache_key(bt_request, data_version))
+
+
+def cache_result(bt_request, payload, result_id: str):
+    '''Caches the payload of a finished request under its result id. Open ended periods, and closed ones whose
+    data isn't fully stored (they never hit), expire after BaseConfig.result_cache_open_ended_ttl'''
+    has_data_version = get_data_version(bt_request) is not None
+    ttl_seconds = None if has_data_version else BaseConfig.result_cache_open_ended_ttl
+    result_cache.set(result_id, payload, ttl_seconds=ttl_seconds)
@@ -0,0 +1,200 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from base_config import BaseConfig
+from indicators.indicator_run_caching import get_indicator_run_cache_stats
+
+# the trace spans of the running request add to, None outside requests or with tracing disabled
+current_trace = ContextVar('current_trace', default=None)
+
+
+class RequestTrace:
+    '''Seconds and call count per span name of one request, plus counters such as cache hits.
+    Spans nest, an outer span's seconds include its inner spans' seconds'''
+
+    def __init__(self):
+        self.spans = {}
+        self.counters = defaultdict(int)
+
+    def add_span(self, name: str, seconds: float, count: int = 1):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [seconds, count]
+        else:
+            span[0] += seconds
+            span[1] += count
+
+    def merge(self, trace_dict: dict):
+        '''Adds the spans and counters of a worker process's trace, see to_dict'''
+        for name, (seconds, count) in trace_dict['spans'].items():
+            self.add_span(name, seconds, count)
+        for name, value in trace_dict['counters'].items():
+            self.counters[name] += value
+
+    def to_dict(self) -> dict:
+        return {'spans': {name: list(span) for name, span in self.spans.items()}, 'counters': dict(self.counters)}
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: RequestTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.trace.add_span(self.name, time.perf_counter() - self.start)
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+null_span = NullSpan()
+
+
+def trace_span(name: str):
+    '''Times the block into the current request's trace, a shared no-op outside traced requests'''
+    trace = current_trace.get()
+    return null_span if trace is None else Span(trace, name)
+
+
+@contextmanager
+def request_trace(span_name: str = 'request'):
+    '''Traces the block, yielding its RequestTrace, None when tracing is disabled. The block's own duration is
+    the span_name span. Indicator cache counters are this process's deltas over the block, so concurrent
+    requests in the same process count each other's lookups'''
+    if not BaseConfig.tracing_enabled:
+        yield None
+        return
+
+    trace = RequestTrace()
+    token = current_trace.set(trace)
+    start_cache_stats = get_indicator_run_cache_stats()
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.add_span(span_name, time.perf_counter() - start)
+        end_cache_stats = get_indicator_run_cache_stats()
+        trace.counters['indicator_cache_hits'] += end_cache_stats['hits'] - start_cache_stats['hits']
+        trace.counters['indicator_cache_misses'] += end_cache_stats['misses'] - start_cache_stats['misses']
+        current_trace.reset(token)
+
+
+def get_trace_dict(trace: RequestTrace):
+    '''Picklable spans and counters of the trace, None when tracing is disabled'''
+    return trace.to_dict() if trace is not None else None
+
+
+def get_trace_diagnostics(trace_dict: dict) -> dict:
+    '''The diagnostics block of a request's result: seconds and count per span, slowest first, and counters'''
+    trace_dict = trace_dict or {'spans': {}, 'counters': {}}
+    return {'spans': {name: {'seconds': round(seconds, 6), 'count': count}
+                      for name, (seconds, count) in sorted(trace_dict['spans'].items(), key=lambda item: -item[1][0])},
+            'counters': trace_dict['counters']}
+
+
+def merge_worker_trace(trace_dict: dict):
+    '''Adds a worker process's trace, as returned by get_trace_dict, to the current request's trace'''
+    trace = current_trace.get()
+    if trace is not None and trace_dict is not None:
+        trace.merge(trace_dict)
+
+
+class MetricsRegistry:
+    '''Rolling per span histograms over the last window_len traced requests and cumulative counters,
+    kept by the API process from the traces of the requests it serves'''
+
+    def __init__(self, buckets: tuple, window_len: int):
+        self.buckets = tuple(sorted(buckets))
+        self.window_len = window_len
+        self.span_seconds = {}
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def observe(self, trace_dict: dict):
+        '''Records one request's span totals and counters, see RequestTrace.to_dict'''
+        if trace_dict is None:
+            return
+
+        with self.lock:
+            self.counters['traced_requests'] += 1
+            for name, (seconds, _) in trace_dict['spans'].items():
+                self.span_seconds.setdefault(name, deque(maxlen=self.window_len)).append(seconds)
+            for name, value in trace_dict['counters'].items():
+                self.counters[name] += value
+
+    def get_histograms(self) -> dict:
+        '''Per span name: cumulative bucket counts, +Inf last, the sum and the count of the window'''
+        with self.lock:
+            span_seconds = {name: list(seconds) for name, seconds in self.span_seconds.items()}
+
+        histograms = {}
+        for name, seconds in sorted(span_seconds.items()):
+            bucket_counts = [sum(value <= bucket for value in seconds) for bucket in self.buckets]
+            histograms[name] = {'buckets': list(zip(self.buckets, bucket_counts)) + [('+Inf', len(seconds))],
+                                'sum': sum(seconds),
+                                'count': len(seconds)}
+
+        return histograms
+
+    def get_counters(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+
+metrics_registry = MetricsRegistry(buckets=BaseConfig.metrics_histogram_buckets,
+                                   window_len=BaseConfig.metrics_window_len)
+
+
+def get_hit_rate(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def get_metrics_text(job_stats: dict, result_cache_stats: dict) -> str:
+    '''Prometheus text exposition of the span histograms, cache hit rates and jobs by status'''
+    lines = ['# HELP bt_span_seconds Seconds per request spent in each span, over the last '
+             f'{metrics_registry.window_len} traced requests',
+             '# TYPE bt_span_seconds histogram']
+    for name, histogram in metrics_registry.get_histograms().items():
+        for bucket, count in histogram['buckets']:
+            lines.append(f'bt_span_seconds_bucket{{span="{name}",le="{bucket}"}} {count}')
+        lines.append(f'bt_span_seconds_sum{{span="{name}"}} {histogram["sum"]}')
+        lines.append(f'bt_span_seconds_count{{span="{name}"}} {histogram["count"]}')
+
+    counters = metrics_registry.get_counters()
+    cache_lookups = {'indicator': (counters.get('indicator_cache_hits', 0),
+                                   counters.get('indicator_cache_misses', 0)),
+                     'result': (result_cache_stats['hits'], result_cache_stats['misses'])}
+    lines += ['# HELP bt_cache_hits_total Cache hits, indicator hits counted by the processes running requests',
+              '# TYPE bt_cache_hits_total counter']
+    lines += [f'bt_cache_hits_total{{cache="{cache}"}} {hits}' for cache, (hits, _) in cache_lookups.items()]
+    lines += ['# TYPE bt_cache_misses_total counter']
+    lines += [f'bt_cache_misses_total{{cache="{cache}"}} {misses}' for cache, (_, misses) in cache_lookups.items()]
+    lines += ['# TYPE bt_cache_hit_rate gauge']
+    lines += [f'bt_cache_hit_rate{{cache="{cache}"}} {get_hit_rate(hits, misses)}'
+              for cache, (hits, misses) in cache_lookups.items()]
+
+    lines += ['# TYPE bt_traced_requests_total counter',
+              f'bt_traced_requests_total {counters.get("traced_requests", 0)}',
+              '# HELP bt_jobs Jobs by status, queued and running ones are in flight',
+              '# TYPE bt_jobs gauge']
+    lines += [f'bt_jobs{{status="{status}"}} {count}' for status, count in job_stats.items()]
+    lines += ['# TYPE bt_jobs_in_flight gauge',
+              f'bt_jobs_in_flight {job_stats.get("queued", 0) + job_stats.get("running", 0)}']
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,462 @@
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+price_operands = ('open', 'high', 'low', 'close', 'volume')
+trigger_processes = ('diff', 'mean', 'median')
+trigger_keywords = ('and', 'or', 'not')
+
+token_pattern = re.compile(r'(?P<number>\d+\.\d*|\d+)'
+                           r'|(?P<name>[A-Za-z_][A-Za-z0-9_]*)'
+                           r'|(?P<operator>\|>|<\||>=|<=|==|!=|[-+*/%<>().#])'
+                           r'|(?P<space>\s+)')
+
+arithmetic_functions = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide, '%': np.mod}
+comparison_functions = {'<': np.less, '>': np.greater, '<=': np.less_equal, '>=': np.greater_equal,
+                        '==': np.equal, '!=': np.not_equal}
+cross_operators = ('|>', '<|')
+
+compiled_triggers = {}
+
+
+def tokenize_trigger(trigger: str) -> list:
+    '''Splits a trigger string into (kind, text) tokens'''
+    tokens = []
+    position = 0
+    while position < len(trigger):
+        match = token_pattern.match(trigger, position)
+        if not match:
+            raise ValueError(f'Unexpected character "{trigger[position]}" at position {position} in trigger "{trigger}"')
+        position = match.end()
+
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        text = match.group(kind)
+        if kind == 'name' and text in trigger_keywords:
+            kind = 'keyword'
+        tokens.append((kind, text))
+
+    return tokens
+
+
+def get_relation(left, right):
+    '''1 where left is above right, -1 below, 0 equal and NaN where either side is NaN'''
+    return np.where(left > right, 1., np.where(left < right, -1., np.where(left == right, 0., np.nan)))
+
+
+def get_crossed(left, right, above: bool):
+    '''Vectorized equivalent of vbt's crossed_above/crossed_below for 1d arrays. Like vbt, bars where both sides
+    are equal carry the last relation forward, so touching and then crossing is a cross, and NaN starts over'''
+    left, right = np.broadcast_arrays(np.asarray(left, dtype=float), np.asarray(right, dtype=float))
+    crossed = np.zeros(left.shape, dtype=bool)
+    if left.ndim == 0 or len(left) < 2:
+        return crossed
+
+    relation = get_relation(left, right)
+    # position of the last non equal relation up to each bar, NaN counts as one
+    last_positions = np.maximum.accumulate(np.where(relation != 0, np.arange(len(relation)), 0))
+    carried_relation = relation[last_positions]
+
+    side = 1. if above else -1.
+    crossed[1:] = (relation[1:] == side) & (carried_relation[:-1] == -side)
+
+    return crossed
+
+
+def get_processed_array(array: np.ndarray, process: str, window: int) -> np.ndarray:
+    '''Applies a #diff/#mean/#median process over the trailing window, leaving warm-up bars as NaN'''
+    if window < 1:
+        raise ValueError(f'Process window must be at least 1, got {window}')
+
+    array = np.asarray(array, dtype=float)
+    processed = np.full(array.shape, np.nan)
+    if process == 'diff':
+        processed[window:] = array[window:] - array[:-window]
+        return processed
+
+    if window > len(array):
+        return processed
+
+    windows = np.lib.stride_tricks.sliding_window_view(array, window)
+    if process == 'mean':
+        processed[window - 1:] = windows.mean(axis=1)
+    elif process == 'median':
+        processed[window - 1:] = np.median(windows, axis=1)
+    else:
+        raise ValueError(f'Process {process} not valid, expecting one of {trigger_processes}')
+
+    return processed
+
+
+@dataclass(frozen=True)
+class Constant:
+    value: float
+    is_boolean = False
+
+    def resolve(self, resolve_reference):
+        return self
+
+    def evaluate(self, operands: dict, params: dict):
+        return self.value
+
+
+@dataclass(frozen=True)
+class Reference:
+    '''Unresolved name as written in the trigger, e.g. my_macd.hist#diff.2'''
+    name: str
+    value: Optional[str] = None
+    process: Optional[str] = None
+    window: Optional[object] = None
+    is_boolean = False
+
+    def resolve(self, resolve_reference):
+        return resolve_reference(self)
+
+    def evaluate(self, operands: dict, params: dict):
+        raise ValueError(f'Reference {self.name} must be resolved before evaluation')
+
+
+@dataclass(frozen=True)
+class Parameter:
+    name: str
+    is_boolean = False
+
+    def resolve(self, resolve_reference):
+        return self
+
+    def evaluate(self, operands: dict, params: dict):
+        if self.name not in params:
+            raise ValueError(f'Parameter {self.name} has no value for this run')
+        return params[self.name]
+
+
+@dataclass(frozen=True)
+class Operand:
+    '''An array input such as close or fast_macd.hist, optionally passed through a process'''
+    key: str
+    process: Optional[str] = None
+    window: Optional[object] = None
+    is_boolean = False
+
+    def resolve(self, resolve_reference):
+        return self
+
+    def evaluate(self, operands: dict, params: dict):
+        array = operands[self.key]
+        if not self.process:
+            return array
+
+        window = self.window.evaluate(operands, params)
+        if int(window) != window:
+            raise ValueError(f'Process window for {self.key} must be a whole number, got {window}')
+
+        return get_processed_array(array, self.process, int(window))
+
+
+@dataclass(frozen=True)
+class Negate:
+    operand: object
+    is_boolean = False
+
+    def resolve(self, resolve_reference):
+        return Negate(self.operand.resolve(resolve_reference))
+
+    def evaluate(self, operands: dict, params: dict):
+        return np.negative(self.operand.evaluate(operands, params))
+
+
+@dataclass(frozen=True)
+class Arithmetic:
+    operator: str
+    left: object
+    right: object
+    is_boolean = False
+
+    def resolve(self, resolve_reference):
+        return Arithmetic(self.operator, self.left.resolve(resolve_reference), self.right.resolve(resolve_reference))
+
+    def evaluate(self, operands: dict, params: dict):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return arithmetic_functions[self.operator](self.left.evaluate(operands, params),
+                                                       self.right.evaluate(operands, params))
+
+
+@dataclass(frozen=True)
+class Comparison:
+    operator: str
+    left: object
+    right: object
+    is_boolean = True
+
+    def resolve(self, resolve_reference):
+        return Comparison(self.operator, self.left.resolve(resolve_reference), self.right.resolve(resolve_reference))
+
+    def evaluate(self, operands: dict, params: dict):
+        left = self.left.evaluate(operands, params)
+        right = self.right.evaluate(operands, params)
+        if self.operator in cross_operators:
+            return get_crossed(left, right, above=self.operator == '|>')
+
+        with np.errstate(invalid='ignore'):
+            return comparison_functions[self.operator](left, right)
+
+
+@dataclass(frozen=True)
+class Logical:
+    operator: str
+    left: object
+    right: object
+    is_boolean = True
+
+    def resolve(self, resolve_reference):
+        return Logical(self.operator, self.left.resolve(resolve_reference), self.right.resolve(resolve_reference))
+
+    def evaluate(self, operands: dict, params: dict):
+        if self.operator == 'and':
+            return np.logical_and(self.left.evaluate(operands, params), self.right.evaluate(operands, params))
+        return np.logical_or(self.left.evaluate(operands, params), self.right.evaluate(operands, params))
+
+
+@dataclass(frozen=True)
+class Not:
+    operand: object
+    is_boolean = True
+
+    def resolve(self, resolve_reference):
+        return Not(self.operand.resolve(resolve_reference))
+
+    def evaluate(self, operands: dict, params: dict):
+        return np.logical_not(self.operand.evaluate(operands, params))
+
+
+class TriggerParser:
+    '''Recursive descent parser, lowest to highest precedence:
+    or, and, not, comparisons/crosses, + -, * / %, unary -, atoms'''
+
+    def __init__(self, trigger: str):
+        self.trigger = trigger
+        self.tokens = tokenize_trigger(trigger)
+        self.position = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError('Trigger cannot be empty')
+
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f'Unexpected "{self.tokens[self.position][1]}" in trigger "{self.trigger}"')
+
+        return node
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def advance(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError(f'Unexpected end of trigger "{self.trigger}"')
+        self.position += 1
+        return token
+
+    def expect(self, text: str):
+        kind, token_text = self.advance()
+        if token_text != text:
+            raise ValueError(f'Expected "{text}" but found "{token_text}" in trigger "{self.trigger}"')
+
+    def expect_boolean(self, node, operator: str):
+        if not node.is_boolean:
+            raise ValueError(f'Operands of "{operator}" must be conditions in trigger "{self.trigger}"')
+        return node
+
+    def expect_numeric(self, node, operator: str):
+        if node.is_boolean:
+            raise ValueError(f'Operands of "{operator}" must be values, not conditions, in trigger "{self.trigger}"')
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == ('keyword', 'or'):
+            self.advance()
+            node = Logical('or', self.expect_boolean(node, 'or'), self.expect_boolean(self.parse_and(), 'or'))
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek() == ('keyword', 'and'):
+            self.advance()
+            node = Logical('and', self.expect_boolean(node, 'and'), self.expect_boolean(self.parse_not(), 'and'))
+        return node
+
+    def parse_not(self):
+        if self.peek() == ('keyword', 'not'):
+            self.advance()
+            return Not(self.expect_boolean(self.parse_not(), 'not'))
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        node = self.parse_sum()
+        kind, text = self.peek()
+        if kind == 'operator' and (text in comparison_functions or text in cross_operators):
+            self.advance()
+            node = Comparison(text, self.expect_numeric(node, text), self.expect_numeric(self.parse_sum(), text))
+        return node
+
+    def parse_sum(self):
+        node = self.parse_product()
+        while self.peek() in (('operator', '+'), ('operator', '-')):
+            operator = self.advance()[1]
+            node = Arithmetic(operator, self.expect_numeric(node, operator),
+                              self.expect_numeric(self.parse_product(), operator))
+        return node
+
+    def parse_product(self):
+        node = self.parse_unary()
+        while self.peek() in (('operator', '*'), ('operator', '/'), ('operator', '%')):
+            operator = self.advance()[1]
+            node = Arithmetic(operator, self.expect_numeric(node, operator),
+                              self.expect_numeric(self.parse_unary(), operator))
+        return node
+
+    def parse_unary(self):
+        if self.peek() == ('operator', '-'):
+            self.advance()
+            return Negate(self.expect_numeric(self.parse_unary(), '-'))
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, text = self.advance()
+        if kind == 'number':
+            return Constant(float(text))
+
+        if kind == 'name':
+            return self.parse_reference(text)
+
+        if text == '(':
+            node = self.parse_or()
+            self.expect(')')
+            return node
+
+        raise ValueError(f'Unexpected "{text}" in trigger "{self.trigger}"')
+
+    def parse_reference(self, name: str):
+        value = None
+        if self.peek() == ('operator', '.'):
+            self.advance()
+            kind, value = self.advance()
+            if kind != 'name':
+                raise ValueError(f'Expected an indicator value after "{name}." in trigger "{self.trigger}"')
+
+        if self.peek() != ('operator', '#'):
+            return Reference(name, value)
+
+        self.advance()
+        kind, process = self.advance()
+        if self.peek() != ('operator', '.'):
+            raise ValueError('Process must be in the format of indicator_alias<.indicator_specifier>'
+                             '#process.process_len (e.g. my_macd.hist#diff.2)')
+        if process not in trigger_processes:
+            raise ValueError(f'Process {process} not valid, expecting diff, mean or median')
+        self.advance()
+
+        kind, window = self.advance()
+        if kind == 'number':
+            window = Constant(float(window))
+        elif kind == 'name':
+            window = Reference(window)
+        else:
+            raise ValueError(f'Invalid process length "{window}" in trigger "{self.trigger}"')
+
+        return Reference(name, value, process, window)
+
+
+def parse_trigger(trigger: str):
+    '''Parses a trigger into an unresolved expression tree, raising ValueError on invalid syntax'''
+    return TriggerParser(trigger).parse()
+
+
+@dataclass(frozen=True)
+class CompiledTrigger:
+    trigger: str
+    root: object
+    operand_keys: frozenset = field(default_factory=frozenset)
+    referenced_aliases: frozenset = field(default_factory=frozenset)
+    parameter_names: frozenset = field(default_factory=frozenset)
+
+    def evaluate(self, operands: dict, params: dict, length: int) -> np.ndarray:
+        '''Evaluates the trigger over the operand arrays with params bound as scalars'''
+        result = self.root.evaluate(operands, params)
+        return np.broadcast_to(np.asarray(result, dtype=bool), (length,))
+
+
+def compile_trigger(trigger: str, indicator_values: dict, parameter_names) -> CompiledTrigger:
+    '''Parses and resolves a trigger, indicator_values maps each alias to (default_value, avlbl_values)'''
+    operand_keys = set()
+    referenced_aliases = set()
+    referenced_parameters = set()
+
+    def resolve_window(window):
+        if isinstance(window, Constant):
+            return window
+        if window.name not in parameter_names:
+            raise ValueError(f'Process length {window.name} is not a number or known parameter')
+        referenced_parameters.add(window.name)
+        return Parameter(window.name)
+
+    def resolve_reference(reference: Reference):
+        window = resolve_window(reference.window) if reference.window else None
+
+        if reference.name in indicator_values:
+            default_value, avlbl_values = indicator_values[reference.name]
+            value = reference.value or default_value
+            if value not in avlbl_values:
+                raise ValueError(f'Value {value} not available for {reference.name}, expecting one of {avlbl_values}')
+            key = f'{reference.name}.{value}'
+            operand_keys.add(key)
+            referenced_aliases.add(reference.name)
+            return Operand(key, reference.process, window)
+
+        if reference.value:
+            raise ValueError(f'Unknown indicator alias {reference.name} in "{trigger}"')
+
+        if reference.name in price_operands:
+            operand_keys.add(reference.name)
+            return Operand(reference.name, reference.process, window)
+
+        if reference.name in parameter_names:
+            if reference.process:
+                raise ValueError(f'Process cannot be applied to parameter {reference.name}')
+            referenced_parameters.add(reference.name)
+            return Parameter(reference.name)
+
+        raise ValueError(f'Unknown name {reference.name} in "{trigger}"')
+
+    for alias in indicator_values:
+        if alias in price_operands or alias in parameter_names:
+            raise ValueError(f'Indicator alias {alias} clashes with a price or parameter name')
+
+    root = parse_trigger(trigger)
+    if not root.is_boolean:
+        raise ValueError(f'Trigger "{trigger}" must be a condition, e.g. a comparison')
+
+    return CompiledTrigger(trigger=trigger,
+                           root=root.resolve(resolve_reference),
+                           operand_keys=frozenset(operand_keys),
+                           referenced_aliases=frozenset(referenced_aliases),
+                           parameter_names=frozenset(referenced_parameters))
+
+
+def get_compiled_trigger(trigger: str, indicator_values: dict, parameter_names) -> CompiledTrigger:
+    '''Returns the compiled trigger, compiling it only the first time this trigger/alias/parameter set is seen'''
+    key = (trigger,
+           tuple(sorted((alias, default_value, tuple(avlbl_values))
+                        for alias, (default_value, avlbl_values) in indicator_values.items())),
+           frozenset(parameter_names))
+    if key not in compiled_triggers:
+        compiled_triggers[key] = compile_trigger(trigger, indicator_values, frozenset(parameter_names))
+
+    return compiled_triggers[key]
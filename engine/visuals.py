@@ -0,0 +1,112 @@
+import pickle
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from plotly.offline import get_plotlyjs
+
+from base_config import BaseConfig
+from engine.process_study_result import get_pf_figure
+from engine.tracing import trace_span
+
+plotly_js_route = '/static/plotly.min.js'
+per_point_trace_attributes = ('x', 'y', 'customdata', 'hovertext', 'text')
+
+
+def get_lttb_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    '''Largest-Triangle-Three-Buckets: picks n_out points of an evenly spaced series that keep its visual shape,
+    first and last points included. Each bucket keeps the point forming the largest triangle with the previous
+    kept point and the average of the next bucket'''
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets between the first and last point, each at least one point wide as n > n_out
+    bucket_edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(np.int64), n)
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    kept = 0
+    for i in range(n_out - 2):
+        start, end, next_end = bucket_edges[i], bucket_edges[i + 1], bucket_edges[i + 2]
+        next_y = y[end:next_end]
+        average_x = (end + next_end - 1) / 2
+        average_y = np.nanmean(next_y) if not np.isnan(next_y).all() else y[kept]
+
+        bucket_x = np.arange(start, end)
+        areas = np.abs((kept - average_x) * (y[start:end] - y[kept]) - (kept - bucket_x) * (average_y - y[kept]))
+        kept = start + (int(np.nanargmax(areas)) if not np.isnan(areas).all() else 0)
+        indices[i + 1] = kept
+
+    return indices
+
+
+def downsample_figure(fig, max_points: int):
+    '''Downsamples, in place, every line trace longer than max_points with LTTB, marker only traces
+    (orders, trades) are sparse and kept whole'''
+    for trace in fig.data:
+        y = getattr(trace, 'y', None)
+        mode = getattr(trace, 'mode', None) or 'lines'
+        if y is None or len(y) <= max_points or 'lines' not in mode:
+            continue
+
+        n = len(y)
+        indices = get_lttb_indices(np.asarray(y, dtype=np.float64), max_points)
+        for attribute in per_point_trace_attributes:
+            value = getattr(trace, attribute, None)
+            if value is not None and not isinstance(value, str) and len(value) == n:
+                trace[attribute] = np.asarray(value)[indices]
+
+    return fig
+
+
+def save_visual_sources(visuals_folder: Path, visual_sources: dict) -> list:
+    '''Pickles each split's (pf, strat runs) so its chart can be rendered later, returns the split names'''
+    visuals_folder.mkdir(parents=True, exist_ok=True)
+    with trace_span('visuals'):
+        for split, visual_source in visual_sources.items():
+            with open(visuals_folder / f'{split}.pickle', 'wb') as f:
+                pickle.dump(visual_source, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return list(visual_sources)
+
+
+def get_visual_splits(visuals_folder: Path) -> list:
+    return sorted(path.stem for path in visuals_folder.glob('*.pickle'))
+
+
+def get_split_figure_html(visuals_folder: Path, split: str, max_points: int = None) -> str:
+    '''Returns the split's chart as a div without plotly.js, which pages load once from plotly_js_route.
+    Renders are kept next to the pickle, a split is only rendered once per max_points'''
+    max_points = max_points or BaseConfig.visuals_max_points
+    html_path = visuals_folder / f'{split}.{max_points}.html'
+    if html_path.exists():
+        return html_path.read_text(encoding='utf-8')
+
+    source_path = visuals_folder / f'{split}.pickle'
+    if not source_path.exists():
+        raise FileNotFoundError(f'No visuals for split {split}')
+
+    with open(source_path, 'rb') as f:
+        pf, strat_runs = pickle.load(f)
+
+    with trace_span('render'):
+        fig = downsample_figure(get_pf_figure(pf, strat_runs), max_points)
+        figure_html = fig.to_html(full_html=False, include_plotlyjs=False)
+    html_path.write_text(figure_html, encoding='utf-8')
+
+    return figure_html
+
+
+def get_visuals_page_html(figure_htmls: dict) -> str:
+    '''One page for the given split divs, plotly.js referenced once'''
+    sections = ''.join(f'<h2>{split}</h2>{figure_html}' for split, figure_html in figure_htmls.items())
+
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<script src="{plotly_js_route}"></script></head><body>{sections}</body></html>')
+
+
+@lru_cache(maxsize=1)
+def get_plotly_js() -> str:
+    return get_plotlyjs()
@@ -0,0 +1,323 @@
+from collections import deque
+
+import numpy as np
+
+
+class RollingWindow:
+    '''Last n values with their running sum and sum of squares, updated in O(1). Statistics are NaN until
+    the window is full and while it holds a NaN, like a rolling window with min periods n'''
+
+    def __init__(self, n: int):
+        self.n = n
+        self.values = deque(maxlen=n)
+        self.total = 0.
+        self.total_squares = 0.
+        self.n_nan = 0
+
+    def append(self, value: float):
+        if len(self.values) == self.n:
+            self.remove(self.values[0])
+
+        self.values.append(value)
+        if np.isnan(value):
+            self.n_nan += 1
+        else:
+            self.total += value
+            self.total_squares += value * value
+
+    def remove(self, value: float):
+        if np.isnan(value):
+            self.n_nan -= 1
+        else:
+            self.total -= value
+            self.total_squares -= value * value
+
+    def is_full(self) -> bool:
+        return len(self.values) == self.n and not self.n_nan
+
+    def mean(self) -> float:
+        return self.total / self.n if self.is_full() else np.nan
+
+    def std(self) -> float:
+        '''Population (ddof=0) standard deviation'''
+        if not self.is_full():
+            return np.nan
+
+        mean = self.total / self.n
+        return np.sqrt(max(self.total_squares / self.n - mean * mean, 0.))
+
+
+class ExponentialMean:
+    '''vbt's exponential moving average (adjust=False) seeded with the first value, NaN for the first span - 1
+    values. NaN inputs are skipped'''
+
+    def __init__(self, span: int):
+        self.span = span
+        self.alpha = 2 / (span + 1)
+        self.value = np.nan
+        self.count = 0
+
+    def update(self, value: float) -> float:
+        if not np.isnan(value):
+            self.count += 1
+            self.value = value if self.count == 1 else (1 - self.alpha) * self.value + self.alpha * value
+
+        return self.value if self.count >= self.span else np.nan
+
+
+def get_true_range(high: float, low: float, prev_close: float) -> float:
+    return max(high - low, abs(high - prev_close), abs(low - prev_close))
+
+
+class IncrementalEma:
+    '''talib EMA, seeded with the simple average of the first timeperiod closes'''
+
+    def __init__(self, timeperiod=30):
+        self.n = int(timeperiod)
+        self.k = 2 / (self.n + 1)
+        self.count = 0
+        self.total = 0.
+        self.value = np.nan
+
+    def update(self, bar: dict) -> dict:
+        self.count += 1
+        if self.count <= self.n:
+            self.total += bar['close']
+            if self.count == self.n:
+                self.value = self.total / self.n
+        else:
+            self.value += self.k * (bar['close'] - self.value)
+
+        return {'real': self.value}
+
+
+class IncrementalMa:
+    '''vbt MA, simple moving average'''
+
+    def __init__(self, window=30):
+        self.window = RollingWindow(int(window))
+
+    def update(self, bar: dict) -> dict:
+        self.window.append(bar['close'])
+        return {'ma': self.window.mean()}
+
+
+class IncrementalMom:
+    '''talib MOM, close minus the close timeperiod bars ago'''
+
+    def __init__(self, timeperiod=10):
+        self.closes = deque(maxlen=int(timeperiod) + 1)
+
+    def update(self, bar: dict) -> dict:
+        self.closes.append(bar['close'])
+        if len(self.closes) < self.closes.maxlen:
+            return {'real': np.nan}
+
+        return {'real': bar['close'] - self.closes[0]}
+
+
+class IncrementalRsi:
+    '''talib RSI, Wilder smoothed average gains and losses seeded with their simple average'''
+
+    def __init__(self, timeperiod=14):
+        self.n = int(timeperiod)
+        self.prev_close = None
+        self.count = 0
+        self.gain = 0.
+        self.loss = 0.
+
+    def update(self, bar: dict) -> dict:
+        close = bar['close']
+        if self.prev_close is None:
+            self.prev_close = close
+            return {'real': np.nan}
+
+        delta = close - self.prev_close
+        self.prev_close = close
+        self.count += 1
+        gain, loss = max(delta, 0.), max(-delta, 0.)
+
+        if self.count <= self.n:
+            self.gain += gain
+            self.loss += loss
+            if self.count < self.n:
+                return {'real': np.nan}
+            self.gain /= self.n
+            self.loss /= self.n
+        else:
+            self.gain = (self.gain * (self.n - 1) + gain) / self.n
+            self.loss = (self.loss * (self.n - 1) + loss) / self.n
+
+        total = self.gain + self.loss
+        return {'real': 100 * self.gain / total if total else 0.}
+
+
+class IncrementalAtr:
+    '''talib ATR, Wilder smoothed true range seeded with its simple average'''
+
+    def __init__(self, timeperiod=14):
+        self.n = int(timeperiod)
+        self.prev_close = None
+        self.count = 0
+        self.value = 0.
+
+    def update(self, bar: dict) -> dict:
+        if self.prev_close is None:
+            self.prev_close = bar['close']
+            return {'real': np.nan}
+
+        true_range = get_true_range(bar['high'], bar['low'], self.prev_close)
+        self.prev_close = bar['close']
+        self.count += 1
+
+        if self.count <= self.n:
+            self.value += true_range
+            if self.count < self.n:
+                return {'real': np.nan}
+            self.value /= self.n
+        else:
+            self.value = (self.value * (self.n - 1) + true_range) / self.n
+
+        return {'real': self.value}
+
+
+class IncrementalMfi:
+    '''talib MFI over the last timeperiod positive and negative money flows'''
+
+    def __init__(self, timeperiod=14):
+        self.n = int(timeperiod)
+        self.prev_typical_price = None
+        self.flows = deque(maxlen=self.n)
+        self.positive_total = 0.
+        self.negative_total = 0.
+
+    def update(self, bar: dict) -> dict:
+        typical_price = (bar['high'] + bar['low'] + bar['close']) / 3
+        if self.prev_typical_price is None:
+            self.prev_typical_price = typical_price
+            return {'real': np.nan}
+
+        money_flow = typical_price * bar['volume']
+        positive = money_flow if typical_price > self.prev_typical_price else 0.
+        negative = money_flow if typical_price < self.prev_typical_price else 0.
+        self.prev_typical_price = typical_price
+
+        if len(self.flows) == self.n:
+            old_positive, old_negative = self.flows[0]
+            self.positive_total -= old_positive
+            self.negative_total -= old_negative
+        self.flows.append((positive, negative))
+        self.positive_total += positive
+        self.negative_total += negative
+
+        if len(self.flows) < self.n:
+            return {'real': np.nan}
+
+        total = self.positive_total + self.negative_total
+        return {'real': 100 * self.positive_total / total if total >= 1 else 0.}
+
+
+class IncrementalAdx:
+    '''talib ADX: directional movements and true range summed over timeperiod - 1 bars then Wilder smoothed,
+    the first ADX is the average of the next timeperiod DXs'''
+
+    def __init__(self, timeperiod=14):
+        self.n = int(timeperiod)
+        self.prev_bar = None
+        self.count = 0
+        self.plus_dm = 0.
+        self.minus_dm = 0.
+        self.true_range = 0.
+        self.dx_total = 0.
+        self.value = np.nan
+
+    def get_dx(self) -> float:
+        if not self.true_range:
+            return None
+
+        plus_di = 100 * self.plus_dm / self.true_range
+        minus_di = 100 * self.minus_dm / self.true_range
+        di_total = plus_di + minus_di
+        return 100 * abs(minus_di - plus_di) / di_total if di_total else None
+
+    def update(self, bar: dict) -> dict:
+        prev_bar, self.prev_bar = self.prev_bar, bar
+        if prev_bar is None:
+            return {'real': np.nan}
+
+        up_move = bar['high'] - prev_bar['high']
+        down_move = prev_bar['low'] - bar['low']
+        plus_dm = up_move if up_move > 0 and up_move > down_move else 0.
+        minus_dm = down_move if down_move > 0 and down_move > up_move else 0.
+        true_range = get_true_range(bar['high'], bar['low'], prev_bar['close'])
+        self.count += 1
+
+        if self.count < self.n:
+            self.plus_dm += plus_dm
+            self.minus_dm += minus_dm
+            self.true_range += true_range
+            return {'real': np.nan}
+
+        self.plus_dm += plus_dm - self.plus_dm / self.n
+        self.minus_dm += minus_dm - self.minus_dm / self.n
+        self.true_range += true_range - self.true_range / self.n
+        dx = self.get_dx()
+
+        if self.count < 2 * self.n:
+            self.dx_total += dx or 0.
+            if self.count == 2 * self.n - 1:
+                self.value = self.dx_total / self.n
+        elif dx is not None:
+            self.value = (self.value * (self.n - 1) + dx) / self.n
+
+        return {'real': self.value}
+
+
+class IncrementalMacd:
+    '''vbt MACD with exponential averages, hist is macd minus its signal line'''
+
+    def __init__(self, fast_window=12, slow_window=26, signal_window=9):
+        self.fast = ExponentialMean(int(fast_window))
+        self.slow = ExponentialMean(int(slow_window))
+        self.signal = ExponentialMean(int(signal_window))
+
+    def update(self, bar: dict) -> dict:
+        macd = self.fast.update(bar['close']) - self.slow.update(bar['close'])
+        signal = self.signal.update(macd)
+
+        return {'macd': macd, 'signal': signal, 'hist': macd - signal}
+
+
+class IncrementalBbands:
+    '''vbt BBANDS, simple average middle band with alpha population standard deviations either side'''
+
+    def __init__(self, window=20, alpha=2):
+        self.window = RollingWindow(int(window))
+        self.alpha = alpha
+
+    def update(self, bar: dict) -> dict:
+        self.window.append(bar['close'])
+        middle = self.window.mean()
+        width = self.alpha * self.window.std()
+        upper, lower = middle + width, middle - width
+
+        return {'lower': lower, 'middle': middle, 'upper': upper, 'bandwidth': (upper - lower) / middle}
+
+
+# indicator library name -> state class, each update takes one closed bar and returns every avlbl_value
+incremental_indicators = {'adx': IncrementalAdx,
+                          'bbands': IncrementalBbands,
+                          'mfi': IncrementalMfi,
+                          'rsi': IncrementalRsi,
+                          'mom': IncrementalMom,
+                          'macd': IncrementalMacd,
+                          'ema': IncrementalEma,
+                          'atr': IncrementalAtr,
+                          'ma': IncrementalMa}
+
+
+def get_incremental_indicator(indicator: str, run_kwargs: dict):
+    if indicator not in incremental_indicators:
+        raise ValueError(f'Indicator {indicator} has no incremental implementation')
+
+    return incremental_indicators[indicator](**run_kwargs)
@@ -1,7 +1,14 @@
+import itertools
+
 import numpy as np
-import vectorbtpro as vbt
-from engine.data.data_manager import convert_std_timeframe_to_pandas_timeframe, reshape_slow_timeframe_data_to_fast
-from indicators.indicator_run_caching import get_cached_indicator_run_result, cache_indicator_run_result
+from base_config import BaseConfig
+from engine.data.data_manager import get_timeframe_alignment_index, align_slow_values_to_fast
+from indicators.indicator_run_caching import get_cached_indicator_run_result, cache_indicator_run_result, \
+    get_data_fingerprint, normalize_run_kwargs, indicator_run_cache, get_guid
+from indicators.indicator_registry import indicator_library, get_indicator_key_value
+
+
+indicator_param_grid_lookups = {}
 
 
 def get_chart_options_value(indicator, data, run_value, shaped_run_result, option: str):
@@ -26,84 +33,164 @@ def get_chart_options_value(indicator, data, run_value, shaped_run_result, optio
 
 
 
-indicator_library = {
-    'adx': {'vbt_indicator': vbt.IF.get_indicator('talib:ADX'),
-            'default_value': 'real',
-            'avlbl_values': ['real'],
-            'data_run_params': ['high', 'low', 'close'],
-            'run_kwargs': {'timeperiod': 14}},
-    'bbands': {'vbt_indicator': vbt.IF.get_indicator('vbt:BBANDS'),
-               'default_value': 'bandwidth',
-               'avlbl_values': ['lower', 'middle', 'upper', 'bandwidth'],
-               'data_run_params': ['close'],
-               'run_kwargs': {'alpha': 2, 'window': 20}},
-                'chart_options': {
-                    'style': {'lower': 'pure', 'middle': 'pure', 'upper': 'pure', 'bandwidth': 'raw'},
-                    'y_val': {'lower': 'close', 'middle': 'close', 'upper': 'close', 'bandwidth': 'self'},
-                    'add_to_orders': {'lower': True, 'middle': True, 'upper': True, 'bandwidth': False},
-
-                },
-    'mfi': {'vbt_indicator': vbt.IF.get_indicator('talib:MFI'),
-            'default_value': 'real',
-            'avlbl_values': ['real'],
-            'data_run_params': ['high', 'low', 'close', 'volume'],
-            'run_kwargs': {'timeperiod': 14}},
-    'rsi': {'vbt_indicator': vbt.IF.get_indicator('talib:RSI'),
-            'default_value': 'real',
-            'avlbl_values': ['real'],
-            'data_run_params': ['close'],
-            'run_kwargs': {'timeperiod': 14}},
-    'mom': {'vbt_indicator': vbt.IF.get_indicator('talib:MOM'),
-            'default_value': 'real',
-            'avlbl_values': ['real'],
-            'data_run_params': ['close'],
-            'run_kwargs': {'timeperiod': 10}},
-    'macd': {'vbt_indicator': vbt.IF.get_indicator('vbt:MACD'),
-             'default_value': 'hist',
-             'avlbl_values': ['macd', 'signal', 'hist'],
-             'data_run_params': ['close'],
-             'run_kwargs': {'fast_window': 12, 'slow_window': 26, 'signal_window': 9},
-             'chart_options': {
-                 'style': {'macd': 'pure', 'signal': 'pure', 'hist': 'pure'},
-                 'y_val': {'macd': 'self', 'signal': 'self', 'hist': 'self'},
-                 'add_to_orders': {'macd': False, 'signal': False, 'hist': False},
-             },
-             },
-    'ema': {'vbt_indicator': vbt.IF.get_indicator('talib:EMA'),
-            'default_value': 'real',
-            'avlbl_values': ['real'],
-            'data_run_params': ['close'],
-            'run_kwargs': {'timeperiod': 30}},
-    'atr': {'vbt_indicator': vbt.IF.get_indicator('talib:ATR'),
-            'default_value': 'real',
-            'avlbl_values': ['real'],
-            'data_run_params': ['high', 'low', 'close'],
-            'run_kwargs': {'timeperiod': 14}},
-    'ma': {'vbt_indicator': vbt.IF.get_indicator('vbt:MA'),
-           'default_value': 'ma',
-           'avlbl_values': ['ma'],
-           'data_run_params': ['close'],
-           'run_kwargs': {'window': 30},
-           'chart_options': {
-               'style': {'ma': 'pure'},
-               'y_val': {'ma': 'close'},
-               'add_to_orders': {'ma': True},
-           },
-           },
-}
-
-
-def get_indicator_key_value(indicator: str, key_value: str):
-    '''Returns the value of the key_value for the indicator,
-    key_value options are 'vbt_indicator', 'default_value', 'avlbl_values', 'data_run_kwargs', 'run_kwargs'''
-    if key_value not in indicator_library[indicator]:
-        raise ValueError(f'key_value must be one of {list(indicator_library[indicator].keys())}')
-    return indicator_library[indicator].get(key_value)
+def get_shaped_run_result(run_output, timeframe, fastest_timeframe_data, fastest_timeframe,
+                          normalize: bool) -> np.ndarray:
+    '''Aligns an indicator output (one column or a block of columns) to the fastest timeframe index'''
+    alignment_index = get_timeframe_alignment_index(slow_index=run_output.index,
+                                                    fast_index=fastest_timeframe_data.index,
+                                                    slow_timeframe=timeframe,
+                                                    fast_timeframe=fastest_timeframe)
+    shaped_run_result = align_slow_values_to_fast(run_output, alignment_index)
+
+    if normalize:
+        close = np.asarray(fastest_timeframe_data.close, dtype=np.float64).reshape(-1)
+        shaped_run_result = shaped_run_result / (close if shaped_run_result.ndim == 1 else close[:, None])
+
+    if shaped_run_result.ndim == 2 and shaped_run_result.shape[1] == 1:
+        shaped_run_result = shaped_run_result.reshape(shaped_run_result.shape[0])
+
+    return shaped_run_result
+
+
+def get_indicator_param_grid(rest_indicator) -> list:
+    '''Returns every run_kwargs combination of an indicator whose ranges are all integer stepped,
+    an empty list when a range is fractional or the grid exceeds max_param_combinations'''
+    if not rest_indicator.run_kwargs:
+        return []
+
+    keys, ranges = [], []
+    for key, value in rest_indicator.run_kwargs.items():
+        value = value if isinstance(value, list) else [value, value]
+        if not all(isinstance(sub_value, int) and not isinstance(sub_value, bool) for sub_value in value):
+            return []
+
+        step = value[2] if len(value) == 3 else 1
+        keys.append(key)
+        ranges.append(range(value[0], value[1] + 1, step))
+
+    n_combinations = int(np.prod([len(key_range) for key_range in ranges]))
+    if not n_combinations or n_combinations > BaseConfig.max_param_combinations:
+        return []
+
+    return [dict(zip(keys, combination)) for combination in itertools.product(*ranges)]
+
+
+def get_grid_nbytes(n_combinations: int, n_bars: int, n_outputs: int = 1) -> int:
+    '''Estimated bytes of n_outputs float64 outputs of a whole parameter grid aligned to n_bars'''
+    return n_combinations * n_bars * 8 * n_outputs
+
+
+def get_indicator_param_grid_lookup(grid_rest_indicator) -> dict:
+    '''Returns the flattened grid run_kwargs and a params -> column lookup, built once per indicator and ranges'''
+    lookup_key = (grid_rest_indicator.indicator, normalize_run_kwargs(grid_rest_indicator.run_kwargs))
+    if lookup_key not in indicator_param_grid_lookups:
+        param_grid = get_indicator_param_grid(grid_rest_indicator)
+        grid_keys = list(param_grid[0]) if param_grid else []
+
+        indicator_param_grid_lookups[lookup_key] = {
+            'grid_run_kwargs': {key: [params[key] for params in param_grid] for key in grid_keys},
+            'column_lookup': {tuple(float(params[key]) for key in grid_keys): i for i, params in enumerate(param_grid)},
+        } if param_grid else None
+
+    return indicator_param_grid_lookups[lookup_key]
+
+
+def get_cached_shaped_output(output_key: tuple, get_run_output, timeframe, fastest_timeframe_data, fastest_timeframe,
+                             normalize: bool, as_rows: bool = False) -> np.ndarray:
+    '''Returns one aligned (and normalized) indicator output, only building it the first time it's asked for,
+    as_rows stores a multi column output as one contiguous row per column'''
+    shaped_output = indicator_run_cache.get(output_key)
+    if shaped_output is None:
+        shaped_output = get_shaped_run_result(get_run_output(),
+                                              timeframe=timeframe,
+                                              fastest_timeframe_data=fastest_timeframe_data,
+                                              fastest_timeframe=fastest_timeframe,
+                                              normalize=normalize)
+        if as_rows:
+            shaped_output = np.ascontiguousarray(shaped_output.reshape(shaped_output.shape[0], -1).T)
+        # shared between trials, nothing downstream may write into it
+        shaped_output.flags.writeable = False
+        indicator_run_cache.set(output_key, shaped_output)
+
+    return shaped_output
+
+
+def get_indicator_grid_run_results(fastest_timeframe_data, fastest_timeframe, timeframe_data, grid_rest_indicator,
+                                   run_kwargs: dict, run_values: list):
+    '''Returns the run results for run_kwargs as row lookups into outputs precomputed over the whole parameter grid,
+    vbt puts one parameter combination per column. None when the indicator has no grid, run_kwargs isn't on it or
+    the grid's outputs don't fit the indicator run cache'''
+    param_grid_lookup = get_indicator_param_grid_lookup(grid_rest_indicator)
+    if not param_grid_lookup or set(param_grid_lookup['grid_run_kwargs']) != set(run_kwargs or {}):
+        return None
+
+    # the cache drops what it can't hold, every trial would rerun and realign the whole grid, single runs are cheaper
+    grid_nbytes = get_grid_nbytes(len(param_grid_lookup['column_lookup']), len(fastest_timeframe_data.index),
+                                  len(run_values))
+    if grid_nbytes > indicator_run_cache.max_bytes:
+        return None
+
+    grid_run_kwargs = param_grid_lookup['grid_run_kwargs']
+    column = param_grid_lookup['column_lookup'].get(tuple(float(run_kwargs[key]) for key in grid_run_kwargs))
+    if column is None:
+        return None
+
+    grid_run_key = ('grid_run',
+                    get_data_fingerprint(timeframe_data, grid_rest_indicator.timeframe),
+                    grid_rest_indicator.indicator,
+                    normalize_run_kwargs(grid_run_kwargs))
+
+    def get_grid_run_object():
+        grid_run_object = indicator_run_cache.get(grid_run_key)
+        if grid_run_object is None:
+            vbt_indicator = get_indicator_key_value(grid_rest_indicator.indicator, 'vbt_indicator')
+            data_run_params = get_indicator_key_value(grid_rest_indicator.indicator, 'data_run_params')
+            data_run_kwargs = {param: getattr(timeframe_data, param) for param in data_run_params}
+
+            grid_run_object = vbt_indicator.run(**data_run_kwargs, **grid_run_kwargs, param_product=False)
+            indicator_run_cache.set(grid_run_key, grid_run_object)
+
+        return grid_run_object
+
+    fastest_fingerprint = get_data_fingerprint(fastest_timeframe_data, fastest_timeframe)
+
+    run_results = {}
+    for run_value in run_values:
+        shaped_rows = get_cached_shaped_output(
+            output_key=grid_run_key + (fastest_fingerprint, bool(grid_rest_indicator.normalize), run_value),
+            get_run_output=lambda: getattr(get_grid_run_object(), run_value),
+            timeframe=grid_rest_indicator.timeframe,
+            fastest_timeframe_data=fastest_timeframe_data,
+            fastest_timeframe=fastest_timeframe,
+            normalize=grid_rest_indicator.normalize,
+            as_rows=True)
+
+        run_results[run_value] = {'shaped_run_result': shaped_rows[column],
+                                  'indicator_run_object': None,
+                                  'data': fastest_timeframe_data}
+
+    return run_results
 
 
 def get_indicator_run_results(fastest_timeframe_data, fastest_timeframe,
-                              timeframe_data, rest_indicator, run_kwargs: dict = None):
-    '''Returns the results of the run_values for the indicator'''
+                              timeframe_data, rest_indicator, run_kwargs: dict = None, grid_rest_indicator=None,
+                              run_values: list = None):
+    '''Returns the results of the requested run_values (all avlbl_values when None) for the indicator.
+    Results are served from the precomputed parameter grid of grid_rest_indicator when one is given,
+    in which case they carry no indicator_run_object'''
+    if run_values is None:
+        run_values = get_indicator_key_value(rest_indicator.indicator, 'avlbl_values')
+
+    if grid_rest_indicator is not None:
+        run_results = get_indicator_grid_run_results(fastest_timeframe_data=fastest_timeframe_data,
+                                                     fastest_timeframe=fastest_timeframe,
+                                                     timeframe_data=timeframe_data,
+                                                     grid_rest_indicator=grid_rest_indicator,
+                                                     run_kwargs=run_kwargs,
+                                                     run_values=run_values)
+        if run_results is not None:
+            return run_results
+
     vbt_indicator = get_indicator_key_value(rest_indicator.indicator, 'vbt_indicator')
 
     if not run_kwargs:
@@ -113,39 +200,37 @@ def get_indicator_run_results(fastest_timeframe_data, fastest_timeframe,
 
     data_run_kwargs = {}
     for param in data_run_params:
-        data_run_kwargs[param] = eval(f'timeframe_data.{param}')
+        data_run_kwargs[param] = getattr(timeframe_data, param)
 
     indicator_run_object = get_cached_indicator_run_result(data_instance=timeframe_data,
                                                            indicator=rest_indicator.indicator,
-                                                           run_kwargs=run_kwargs)
-    if not indicator_run_object:
+                                                           run_kwargs=run_kwargs,
+                                                           timeframe=rest_indicator.timeframe)
+    if indicator_run_object is None:
         indicator_run_object = vbt_indicator.run(**data_run_kwargs, **run_kwargs)
 
         cache_indicator_run_result(run_result=indicator_run_object,
                                    data_instance=timeframe_data,
                                    indicator=rest_indicator.indicator,
-                                   run_kwargs=run_kwargs)
+                                   run_kwargs=run_kwargs,
+                                   timeframe=rest_indicator.timeframe)
 
-    avlbl_values = get_indicator_key_value(rest_indicator.indicator, 'avlbl_values')
+    output_key = ('shaped_output',
+                  get_guid(timeframe_data, rest_indicator.indicator, run_kwargs, rest_indicator.timeframe),
+                  get_data_fingerprint(fastest_timeframe_data, fastest_timeframe),
+                  bool(rest_indicator.normalize))
 
     run_results = {}
-    for run_value in avlbl_values:
-        pandas_timeframe = convert_std_timeframe_to_pandas_timeframe(fastest_timeframe)
-        shaped_run_result = eval(f'indicator_run_object.{run_value}').resample(pandas_timeframe).asfreq().ffill()
-        shaped_run_result = reshape_slow_timeframe_data_to_fast(slow_timeframe_data=shaped_run_result,
-                                                                fastest_timeframe_index=fastest_timeframe_data.index)
-
-        if rest_indicator.normalize:
-            shaped_run_result = shaped_run_result / fastest_timeframe_data.close
-
-        shaped_run_result = np.array(shaped_run_result)
-        shaped_run_result = shaped_run_result.reshape(shaped_run_result.shape[0])
+    for run_value in run_values:
+        shaped_run_result = get_cached_shaped_output(output_key=output_key + (run_value,),
+                                                     get_run_output=lambda: getattr(indicator_run_object, run_value),
+                                                     timeframe=rest_indicator.timeframe,
+                                                     fastest_timeframe_data=fastest_timeframe_data,
+                                                     fastest_timeframe=fastest_timeframe,
+                                                     normalize=rest_indicator.normalize)
 
         run_results[run_value] = {'shaped_run_result': shaped_run_result,
                                   'indicator_run_object': indicator_run_object,
                                   'data': fastest_timeframe_data}
 
     return run_results
-
-
-
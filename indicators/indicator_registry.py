@@ -0,0 +1,88 @@
+from functools import lru_cache
+
+# static indicator metadata, importable without vectorbtpro so request validation stays cheap. 'factory' names the
+# vbt.IF.get_indicator factory, built on first use by get_vbt_indicator
+indicator_library = {
+    'adx': {'factory': 'talib:ADX',
+            'default_value': 'real',
+            'avlbl_values': ['real'],
+            'data_run_params': ['high', 'low', 'close'],
+            'run_kwargs': {'timeperiod': 14}},
+    'bbands': {'factory': 'vbt:BBANDS',
+               'default_value': 'bandwidth',
+               'avlbl_values': ['lower', 'middle', 'upper', 'bandwidth'],
+               'data_run_params': ['close'],
+               'run_kwargs': {'alpha': 2, 'window': 20},
+               'chart_options': {
+                   'style': {'lower': 'pure', 'middle': 'pure', 'upper': 'pure', 'bandwidth': 'raw'},
+                   'y_val': {'lower': 'close', 'middle': 'close', 'upper': 'close', 'bandwidth': 'self'},
+                   'add_to_orders': {'lower': True, 'middle': True, 'upper': True, 'bandwidth': False},
+               },
+               },
+    'mfi': {'factory': 'talib:MFI',
+            'default_value': 'real',
+            'avlbl_values': ['real'],
+            'data_run_params': ['high', 'low', 'close', 'volume'],
+            'run_kwargs': {'timeperiod': 14}},
+    'rsi': {'factory': 'talib:RSI',
+            'default_value': 'real',
+            'avlbl_values': ['real'],
+            'data_run_params': ['close'],
+            'run_kwargs': {'timeperiod': 14}},
+    'mom': {'factory': 'talib:MOM',
+            'default_value': 'real',
+            'avlbl_values': ['real'],
+            'data_run_params': ['close'],
+            'run_kwargs': {'timeperiod': 10}},
+    'macd': {'factory': 'vbt:MACD',
+             'default_value': 'hist',
+             'avlbl_values': ['macd', 'signal', 'hist'],
+             'data_run_params': ['close'],
+             'run_kwargs': {'fast_window': 12, 'slow_window': 26, 'signal_window': 9},
+             'chart_options': {
+                 'style': {'macd': 'pure', 'signal': 'pure', 'hist': 'pure'},
+                 'y_val': {'macd': 'self', 'signal': 'self', 'hist': 'self'},
+                 'add_to_orders': {'macd': False, 'signal': False, 'hist': False},
+             },
+             },
+    'ema': {'factory': 'talib:EMA',
+            'default_value': 'real',
+            'avlbl_values': ['real'],
+            'data_run_params': ['close'],
+            'run_kwargs': {'timeperiod': 30}},
+    'atr': {'factory': 'talib:ATR',
+            'default_value': 'real',
+            'avlbl_values': ['real'],
+            'data_run_params': ['high', 'low', 'close'],
+            'run_kwargs': {'timeperiod': 14}},
+    'ma': {'factory': 'vbt:MA',
+           'default_value': 'ma',
+           'avlbl_values': ['ma'],
+           'data_run_params': ['close'],
+           'run_kwargs': {'window': 30},
+           'chart_options': {
+               'style': {'ma': 'pure'},
+               'y_val': {'ma': 'close'},
+               'add_to_orders': {'ma': True},
+           },
+           },
+}
+
+
+@lru_cache(maxsize=None)
+def get_vbt_indicator(indicator: str):
+    '''The indicator's vbt indicator class, its factory (and vectorbtpro) is only imported and built on first use,
+    once per process'''
+    import vectorbtpro as vbt
+
+    return vbt.IF.get_indicator(indicator_library[indicator]['factory'])
+
+
+def get_indicator_key_value(indicator: str, key_value: str):
+    '''Returns the value of the key_value for the indicator,
+    key_value options are 'vbt_indicator', 'default_value', 'avlbl_values', 'data_run_kwargs', 'run_kwargs'''
+    if key_value == 'vbt_indicator':
+        return get_vbt_indicator(indicator)
+    if key_value not in indicator_library[indicator]:
+        raise ValueError(f'key_value must be one of {list(indicator_library[indicator].keys())}')
+    return indicator_library[indicator].get(key_value)
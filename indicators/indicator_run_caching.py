@@ -1,31 +1,164 @@
-cached_results = {}
+import sys
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
 
+import numpy as np
+import pandas as pd
 
-def get_guid(data_instance, indicator: str, run_kwargs: dict = None):
-    '''Returns a guid from data_instance, indicator, timeframe, run_kwargs'''
-    return f'{id(data_instance)}_{indicator}_{run_kwargs}'
+from base_config import BaseConfig
 
+ohlcv_fields = ('open', 'high', 'low', 'close', 'volume')
+# id(data instance) -> (weak reference to it, its content crc32), data instances are never modified in place
+data_crcs = {}
 
-def get_cached_indicator_run_result(data_instance, indicator: str, run_kwargs: dict = None):
-    '''Returns the cached results of the run_values for the indicator'''
 
-    guid = get_guid(data_instance, indicator, run_kwargs)
-    if guid not in cached_results:
-        return None
+def get_data_crc(data_instance) -> int:
+    '''crc32 over the whole index and every OHLCV column of the data instance, computed once per instance'''
+    key = id(data_instance)
+    cached = data_crcs.get(key)
+    if cached is not None and cached[0]() is data_instance:
+        return cached[1]
 
-    return cached_results[guid]
+    crc = zlib.crc32(np.ascontiguousarray(pd.DatetimeIndex(data_instance.index).asi8))
+    for field in ohlcv_fields:
+        values = getattr(data_instance, field, None)
+        if values is not None:
+            crc = zlib.crc32(np.ascontiguousarray(np.asarray(values, dtype=np.float64)), crc)
 
+    try:
+        data_crcs[key] = (weakref.ref(data_instance, lambda _: data_crcs.pop(key, None)), crc)
+    except TypeError:  # not weak referenceable, hashed on every call
+        pass
 
-def cache_indicator_run_result(run_result, data_instance, indicator: str, run_kwargs: dict = None):
-    '''Caches the results of the run_values for the indicator'''
+    return crc
 
-    guid = get_guid(data_instance, indicator, run_kwargs)
-    if guid in cached_results:
-        raise ValueError(f'{guid} already exists in cached_results')
 
-    cached_results[guid] = run_result
+def get_data_fingerprint(data_instance, timeframe: str = None) -> tuple:
+    '''Content fingerprint of a vbt data instance: symbol, timeframe, first/last timestamp, length and a crc32
+    over all of its timestamps and OHLCV values, so data differing in any bar or field fingerprints differently'''
+    index = data_instance.index
+    symbols = tuple(getattr(data_instance, 'symbols', None) or ())
+
+    return (symbols, timeframe, str(index[0]) if len(index) else None, str(index[-1]) if len(index) else None,
+            len(index), get_data_crc(data_instance))
+
+
+def normalize_run_kwargs(run_kwargs: dict = None) -> tuple:
+    '''Order independent run_kwargs key where 10 and 10.0 are the same value'''
+    normalized = []
+    for key, value in sorted((run_kwargs or {}).items()):
+        if isinstance(value, (list, tuple)):
+            value = tuple(float(sub_value) for sub_value in value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(value)
+        normalized.append((key, value))
+
+    return tuple(normalized)
+
+
+def get_nbytes(value) -> int:
+    '''Approximate bytes held by an indicator run result, its outputs included'''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return int(np.sum(value.memory_usage(index=False, deep=False)))
+    if isinstance(value, dict):
+        return sum(get_nbytes(sub_value) for sub_value in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(get_nbytes(sub_value) for sub_value in value)
+
+    output_names = getattr(value, 'output_names', None)
+    if output_names:
+        return sum(get_nbytes(getattr(value, output_name)) for output_name in output_names)
+
+    return sys.getsizeof(value)
+
+
+class IndicatorRunCache:
+    '''Thread safe LRU cache bounded by the total bytes of its entries'''
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    def set(self, key, value, nbytes: int = None):
+        nbytes = get_nbytes(value) if nbytes is None else nbytes
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+
+            if nbytes > self.max_bytes:
+                return
+
+            self.entries[key] = (value, nbytes)
+            self.total_bytes += nbytes
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes: int):
+        '''Drops least recently used entries until the cache holds at most max_bytes'''
+        with self.lock:
+            while self.entries and self.total_bytes > max_bytes:
+                _, (_, nbytes) = self.entries.popitem(last=False)
+                self.total_bytes -= nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries),
+                    'bytes': self.total_bytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+indicator_run_cache = IndicatorRunCache(max_bytes=BaseConfig.indicator_run_cache_max_bytes)
+
+
+def get_guid(data_instance, indicator: str, run_kwargs: dict = None, timeframe: str = None) -> tuple:
+    '''Returns the cache key from the data fingerprint, indicator and normalized run_kwargs'''
+    return get_data_fingerprint(data_instance, timeframe), indicator, normalize_run_kwargs(run_kwargs)
+
+
+def get_cached_indicator_run_result(data_instance, indicator: str, run_kwargs: dict = None, timeframe: str = None):
+    '''Returns the cached results of the run_values for the indicator, None on a miss'''
+    return indicator_run_cache.get(get_guid(data_instance, indicator, run_kwargs, timeframe))
+
+
+def cache_indicator_run_result(run_result, data_instance, indicator: str, run_kwargs: dict = None,
+                               timeframe: str = None):
+    '''Caches the results of the run_values for the indicator, replacing any previous result for the key'''
+    indicator_run_cache.set(get_guid(data_instance, indicator, run_kwargs, timeframe), run_result)
+
+
+def get_indicator_run_cache_stats() -> dict:
+    return indicator_run_cache.get_stats()
 
 
 def clear_indicator_run_cache():
-    '''Clears the cached_results'''
-    cached_results.clear()
\ No newline at end of file
+    '''Clears the indicator run cache, counters are kept'''
+    indicator_run_cache.clear()
@@ -1,15 +1,18 @@
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, List
-import vectorbtpro as vbt
-import pandas as pd
+from typing import Optional, List, TYPE_CHECKING
 import pytz
 from base_config import BaseConfig, valid_sources, valid_symbols, bad_operators, bad_aliases, arithmetic_operators, \
-    comparison_operators, flow_operators, valid_timeframes
+    comparison_operators, flow_operators, valid_timeframes, valid_pruners
+from engine.trigger_parsing import parse_trigger, tokenize_trigger
 from engine.utils import get_periods_in_testing_period
-from indicators.indicator_library import indicator_library, get_indicator_key_value
+from indicators.indicator_registry import indicator_library, get_indicator_key_value
 import json
 
+if TYPE_CHECKING:  # validation only needs the registry, vbt and pandas load with the engine
+    import pandas as pd
+    import vectorbtpro as vbt
+
 
 @dataclass
 class TestingPeriod(json.JSONEncoder):
@@ -104,25 +107,14 @@ class TriggerPair(json.JSONEncoder):
 
     def validate(self):
         for trigger in [self.entry, self.exit]:
-            if '#' in trigger:
-                for word in trigger.split():
-                    if '#' not in word:
-                        continue
-                    split_word = word.split('#')
-
-                    if '.' not in split_word[1]:
-                        raise ValueError('Process must be in the format of indicator_alias<.indicator_specifier>'
-                                         '#process.process_len (e.g. my_macd.hist#diff.2)')
-                    process = split_word[1].split('.')[0]
-                    if process not in ['diff', 'mean', 'median']:
-                        raise ValueError(f'Process {process} not valid, expecting diff, mean or median')
-
             if len(trigger) > BaseConfig.max_trigger_len:
                 raise ValueError(f'Entry or exit conditions exceed max length of {BaseConfig.max_trigger_len}')
 
-            for bad_operator in bad_operators:
-                if bad_operator in trigger or bad_operator in trigger:
-                    raise ValueError(f'Invalid operator {bad_operator} in entry or exit conditions')
+            for kind, text in tokenize_trigger(trigger):
+                if text in bad_operators:
+                    raise ValueError(f'Invalid operator {text} in entry or exit conditions')
+
+            parse_trigger(trigger)
 
         if len(self.alias) > 30:
             raise ValueError(f'Alias {self.alias} must be at most 30 characters')
@@ -134,7 +126,7 @@ class TriggerPair(json.JSONEncoder):
 
 @dataclass
 class BtRequest(json.JSONEncoder):
-    symbol: str
+    symbol: str | List[str]  # a list runs the strategy on every symbol as the columns of one portfolio
     testing_period: TestingPeriod | dict
     indicators: List[RestIndicator] | List[dict]
     custom_ranges: Optional[dict]
@@ -145,6 +137,8 @@ class BtRequest(json.JSONEncoder):
     fee: Optional[float] = 0.0
     slippage: Optional[float] = 0.0
     n_trials: Optional[int] = 10
+    trial_batch_size: Optional[int] = 1
+    precompute_indicators: Optional[bool] = False
     objective_value: Optional[str] = 'sharpe_ratio'
     parameter_merge: Optional[str] = 'concat'
     cross_validate: Optional[str] = 'none'
@@ -152,6 +146,11 @@ class BtRequest(json.JSONEncoder):
     source: str = 'binance'
     direction: str = 'long'  # 'short | long | both'
     get_signal: bool = False
+    seed: Optional[int] = None
+    keep_top_k: Optional[int] = 1  # standard studies re-simulate this many of the best trials
+    pruner: Optional[str] = None  # 'median' | 'successive_halving' | 'hyperband'
+    pruning_segments: Optional[int] = 4
+    get_diagnostics: Optional[bool] = False  # per stage span timings in the result
 
     def __repr__(self):
         return f'BtRequest: {self.__dict__}'
@@ -159,10 +158,22 @@ class BtRequest(json.JSONEncoder):
     # todo <- create jsonify and de-jsonify methods and clean up doing this in scraps
 
     def __post_init__(self):
-        self.trigger_pairs = [TriggerPair.from_dict(trigger_pair) for trigger_pair in self.trigger_pairs]
+        # pydantic builds the pairs of a request nested in another body itself
+        self.trigger_pairs = [trigger_pair if isinstance(trigger_pair, TriggerPair)
+                              else TriggerPair.from_dict(trigger_pair) for trigger_pair in self.trigger_pairs]
         self.validate()
         print(1)
 
+    def get_symbols(self) -> list:
+        return [self.symbol] if isinstance(self.symbol, str) else list(self.symbol)
+
+    def is_multi_symbol(self) -> bool:
+        return len(self.get_symbols()) > 1
+
+    def is_cross_validated(self) -> bool:
+        # 'none', the default, as well as null run a standard study
+        return self.cross_validate not in (None, 'none')
+
     def to_json(self):
         indicator_dicts = []
         for indicator in self.indicators:
@@ -193,6 +204,32 @@ class BtRequest(json.JSONEncoder):
         if len(self.indicators) > BaseConfig.max_indicators:
             raise ValueError(f'Too many indicators, max {BaseConfig.max_indicators}')
 
+        if not 1 <= self.trial_batch_size <= BaseConfig.max_trial_batch_size:
+            raise ValueError(f'Trial batch size must be between 1 and {BaseConfig.max_trial_batch_size}')
+
+        if not 1 <= self.keep_top_k <= BaseConfig.max_keep_top_k:
+            raise ValueError(f'Keep top k must be between 1 and {BaseConfig.max_keep_top_k}')
+
+        symbols = self.get_symbols()
+        if not symbols or not all(isinstance(symbol, str) for symbol in symbols):
+            raise ValueError('Symbol must be a string or a non empty list of strings')
+
+        if len(set(symbols)) != len(symbols):
+            raise ValueError('Symbols must be unique')
+
+        if len(symbols) > BaseConfig.max_symbols:
+            raise ValueError(f'Too many symbols, max {BaseConfig.max_symbols}')
+
+        if self.is_multi_symbol() and (self.is_cross_validated() or self.pruner):
+            raise ValueError('Multi symbol requests support neither cross validation nor pruning, '
+                             'set cross_validate to none and pruner to null')
+
+        if self.pruner and self.pruner not in valid_pruners:
+            raise ValueError(f'Invalid pruner: {self.pruner}, expecting one of {valid_pruners}')
+
+        if not 2 <= self.pruning_segments <= BaseConfig.max_pruning_segments:
+            raise ValueError(f'Pruning segments must be between 2 and {BaseConfig.max_pruning_segments}')
+
         for key, value in self.custom_ranges.items():
             if len(value) not in [2, 3]:
                 raise ValueError(f'Custom range {key} must have 2 or 3 values')
@@ -213,6 +250,13 @@ class BtRequest(json.JSONEncoder):
        #                          f'{BaseConfig.max_periods_in_testing_period} for timeframe {timeframe}')
 
 
+@dataclass
+class LiveSessionRequest:
+    '''A request and the fixed params, e.g. a study's best params, to follow live'''
+    bt_request: BtRequest
+    params: dict
+
+
 @dataclass
 class IndicatorDataRequest(json.JSONEncoder):
     source: str
@@ -239,20 +283,21 @@ class IndicatorDataRequest(json.JSONEncoder):
 @dataclass
 class CvResult:
     '''Consists of multiple study results and test results'''
-    cv_df: pd.DataFrame
-    final_test_best_pf: vbt.Portfolio
-    final_test_actual_pf: pd.DataFrame
-    html_visuals: dict
+    cv_df: 'pd.DataFrame'
+    final_test_best_pf: 'vbt.Portfolio'
+    final_test_actual_pf: 'pd.DataFrame'
+    visual_sources: dict  # split -> (pf, strat runs), rendered on demand by engine.visuals
     signal: Optional[dict] = None
 
 
 @dataclass
 class StandardResult:
-    optuna_df: pd.DataFrame
+    optuna_df: 'pd.DataFrame'
     best_params: dict
     best_objective_value: float
     best_trial_pf_stats: dict
-    best_trial_pf_visuals_html: str
+    top_trials: list  # keep_top_k best trials, best first: number, params, value, symbol values and pf stats
+    visual_sources: dict  # split -> (pf, strat runs), rendered on demand by engine.visuals
     signal: Optional[dict] = None
 
 
@@ -1,9 +1,27 @@
+import asyncio
+import json
+
+from fastapi import HTTPException, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, HTMLResponse, Response, PlainTextResponse
+
+from base_config import BaseConfig
+
+from engine.data.data_warmer import data_warmer
+from engine.job_queue import job_queue, JobQueueFullError
+from engine.live_signals import create_live_session, get_live_session, remove_live_session
 from engine.process_requests import run_study
+from engine.progress import read_progress_events
+from engine.result_cache import result_cache
+from engine.memory_budget import request_memory
+from engine.tracing import request_trace, metrics_registry, get_trace_dict, get_trace_diagnostics, \
+    get_metrics_text
+from engine.visuals import get_visual_splits, get_split_figure_html, get_visuals_page_html, get_plotly_js, \
+    plotly_js_route
 from engine.process_study_result import get_standard_result_from_study
 from indicators.indicator_data import get_indicator_data
 from main import app
 import pandas as pd
-from models import IndicatorDataRequest, BtRequest
+from models import IndicatorDataRequest, BtRequest, LiveSessionRequest
 
 
 @app.get("/")
@@ -12,19 +30,221 @@ async def root():
 
 
 @app.post("/bt")
-async def say_hello(bt_request: BtRequest):
+def say_hello(bt_request: BtRequest):  # sync so it runs in the threadpool instead of blocking the event loop
     try:
-        processed_result = run_study(bt_request)
-        final_test_stats = processed_result.final_test_best_pf.stats()
+        # the API process serves other requests too, only this request's own bytes count against its budget
+        with request_trace() as trace, request_memory(shared_process=True) as memory:
+            processed_result = run_study(bt_request)
+            final_test_stats = processed_result.final_test_best_pf.stats()
+        trace_dict = get_trace_dict(trace)
+        metrics_registry.observe(trace_dict)
         # todo rather return all training and test HTML pages for each train/split block
         print(1)
 
-        return {"message": f"Hello world"}
+        if bt_request.get_diagnostics:
+            return {"message": f"Hello world", "memory": memory.to_dict(),
+                    "diagnostics": get_trace_diagnostics(trace_dict)}
+        return {"message": f"Hello world", "memory": memory.to_dict()}
     except Exception as e:
         print(e)
         return {"message": f"Error: {e}"}
 
 
+@app.on_event("startup")
+def start_data_warmer():
+    if BaseConfig.data_warmer_enabled:
+        data_warmer.start()
+
+
+@app.on_event("shutdown")
+def shutdown_job_queue():
+    job_queue.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_data_warmer():
+    data_warmer.stop(timeout=BaseConfig.fetch_timeout_seconds)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    '''Prometheus scrape target: per span request histograms, cache hit rates and in flight jobs'''
+    return get_metrics_text(job_queue.get_stats(), result_cache.get_stats())
+
+
+@app.get("/data/freshness")
+def get_data_freshness():
+    '''Freshness of every watched symbol/timeframe in the local store'''
+    return data_warmer.get_freshness()
+
+
+def get_job_or_404(job_id: str):
+    job = job_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f'Unknown job: {job_id}')
+
+    return job
+
+
+@app.post("/jobs", status_code=202)
+def submit_job(bt_request: BtRequest):  # sync, the result cache lookup hashes the request's stored bars
+    try:
+        job = job_queue.submit(bt_request)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return job.get_status_dict()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    return get_job_or_404(job_id).get_status_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status != 'completed':
+        raise HTTPException(status_code=409, detail=job.get_status_dict())
+
+    return job_queue.get_result(job_id)
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    get_job_or_404(job_id)
+    return job_queue.cancel(job_id).get_status_dict()
+
+
+async def iter_job_events(job, offset: int = 0):
+    '''Yields (offset, event) for the job's progress events as they are written and a final status event'''
+    while True:
+        # checked before reading so every event written before the job finished is read
+        done = job.future.done()
+        for offset, event in read_progress_events(job.progress_path, offset):
+            yield offset, event
+
+        if done:
+            yield offset, {'type': 'status', **job.get_status_dict()}
+            return
+
+        await asyncio.sleep(BaseConfig.progress_poll_seconds)
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, last_event_id: int = Header(default=0)):
+    '''Server-Sent Events of the job's progress, reconnecting clients resume after Last-Event-ID'''
+    job = get_job_or_404(job_id)
+
+    async def get_event_stream():
+        async for offset, event in iter_job_events(job, offset=last_event_id):
+            yield f'id: {offset}\nevent: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+
+    return StreamingResponse(get_event_stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache'})
+
+
+@app.websocket("/jobs/{job_id}/ws")
+async def job_events_websocket(websocket: WebSocket, job_id: str, offset: int = 0):
+    job = job_queue.get_job(job_id)
+    if job is None:
+        await websocket.close(code=4404)
+        return
+
+    await websocket.accept()
+    try:
+        async for offset, event in iter_job_events(job, offset=offset):
+            await websocket.send_json({'offset': offset, **event})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+def get_visuals_folder_and_splits(result_id: str) -> tuple:
+    visuals_folder = result_cache.get_visuals_folder(result_id)
+    visual_splits = get_visual_splits(visuals_folder) if result_id.isalnum() else []
+    if not visual_splits:
+        raise HTTPException(status_code=404, detail=f'No visuals for result: {result_id}')
+
+    return visuals_folder, visual_splits
+
+
+@app.get("/results/{result_id}/visuals", response_class=HTMLResponse)
+def get_result_visuals(result_id: str, max_points: int = BaseConfig.visuals_max_points):
+    '''Renders every split of a result on one page, sync so rendering runs in the threadpool'''
+    visuals_folder, visual_splits = get_visuals_folder_and_splits(result_id)
+    with request_trace('visuals_request') as trace:
+        page_html = get_visuals_page_html({split: get_split_figure_html(visuals_folder, split, max_points=max_points)
+                                           for split in visual_splits})
+    metrics_registry.observe(get_trace_dict(trace))
+
+    return page_html
+
+
+@app.get("/results/{result_id}/visuals/{split}", response_class=HTMLResponse)
+def get_result_split_visuals(result_id: str, split: str, max_points: int = BaseConfig.visuals_max_points):
+    visuals_folder, visual_splits = get_visuals_folder_and_splits(result_id)
+    if split not in visual_splits:
+        raise HTTPException(status_code=404, detail=f'No visuals for split: {split}, expecting one of {visual_splits}')
+
+    with request_trace('visuals_request') as trace:
+        page_html = get_visuals_page_html({split: get_split_figure_html(visuals_folder, split, max_points=max_points)})
+    metrics_registry.observe(get_trace_dict(trace))
+
+    return page_html
+
+
+@app.get(plotly_js_route)
+async def get_plotly_js_bundle():
+    return Response(get_plotly_js(), media_type='application/javascript',
+                    headers={'Cache-Control': 'public, max-age=31536000, immutable'})
+
+
+def get_live_session_or_404(session_id: str):
+    session = get_live_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f'Unknown live session: {session_id}')
+
+    return session
+
+
+@app.post("/signals/sessions", status_code=201)
+def create_signal_session(live_session_request: LiveSessionRequest):
+    '''Warms a live signal session up on the request's testing period, sync so the warm up runs in the threadpool'''
+    try:
+        session_id = create_live_session(live_session_request.bt_request, live_session_request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return {'session_id': session_id, 'signal': get_live_session(session_id).last_signal}
+
+
+@app.get("/signals/sessions/{session_id}")
+def poll_signal_session(session_id: str):
+    '''Processes the bars closed since the session's last bar and returns their signals'''
+    session = get_live_session_or_404(session_id)
+    signals = session.poll()
+
+    return {'signals': signals, 'signal': session.last_signal}
+
+
+@app.post("/signals/sessions/{session_id}/bars")
+def push_signal_session_bars(session_id: str, bars: list[list[float]]):
+    '''Processes pushed closed bars, each [open time ms, open, high, low, close, volume] like exchange klines'''
+    session = get_live_session_or_404(session_id)
+    signals = [session.update(int(bar[0]) * 10 ** 6, *bar[1:6]) for bar in bars]
+
+    return {'signals': signals, 'signal': session.last_signal}
+
+
+@app.delete("/signals/sessions/{session_id}")
+def delete_signal_session(session_id: str):
+    if not remove_live_session(session_id):
+        raise HTTPException(status_code=404, detail=f'Unknown live session: {session_id}')
+
+    return {'session_id': session_id, 'removed': True}
+
+
 @app.post("/indicators")
 async def get_indicator_data_post(indicator_data_request: IndicatorDataRequest):  # todo <- convert to object
     indicator_data = get_indicator_data(indicator_data_request)
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+from fastapi import FastAPI, Response
+
+interval_ms = {'1m': 60_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000, '1h': 3_600_000,
+               '2h': 7_200_000, '4h': 14_400_000, '8h': 28_800_000, '12h': 43_200_000, '1d': 86_400_000}
+
+
+def get_synthetic_klines(open_times_ms: np.ndarray, interval: str) -> list:
+    '''Deterministic klines in the exchange's row format, the same open time always gives the same bar'''
+    phase = open_times_ms / 86_400_000
+    open_ = 100 + 10 * np.sin(phase)
+    close = 100 + 10 * np.sin(phase + interval_ms[interval] / 86_400_000)
+    high = np.maximum(open_, close) + 1
+    low = np.minimum(open_, close) - 1
+    volume = 1 + (open_times_ms // interval_ms['1m']) % 7
+
+    return [[int(open_time), str(o), str(h), str(l), str(c), str(v), int(open_time) + interval_ms[interval] - 1,
+             '0', 0, '0', '0', '0']
+            for open_time, o, h, l, c, v in zip(open_times_ms, open_, high, low, close, volume)]
+
+
+def create_mock_exchange_app(weight_limit_per_minute: int = 6000, fail_first_n: int = 0,
+                             listed_at_ms: int = 0, latency_seconds: float = 0) -> FastAPI:
+    '''Local stand in for the exchange klines endpoint: synthetic klines, per minute weight accounting
+    answered with 429 and Retry-After past the limit, and fail_first_n requests answered with 503'''
+    app = FastAPI()
+    app.state.requests = []
+    app.state.used_weight = {}
+
+    @app.get('/api/v3/klines')
+    async def klines(symbol: str, interval: str, startTime: int, endTime: int, limit: int = 500):
+        if latency_seconds:
+            await asyncio.sleep(latency_seconds)
+
+        app.state.requests.append((symbol, interval, startTime, endTime, limit))
+        minute = int(time.time() // 60)
+        app.state.used_weight[minute] = app.state.used_weight.get(minute, 0) + 2
+        headers = {'X-MBX-USED-WEIGHT-1m': str(app.state.used_weight[minute])}
+
+        if len(app.state.requests) <= fail_first_n:
+            return Response(status_code=503, headers=headers)
+        if app.state.used_weight[minute] > weight_limit_per_minute:
+            return Response(status_code=429, headers={**headers, 'Retry-After': '1'})
+
+        step = interval_ms[interval]
+        first_open = max(startTime, listed_at_ms)
+        first_open += -first_open % step
+        open_times_ms = np.arange(first_open, endTime + 1, step, dtype=np.int64)[:limit]
+
+        return Response(content=json.dumps(get_synthetic_klines(open_times_ms, interval)),
+                        media_type='application/json', headers=headers)
+
+    return app
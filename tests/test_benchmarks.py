@@ -0,0 +1,54 @@
+import numpy as np
+
+from benchmarks.baseline import compare_to_baseline
+from benchmarks.synthetic_data import get_synthetic_ohlcv, write_synthetic_data
+from engine.data.local_store import get_local_store
+
+hour_ns = 3600 * 10 ** 9
+
+
+def get_result(function: str, median_seconds: float) -> dict:
+    return {'function': function, 'bars': 10_000, 'n_indicators': 1, 'timeframes': ['1m', '1h'],
+            'median_seconds': median_seconds}
+
+
+def test_synthetic_ohlcv_is_deterministic():
+    timestamps, ohlcv = get_synthetic_ohlcv(1000, '1h', start_ns=0, seed=3)
+    same_timestamps, same_ohlcv = get_synthetic_ohlcv(1000, '1h', start_ns=0, seed=3)
+
+    np.testing.assert_array_equal(timestamps, same_timestamps)
+    for field, values in ohlcv.items():
+        np.testing.assert_array_equal(values, same_ohlcv[field])
+    assert np.all(ohlcv['high'] >= np.maximum(ohlcv['open'], ohlcv['close']))
+    assert np.all(ohlcv['low'] <= np.minimum(ohlcv['open'], ohlcv['close']))
+
+
+def test_write_synthetic_data_aggregates_coarser_timeframes(tmp_path):
+    start_ns, end_ns = write_synthetic_data(240, ['4h', '1h'], base_folder=tmp_path)
+    assert end_ns - start_ns == 240 * hour_ns
+
+    hourly = get_local_store('SYNTHUSDT', '1h', tmp_path).load_arrays(start_ns, end_ns)
+    four_hourly = get_local_store('SYNTHUSDT', '4h', tmp_path).load_arrays(start_ns, end_ns)
+    assert len(four_hourly['timestamp']) == 60
+    np.testing.assert_allclose(four_hourly['close'], hourly['close'][3::4])
+    np.testing.assert_allclose(four_hourly['high'], hourly['high'].reshape(-1, 4).max(axis=1))
+
+
+def test_compare_to_baseline_flags_slowdowns_past_tolerance():
+    baseline = {'results': [get_result('get_merged_data', 1.), get_result('pf_figure_html', 1.)]}
+    results = {'results': [get_result('get_merged_data', 1.2), get_result('pf_figure_html', 1.3),
+                           get_result('get_pf_and_strat_runs', 9.)]}
+
+    comparisons = compare_to_baseline(results, baseline, tolerance=0.25)
+
+    assert [comparison['regression'] for comparison in comparisons] == [False, True]
+
+
+def test_startup_measurements_compare_by_case():
+    baseline = {'results': [{'function': 'import_models', 'median_seconds': 1.}]}
+    results = {'results': [{'function': 'import_models', 'median_seconds': 0.5},
+                           {'function': 'pool_spin_up', 'median_seconds': 2.}]}
+
+    comparisons = compare_to_baseline(results, baseline, tolerance=0.25)
+
+    assert [(comparison['key'], comparison['regression']) for comparison in comparisons] == [('import_models', False)]
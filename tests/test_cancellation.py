@@ -0,0 +1,19 @@
+import pytest
+
+from engine.cancellation import set_job_cancel_path, request_job_cancel, raise_if_job_cancelled, \
+    JobCancelledError, is_job_cancelled
+
+
+def test_cancel_flag(tmp_path):
+    cancel_path = tmp_path / 'jobs' / 'job.cancel'
+    set_job_cancel_path(cancel_path)
+    try:
+        raise_if_job_cancelled()
+
+        request_job_cancel(cancel_path)
+        with pytest.raises(JobCancelledError):
+            raise_if_job_cancelled()
+    finally:
+        set_job_cancel_path(None)
+
+    assert not is_job_cancelled()
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from base_config import BaseConfig
+from engine.data.data_manager import align_symbol_datas, aggregate_ohlcv_arrays, get_derivation_base_timeframe, \
+    derive_missing_intervals, get_timeframe_alignment_index, align_slow_values_to_fast
+from engine.data.local_store import get_local_store, ohlcv_fields
+
+minute_ns = 60 * 10 ** 9
+hour_ns = 60 * minute_ns
+
+
+def get_frame(start: str, periods: int) -> pd.DataFrame:
+    index = pd.date_range(start, periods=periods, freq='1h', tz='UTC')
+    return pd.DataFrame({'close': range(periods)}, index=index, dtype=float)
+
+
+def test_symbols_are_trimmed_to_their_shared_bars():
+    symbol_datas = align_symbol_datas({'BTCUSDT': {'1h': get_frame('2024-01-01 00:00', 48)},
+                                       'ETHUSDT': {'1h': get_frame('2024-01-01 05:00', 40)}})
+
+    btc, eth = symbol_datas['BTCUSDT']['1h'], symbol_datas['ETHUSDT']['1h']
+    assert btc.index.equals(eth.index)
+    assert btc.index[0] == pd.Timestamp('2024-01-01 05:00', tz='UTC')
+    assert btc.index[-1] == pd.Timestamp('2024-01-02 20:00', tz='UTC')
+
+
+def test_gaps_cannot_be_aligned():
+    gapped = get_frame('2024-01-01 00:00', 48).drop(pd.Timestamp('2024-01-01 10:00', tz='UTC'))
+
+    with pytest.raises(ValueError):
+        align_symbol_datas({'BTCUSDT': {'1h': get_frame('2024-01-01 00:00', 48)}, 'ETHUSDT': {'1h': gapped}})
+
+
+def get_minute_arrays(n_bars: int) -> dict:
+    timestamps = np.arange(n_bars, dtype=np.int64) * minute_ns
+    values = np.arange(n_bars, dtype=np.float64)
+    return {'timestamp': timestamps, 'open': values, 'high': values + 10, 'low': values - 10, 'close': values + 0.5,
+            'volume': np.ones(n_bars)}
+
+
+def test_bars_aggregate_per_bucket_including_partial_ones():
+    bars = aggregate_ohlcv_arrays(get_minute_arrays(12), 5 * minute_ns)
+
+    assert bars['timestamp'].tolist() == [0, 5 * minute_ns, 10 * minute_ns]
+    assert bars['open'].tolist() == [0., 5., 10.]
+    assert bars['high'].tolist() == [14., 19., 21.]
+    assert bars['low'].tolist() == [-10., -5., 0.]
+    assert bars['close'].tolist() == [4.5, 9.5, 11.5]
+    assert bars['volume'].tolist() == [5., 5., 2.]
+
+
+def test_derivation_prefers_a_covering_store_then_the_coarsest_fetchable_base(tmp_path, monkeypatch):
+    monkeypatch.setattr(BaseConfig.resources, 'local_data', tmp_path)
+    hourly = get_minute_arrays(8)
+    hourly['timestamp'] = hourly['timestamp'] * 60
+    get_local_store('BTCUSDT', '1h', tmp_path).write(hourly.pop('timestamp'), hourly,
+                                                      covered_intervals=[[0, 8 * hour_ns]])
+
+    assert get_derivation_base_timeframe('BTCUSDT', '4h', 0, 8 * hour_ns, ('1m',)) == '1h'
+    assert get_derivation_base_timeframe('BTCUSDT', '4h', 0, 12 * hour_ns, ('1m', '15m')) == '15m'
+    assert get_derivation_base_timeframe('BTCUSDT', '4h', 0, 12 * hour_ns) is None
+
+
+def test_the_open_coarse_bar_is_never_derived(tmp_path, monkeypatch):
+    monkeypatch.setattr(BaseConfig.resources, 'local_data', tmp_path)
+    minutes = get_minute_arrays(120)
+    get_local_store('BTCUSDT', '1m', tmp_path).write(minutes.pop('timestamp'), minutes,
+                                                      covered_intervals=[[0, 2 * hour_ns]])
+    local_store = get_local_store('BTCUSDT', '1h', tmp_path)
+
+    derive_missing_intervals(local_store, 'BTCUSDT', '1h', 0, 2 * hour_ns, now_ns=90 * minute_ns)
+
+    assert local_store.get_covered_intervals() == [[0, hour_ns]]
+    assert local_store.load_arrays(0, 2 * hour_ns)['close'].tolist() == [59.5]
+    assert set(local_store.load_arrays(0, 2 * hour_ns)) == {'timestamp', *ohlcv_fields}
+
+
+def get_index(start: str, periods: int, freq: str) -> pd.DatetimeIndex:
+    return pd.date_range(start, periods=periods, freq=freq, tz='UTC')
+
+
+def test_closed_alignment_only_uses_slow_bars_that_have_closed():
+    slow_index = get_index('2024-01-01 00:00', 3, '4h')
+    fast_index = get_index('2024-01-01 00:00', 12, '1h')
+
+    closed = get_timeframe_alignment_index(slow_index, fast_index, '4h', '1h', alignment='closed')
+    opened = get_timeframe_alignment_index(slow_index, fast_index, '4h', '1h', alignment='open')
+
+    # the 00:00 4h bar closes with the 03:00 1h bar, so it is first usable there
+    assert closed.tolist() == [-1, -1, -1, 0, 0, 0, 0, 1, 1, 1, 1, 2]
+    assert opened.tolist() == [0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2]
+
+
+def test_a_timeframe_aligns_to_itself_one_to_one():
+    index = get_index('2024-01-01 00:00', 6, '1h')
+
+    for alignment in ('closed', 'open'):
+        assert get_timeframe_alignment_index(index, index, '1h', '1h', alignment=alignment).tolist() == list(range(6))
+
+
+def test_fast_bars_before_the_first_slow_bar_get_nan():
+    slow_index = get_index('2024-01-01 04:00', 2, '4h')
+    fast_index = get_index('2024-01-01 00:00', 12, '1h')
+
+    alignment_index = get_timeframe_alignment_index(slow_index, fast_index, '4h', '1h', alignment='closed')
+    fast_values = align_slow_values_to_fast([10., 20.], alignment_index)
+
+    assert alignment_index.tolist() == [-1] * 7 + [0] * 4 + [1]
+    assert np.isnan(fast_values[:7]).all()
+    assert fast_values[7:].tolist() == [10.] * 4 + [20.]
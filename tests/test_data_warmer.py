@@ -0,0 +1,74 @@
+import httpx
+
+from engine.data.data_warmer import DataWarmer
+from engine.data.local_store import get_local_store
+from tests.mock_exchange import create_mock_exchange_app
+
+minute_ns = 60 * 10 ** 9
+
+
+def get_data_warmer(tmp_path, app) -> DataWarmer:
+    return DataWarmer(tmp_path, watchlist=[('BTCUSDT', '1m')], history_days=100 / (24 * 60),
+                      transport=httpx.ASGITransport(app=app))
+
+
+def test_warm_appends_only_newly_closed_bars(tmp_path):
+    app = create_mock_exchange_app()
+    data_warmer = get_data_warmer(tmp_path, app)
+    now_ns = 10_000 * minute_ns + minute_ns // 2
+
+    data_warmer.warm('BTCUSDT', '1m', now_ns=now_ns)
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+    assert local_store.get_covered_intervals() == [[9_900 * minute_ns, 10_000 * minute_ns]]
+    assert data_warmer.get_freshness(now_ns=now_ns)[0]['is_fresh']
+
+    later_ns = now_ns + 5 * minute_ns
+    assert data_warmer.get_freshness(now_ns=later_ns)[0]['lag_bars'] == 5
+
+    n_requests = len(app.state.requests)
+    data_warmer.warm('BTCUSDT', '1m', now_ns=later_ns)
+    assert len(app.state.requests) == n_requests + 1
+    assert app.state.requests[-1][2] == 10_000 * 60_000
+    assert local_store.get_covered_intervals() == [[9_900 * minute_ns, 10_005 * minute_ns]]
+
+    assert data_warmer.warm('BTCUSDT', '1m', now_ns=later_ns) == 0
+
+
+def test_pair_being_warmed_is_skipped(tmp_path):
+    data_warmer = get_data_warmer(tmp_path, create_mock_exchange_app())
+    data_warmer.in_progress.add(('BTCUSDT', '1m'))
+
+    assert data_warmer.warm('BTCUSDT', '1m', now_ns=10_000 * minute_ns) is None
+    assert get_local_store('BTCUSDT', '1m', tmp_path).get_covered_intervals() == []
+
+
+def test_fetch_errors_are_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr('engine.data.data_warmer.BaseConfig.fetch_max_retries', 0)
+    data_warmer = get_data_warmer(tmp_path, create_mock_exchange_app(fail_first_n=10))
+
+    assert data_warmer.warm('BTCUSDT', '1m', now_ns=10_000 * minute_ns) is None
+    assert data_warmer.get_freshness(now_ns=10_000 * minute_ns)[0]['last_error']
+
+
+def test_coarser_timeframes_are_derived_from_the_finest(tmp_path):
+    app = create_mock_exchange_app()
+    data_warmer = DataWarmer(tmp_path, watchlist=[('BTCUSDT', '5m'), ('BTCUSDT', '1m')],
+                             history_days=100 / (24 * 60), transport=httpx.ASGITransport(app=app))
+    now_ns = 10_000 * minute_ns + minute_ns // 2
+
+    data_warmer.warm_all(now_ns=now_ns)
+
+    assert {request[1] for request in app.state.requests} == {'1m'}
+    five_minute_store = get_local_store('BTCUSDT', '5m', tmp_path)
+    assert five_minute_store.get_covered_intervals() == [[9_900 * minute_ns, 10_000 * minute_ns]]
+    minute_closes = get_local_store('BTCUSDT', '1m', tmp_path).load_arrays(0, now_ns)['close']
+    assert five_minute_store.load_arrays(0, now_ns)['close'].tolist() == minute_closes[4::5].tolist()
+
+
+def test_pair_another_fetch_holds_is_skipped(tmp_path):
+    app = create_mock_exchange_app()
+    data_warmer = get_data_warmer(tmp_path, app)
+
+    with get_local_store('BTCUSDT', '1m', tmp_path).fetch_locked():
+        assert data_warmer.warm('BTCUSDT', '1m', now_ns=10_000 * minute_ns) is None
+    assert not app.state.requests
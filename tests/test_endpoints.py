@@ -1,5 +1,7 @@
 import json
+from types import SimpleNamespace
 
+import pandas as pd
 from fastapi.testclient import TestClient
 
 from models import BtRequest, TestingPeriod, RestIndicator, TriggerPair
@@ -76,5 +78,26 @@ def test_bt_request():
     print('test_bt_request passed')
 
 
+
+def test_signal_session_on_empty_history_is_rejected(monkeypatch):
+    from main import app
+    import engine.live_signals as live_signals
+    client = TestClient(app)
+
+    index = pd.DatetimeIndex([], tz='UTC')
+    empty_data = SimpleNamespace(index=index, **{field: pd.Series([], index=index, dtype=float)
+                                                 for field in live_signals.ohlcv_fields})
+    monkeypatch.setattr(live_signals, 'fetch_datas', lambda **kwargs: {'4h': empty_data})
+
+    bt_request = {'symbol': 'BTCUSDT',
+                  'testing_period': {'start': '2022-01-01 00:00', 'end': '2022-02-01 00:00', 'tz': 'UTC'},
+                  'indicators': [{'alias': 'slow_ma', 'indicator': 'ma', 'timeframe': '4h'}],
+                  'custom_ranges': {},
+                  'trigger_pairs': [{'alias': 'cross', 'entry': 'close |> slow_ma', 'exit': 'close <| slow_ma'}]}
+    response = client.post('/signals/sessions', json={'bt_request': bt_request, 'params': {}})
+
+    assert response.status_code == 422, response.json()
+    assert 'no bars' in response.json()['detail']
+
 if __name__ == '__main__':
     test_bt_request()
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators.indicator_library as indicator_library_module
+from indicators.indicator_library import get_indicator_run_results, get_grid_nbytes
+from indicators.indicator_run_caching import indicator_run_cache, clear_indicator_run_cache
+from models import RestIndicator
+
+
+class CountingMa:
+    '''Stands in for vbt's MA, recording the windows of every run'''
+    runs = []
+
+    @classmethod
+    def run(cls, close, window, param_product=False):
+        windows = window if isinstance(window, list) else [window]
+        cls.runs.append(windows)
+        ma = pd.concat([close.rolling(window).mean() for window in windows], axis=1, keys=windows)
+
+        return SimpleNamespace(ma=ma, output_names=['ma'])
+
+
+@pytest.fixture
+def data(monkeypatch):
+    get_indicator_key_value = indicator_library_module.get_indicator_key_value
+    monkeypatch.setattr(indicator_library_module, 'get_indicator_key_value',
+                        lambda indicator, key_value: CountingMa if key_value == 'vbt_indicator'
+                        else get_indicator_key_value(indicator, key_value))
+    CountingMa.runs = []
+    clear_indicator_run_cache()
+    yield get_data(200)
+    clear_indicator_run_cache()
+
+
+def get_data(n: int):
+    index = pd.date_range('2022-01-01', periods=n, freq='1h', tz='UTC')
+    close = pd.Series(100 + np.cumsum(np.random.default_rng(1).normal(size=n)), index=index)
+
+    return SimpleNamespace(index=index, symbols=('SYNTHUSDT',), open=close, high=close, low=close, close=close,
+                           volume=close)
+
+
+def get_ma_results(data, window: int, grid_rest_indicator):
+    rest_indicator = RestIndicator(alias='fast_ma', indicator='ma', timeframe='1h', normalize=False)
+    return get_indicator_run_results(fastest_timeframe_data=data, fastest_timeframe='1h', timeframe_data=data,
+                                     rest_indicator=rest_indicator, run_kwargs={'window': window},
+                                     grid_rest_indicator=grid_rest_indicator, run_values=['ma'])
+
+
+def test_grid_run_once_for_every_trial(data):
+    grid_rest_indicator = RestIndicator(alias='fast_ma', indicator='ma', timeframe='1h', normalize=False,
+                                        run_kwargs={'window': [5, 24]})
+    for window in (5, 12, 24):
+        run_result = get_ma_results(data, window, grid_rest_indicator)['ma']
+        assert run_result['indicator_run_object'] is None
+        np.testing.assert_allclose(run_result['shaped_run_result'], data.close.rolling(window).mean())
+
+    assert CountingMa.runs == [list(range(5, 25))]
+
+
+def test_grid_too_big_for_the_cache_runs_single_trials(data, monkeypatch):
+    grid_rest_indicator = RestIndicator(alias='fast_ma', indicator='ma', timeframe='1h', normalize=False,
+                                        run_kwargs={'window': [5, 24]})
+    monkeypatch.setattr(indicator_run_cache, 'max_bytes', get_grid_nbytes(20, len(data.index)) - 1)
+
+    for window in (5, 12, 12):
+        run_result = get_ma_results(data, window, grid_rest_indicator)['ma']
+        assert run_result['indicator_run_object'] is not None
+        np.testing.assert_allclose(run_result['shaped_run_result'], data.close.rolling(window).mean())
+
+    # single runs are cached like any other
+    assert CountingMa.runs == [[5], [12]]
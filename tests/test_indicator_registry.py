@@ -0,0 +1,23 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from indicators.indicator_registry import indicator_library, get_indicator_key_value
+
+repo_folder = Path(__file__).parent.parent
+
+
+def test_validation_imports_leave_vectorbtpro_unloaded():
+    script = 'import sys, models, base_config\nprint(sorted({"vectorbtpro", "pandas"} & set(sys.modules)))'
+    completed = subprocess.run([sys.executable, '-c', script], cwd=repo_folder, capture_output=True, text=True,
+                               check=True)
+
+    assert completed.stdout.strip() == '[]'
+
+
+def test_every_indicator_names_its_factory_and_metadata():
+    for indicator, spec in indicator_library.items():
+        assert spec['factory'].split(':')[0] in ('talib', 'vbt')
+        assert get_indicator_key_value(indicator, 'default_value') in spec['avlbl_values']
+        if 'chart_options' in spec:
+            assert set(spec['chart_options']['style']) == set(spec['avlbl_values'])
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from indicators.indicator_run_caching import IndicatorRunCache, get_data_fingerprint, normalize_run_kwargs
+
+
+class Data:
+    def __init__(self, n_bars: int = 10_000):
+        self.index = pd.date_range('2024-01-01', periods=n_bars, freq='1min', tz='UTC')
+        self.open, self.high, self.low, self.close, self.volume = (np.arange(n_bars, dtype=np.float64) + offset
+                                                                   for offset in range(5))
+
+
+def test_lru_evicts_the_least_recently_used_entries_by_bytes():
+    cache = IndicatorRunCache(max_bytes=100)
+    cache.set('a', 'a', nbytes=40)
+    cache.set('b', 'b', nbytes=40)
+    assert cache.get('a') == 'a'
+
+    cache.set('c', 'c', nbytes=40)
+
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.get_stats()['bytes'] == 80 and cache.evictions == 1
+
+
+def test_replacing_and_oversized_entries_keep_the_byte_total():
+    cache = IndicatorRunCache(max_bytes=100)
+    cache.set('a', 'a', nbytes=40)
+    cache.set('a', 'a', nbytes=60)
+    cache.set('b', 'b', nbytes=200)
+
+    assert cache.total_bytes == 60 and 'b' not in cache.entries
+
+
+def test_hits_and_misses_are_counted():
+    cache = IndicatorRunCache(max_bytes=100)
+    cache.get('a')
+    cache.set('a', 'a', nbytes=1)
+    cache.get('a')
+    cache.get('a')
+
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (2, 1, 2 / 3)
+
+
+def test_fingerprints_cover_every_bar_and_field():
+    data = Data()
+    fingerprint = get_data_fingerprint(data, '1m')
+    assert get_data_fingerprint(Data(), '1m') == fingerprint
+
+    for field in ('high', 'close', 'volume'):
+        changed_data = Data()
+        getattr(changed_data, field)[4321] += 1
+        assert get_data_fingerprint(changed_data, '1m') != fingerprint
+    assert get_data_fingerprint(data, '5m') != fingerprint
+
+
+def test_run_kwargs_normalize_independent_of_order_and_number_type():
+    assert normalize_run_kwargs({'window': 10, 'alpha': 2.0}) == normalize_run_kwargs({'alpha': 2, 'window': 10.0})
@@ -0,0 +1,115 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import engine.job_queue as job_queue_module
+from engine.job_queue import JobQueue, JobQueueFullError
+
+
+@pytest.fixture
+def release():
+    return threading.Event()
+
+
+@pytest.fixture
+def job_queue(tmp_path, monkeypatch, release):
+    '''A queue running jobs on threads, each job blocks until release is set and records that it started'''
+    started = []
+
+    def run_job(bt_request, cancel_path, progress_path):
+        started.append(bt_request.name)
+        release.wait(timeout=10)
+        return {'name': bt_request.name, 'trace': None}
+
+    monkeypatch.setattr(job_queue_module, 'run_job', run_job)
+    monkeypatch.setattr(job_queue_module, 'get_cached_result', lambda bt_request: None)
+    monkeypatch.setattr(job_queue_module, 'get_result_cache_key', lambda bt_request: bt_request.name)
+
+    queue = JobQueue(max_workers=1, max_depth=1, history_len=1, jobs_folder=tmp_path / 'jobs')
+    executor = queue.executor = ThreadPoolExecutor(max_workers=queue.max_workers)
+    queue.started = started
+    yield queue
+
+    # drops what is still queued, so no job of this test starts in the next one
+    queue.shutdown()
+    release.set()
+    executor.shutdown(wait=True)
+
+
+def get_request(name: str):
+    return SimpleNamespace(name=name, get_diagnostics=False)
+
+
+def test_queue_full(job_queue):
+    running = job_queue.submit(get_request('a'))
+    queued = job_queue.submit(get_request('b'))
+
+    assert running.status == 'running'
+    assert queued.status == 'queued'
+    # the route answers this with a 429
+    with pytest.raises(JobQueueFullError):
+        job_queue.submit(get_request('c'))
+
+
+def test_cancel_queued_and_running(job_queue, release):
+    running = job_queue.submit(get_request('a'))
+    queued = job_queue.submit(get_request('b'))
+
+    # a queued job is dropped, it never reaches a worker
+    job_queue.cancel(queued.job_id)
+    assert queued.status == 'cancelled'
+    assert not queued.cancel_path.exists()
+
+    # a running job is only flagged, it stops itself once it sees the cancel file
+    job_queue.cancel(running.job_id)
+    assert running.status == 'running'
+    assert running.cancel_requested
+    assert running.cancel_path.exists()
+
+    release.set()
+    running.future.result(timeout=10)
+    assert job_queue.started == ['a']
+    assert job_queue.get_stats()['cancelled'] == 1
+
+
+def test_identical_requests_share_the_in_flight_job(job_queue, release):
+    job = job_queue.submit(get_request('a'))
+    assert job_queue.submit(get_request('a')) is job
+
+    # once cancelled the job is no longer joined, nor once finished
+    job_queue.cancel(job.job_id)
+    rerun = job_queue.submit(get_request('a'))
+    assert rerun is not job
+
+    release.set()
+    rerun.future.result(timeout=10)
+    assert job_queue.submit(get_request('a')) is not rerun
+
+
+def test_queued_job_starts_when_worker_frees(job_queue, release):
+    first = job_queue.submit(get_request('a'))
+    second = job_queue.submit(get_request('b'))
+
+    release.set()
+    assert second.future.result(timeout=10)['name'] == 'b'
+    assert first.status == second.status == 'completed'
+    assert job_queue.started == ['a', 'b']
+
+
+def test_history_trimming(job_queue, release):
+    release.set()
+    jobs = []
+    for name in ['a', 'b', 'c']:
+        jobs.append(job_queue.submit(get_request(name)))
+        jobs[-1].future.result(timeout=10)
+        jobs[-1].cancel_path.touch()
+
+    # forgetting happens on submit, c was finished after its own submit
+    assert list(job_queue.jobs) == [jobs[1].job_id, jobs[2].job_id]
+    assert job_queue.get_job(jobs[0].job_id) is None
+    assert not jobs[0].cancel_path.exists()
+
+    last = job_queue.submit(get_request('d'))
+    assert list(job_queue.jobs) == [jobs[2].job_id, last.job_id]
@@ -0,0 +1,79 @@
+import asyncio
+
+import httpx
+import numpy as np
+
+from base_config import BaseConfig
+from engine.data.kline_fetcher import fetch_klines_to_store, plan_kline_chunks, run_coroutine
+from engine.data.local_store import get_local_store
+from tests.mock_exchange import create_mock_exchange_app
+
+minute_ns = 60 * 10 ** 9
+
+
+def fetch(local_store, app, intervals, timeframe='1m', timeframe_ns=minute_ns):
+    return run_coroutine(fetch_klines_to_store(local_store, 'BTCUSDT', timeframe, intervals, timeframe_ns,
+                                               transport=httpx.ASGITransport(app=app)))
+
+
+def test_plan_kline_chunks():
+    assert plan_kline_chunks([[30, 250], [400, 410]], 10, 10) == [(30, 130), (130, 230), (230, 250), (400, 410)]
+
+
+def test_concurrent_fetch_streams_into_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(BaseConfig, 'data_batch_len', 100)
+    app = create_mock_exchange_app(latency_seconds=0.01)
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+
+    assert fetch(local_store, app, [[0, 1000 * minute_ns], [2000 * minute_ns, 2050 * minute_ns]]) == 11
+    assert len(app.state.requests) == 11
+
+    arrays = local_store.load_arrays(0, 3000 * minute_ns)
+    expected = np.concatenate([np.arange(1000), np.arange(2000, 2050)]) * minute_ns
+    np.testing.assert_array_equal(arrays['timestamp'], expected)
+    assert local_store.get_covered_intervals() == [[0, 1000 * minute_ns], [2000 * minute_ns, 2050 * minute_ns]]
+
+
+def test_retries_server_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(BaseConfig, 'fetch_backoff_seconds', 0.001)
+    app = create_mock_exchange_app(fail_first_n=2)
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+
+    fetch(local_store, app, [[0, 10 * minute_ns]])
+    assert len(app.state.requests) == 3
+    assert local_store.read_manifest()['n_rows'] == 10
+
+
+def test_no_bars_before_listing_still_covered(tmp_path):
+    app = create_mock_exchange_app(listed_at_ms=5 * 60_000)
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+
+    fetch(local_store, app, [[0, 10 * minute_ns]])
+    assert local_store.load_arrays(0, 10 * minute_ns)['timestamp'].tolist() == list(np.arange(5, 10) * minute_ns)
+    assert local_store.get_missing_intervals(0, 10 * minute_ns) == []
+
+
+def test_run_coroutine_inside_running_loop():
+    async def outer():
+        return run_coroutine(asyncio.sleep(0, result=1))
+
+    assert asyncio.run(outer()) == 1
+
+
+def test_backfill_chunks_merge_in_one_write(tmp_path, monkeypatch):
+    monkeypatch.setattr(BaseConfig, 'data_batch_len', 100)
+    app = create_mock_exchange_app()
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+    fetch(local_store, app, [[2000 * minute_ns, 2050 * minute_ns]])
+
+    writes = []
+    write = local_store.write
+    monkeypatch.setattr(local_store, 'write', lambda *args, **kwargs: writes.append(1) or write(*args, **kwargs))
+    fetch(local_store, app, [[0, 1000 * minute_ns], [3000 * minute_ns, 3100 * minute_ns]])
+
+    assert len(writes) == 2
+    assert local_store.read_manifest()['generation'] == 1
+    assert local_store.load_arrays(0, 4000 * minute_ns)['timestamp'].tolist()[998:1002] == \
+        [998 * minute_ns, 999 * minute_ns, 2000 * minute_ns, 2001 * minute_ns]
+    assert local_store.get_covered_intervals() == [[0, 1000 * minute_ns], [2000 * minute_ns, 2050 * minute_ns],
+                                                   [3000 * minute_ns, 3100 * minute_ns]]
@@ -0,0 +1,109 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine.live_signals import LiveTrigger, SlowBarAggregator, LiveSignalSession
+from engine.trigger_parsing import compile_trigger
+from indicators.incremental_indicators import incremental_indicators
+from indicators.indicator_library import get_indicator_key_value
+from models import BtRequest, RestIndicator
+
+hour_ns = 3600 * 10 ** 9
+
+
+def get_ohlcv(n: int = 1000) -> dict:
+    rng = np.random.default_rng(7)
+    close = 100 + np.cumsum(rng.normal(size=n))
+    return {'open': np.r_[close[0], close[:-1]],
+            'high': close + rng.random(n),
+            'low': close - rng.random(n),
+            'close': close,
+            'volume': 100 * rng.random(n)}
+
+
+@pytest.mark.parametrize('trigger', ['close |> fast.real',
+                                     'close#mean.5 <| close#median.7 or not (close#diff.window > 0.5)',
+                                     '(close - fast.real) / high > 0.001 and fast.real#diff.3 > 0'])
+def test_live_trigger_matches_vectorized(trigger):
+    operands = get_ohlcv()
+    operands['fast.real'] = pd.Series(operands['close']).rolling(10).mean().to_numpy()
+    compiled_trigger = compile_trigger(trigger, {'fast': ('real', ['real'])}, {'window'})
+
+    expected = compiled_trigger.evaluate(operands, params={'window': 4}, length=len(operands['close']))
+    live_trigger = LiveTrigger(compiled_trigger, {'window': 4})
+    live = [live_trigger.update({key: values[i] for key, values in operands.items()})
+            for i in range(len(operands['close']))]
+
+    np.testing.assert_array_equal(live, expected)
+
+
+@pytest.mark.parametrize('trigger', ['close |> 1', 'close <| 1'])
+def test_live_crosses_carry_the_relation_over_touches(trigger):
+    close = np.array([0., 1., 2., 1., 2., 0., 1., 1., 0., np.nan, 2., 3., 1., 0.])
+    compiled_trigger = compile_trigger(trigger, {}, set())
+
+    expected = compiled_trigger.evaluate({'close': close}, params={}, length=len(close))
+    live_trigger = LiveTrigger(compiled_trigger, {})
+    live = [live_trigger.update({'close': value}) for value in close]
+
+    assert expected.any()
+    np.testing.assert_array_equal(live, expected)
+
+
+@pytest.mark.parametrize('indicator', sorted(incremental_indicators))
+def test_incremental_indicators_match_library(indicator):
+    ohlcv = get_ohlcv()
+    run_kwargs = get_indicator_key_value(indicator, 'run_kwargs')
+    data_run_kwargs = {param: pd.Series(ohlcv[param])
+                       for param in get_indicator_key_value(indicator, 'data_run_params')}
+    run_object = get_indicator_key_value(indicator, 'vbt_indicator').run(**data_run_kwargs, **run_kwargs)
+
+    state = incremental_indicators[indicator](**run_kwargs)
+    live = [state.update({field: values[i] for field, values in ohlcv.items()}) for i in range(len(ohlcv['close']))]
+
+    # recurrences seeded differently converge, compare once every warm-up has long passed
+    for run_value in get_indicator_key_value(indicator, 'avlbl_values'):
+        np.testing.assert_allclose([bar_values[run_value] for bar_values in live][800:],
+                                   np.asarray(getattr(run_object, run_value)).reshape(-1)[800:], rtol=1e-6)
+
+
+def test_slow_bars_complete_on_their_last_fast_bar():
+    slow_bar_aggregator = SlowBarAggregator('4h', '1h')
+    slow_bars = []
+    # starts mid way through a 4h bar, which is never emitted
+    for i in range(2, 12):
+        slow_bar = slow_bar_aggregator.update(i * hour_ns, {'open': i, 'high': i, 'low': -i, 'close': i, 'volume': 1.})
+        if slow_bar is not None:
+            slow_bars.append(slow_bar)
+
+    assert slow_bars == [(4 * hour_ns, {'open': 4, 'high': 7, 'low': -7, 'close': 7, 'volume': 4.}),
+                         (8 * hour_ns, {'open': 8, 'high': 11, 'low': -11, 'close': 11, 'volume': 4.})]
+
+
+def get_timeframed_data(n_fast_bars: int) -> dict:
+    ohlcv = {field: values[:n_fast_bars] for field, values in get_ohlcv().items()}
+    index = pd.date_range('2022-01-01', periods=n_fast_bars, freq='1h', tz='UTC')
+    fast = SimpleNamespace(index=index, **{field: pd.Series(values, index=index) for field, values in ohlcv.items()})
+    slow = SimpleNamespace(index=index[::4], **{field: getattr(fast, field).resample('4h').last()
+                                                 for field in ohlcv})
+
+    return {'1h': fast, '4h': slow}
+
+
+def test_session_needs_its_longest_window_of_history():
+    bt_request = BtRequest(symbol='BTCUSDT',
+                           testing_period={'start': '2022-01-01 00:00', 'end': '2022-02-01 00:00', 'tz': 'UTC'},
+                           indicators=[RestIndicator(alias='slow_ma', indicator='ma', timeframe='4h',
+                                                     run_kwargs={'window': [10, 30]})],
+                           custom_ranges={},
+                           trigger_pairs=[{'alias': 'cross', 'entry': 'close |> slow_ma', 'exit': 'close <| slow_ma'}])
+    params = {'slow_ma__window': 20}
+
+    for n_fast_bars in (0, 40):
+        with pytest.raises(ValueError):
+            LiveSignalSession.from_history(get_timeframed_data(n_fast_bars), bt_request, params)
+
+    session = LiveSignalSession.from_history(get_timeframed_data(80), bt_request, params)
+    assert session.last_bar_ns is not None
@@ -0,0 +1,83 @@
+import multiprocessing
+
+import numpy as np
+
+from engine.data.local_store import get_local_store, merge_intervals, subtract_intervals, ohlcv_fields
+
+
+def get_bars(timestamps, offset=0.):
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    return timestamps, {field: timestamps + offset for field in ohlcv_fields}
+
+
+def test_intervals():
+    assert merge_intervals([[5, 7], [0, 2], [2, 3], [6, 9]]) == [[0, 3], [5, 9]]
+    assert subtract_intervals(0, 10, [[0, 3], [5, 9]]) == [[3, 5], [9, 10]]
+    assert subtract_intervals(4, 5, [[0, 3], [5, 9]]) == [[4, 5]]
+    assert subtract_intervals(1, 3, [[0, 3]]) == []
+
+
+def test_append_and_range_load(tmp_path):
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+    local_store.write(*get_bars([0, 1, 2]), covered_intervals=[[0, 3]])
+    local_store.write(*get_bars([3, 4]), covered_intervals=[[3, 5]])
+
+    assert local_store.read_manifest()['n_rows'] == 5
+    assert local_store.get_covered_intervals() == [[0, 5]]
+    assert local_store.get_missing_intervals(2, 8) == [[5, 8]]
+
+    arrays = local_store.load_arrays(1, 4)
+    assert isinstance(arrays['close'], np.memmap)
+    assert arrays['timestamp'].tolist() == [1, 2, 3]
+
+    df = local_store.load_df(0, 5)
+    assert df.columns.tolist() == ['Open', 'High', 'Low', 'Close', 'Volume']
+    assert str(df.index.tz) == 'UTC'
+
+
+def test_backfill_and_overlap_rewrite(tmp_path):
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+    local_store.write(*get_bars([5, 6, 7]), covered_intervals=[[5, 8]])
+    local_store.write(*get_bars([1, 2, 6], offset=100.), covered_intervals=[[1, 3]])
+
+    arrays = local_store.load_arrays(0, 10)
+    assert arrays['timestamp'].tolist() == [1, 2, 5, 6, 7]
+    assert arrays['close'].tolist() == [101., 102., 5., 106., 7.]
+    assert local_store.get_covered_intervals() == [[1, 3], [5, 8]]
+
+
+def test_merge_commits_a_new_generation_and_keeps_views(tmp_path):
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+    local_store.write(*get_bars([5, 6, 7]), covered_intervals=[[5, 8]])
+    view = local_store.load_arrays(0, 10)
+
+    local_store.write(*get_bars([6], offset=100.), covered_intervals=[[6, 7]])
+
+    assert view['close'].tolist() == [5., 6., 7.]
+    assert local_store.read_manifest()['generation'] == 1
+    assert local_store.load_arrays(0, 10)['close'].tolist() == [5., 106., 7.]
+    assert sorted(path.name for path in local_store.folder.glob('close*.bin')) == ['close.1.bin']
+
+
+def write_bars_one_by_one(folder, timestamps, barrier):
+    local_store = get_local_store('BTCUSDT', '1m', folder)
+    barrier.wait()
+    for timestamp in timestamps:
+        local_store.write(*get_bars([timestamp]), covered_intervals=[[timestamp, timestamp + 1]])
+
+
+def test_concurrent_writers_in_processes(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(2)
+    processes = [context.Process(target=write_bars_one_by_one, args=(tmp_path, range(start, start + 200), barrier))
+                 for start in (0, 1000)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+    expected = list(range(200)) + list(range(1000, 1200))
+    assert local_store.load_arrays(0, 2000)['timestamp'].tolist() == expected
+    assert local_store.load_arrays(0, 2000)['close'].tolist() == expected
+    assert local_store.get_covered_intervals() == [[0, 200], [1000, 1200]]
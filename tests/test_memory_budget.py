@@ -0,0 +1,76 @@
+import pytest
+
+import engine.memory_budget as memory_budget
+from engine.memory_budget import RequestMemory, MemoryBudgetExceededError, get_column_nbytes
+
+mib = 1024 ** 2
+
+
+@pytest.fixture
+def rss_bytes(monkeypatch):
+    '''The resident set size the accounting reads, each free_memory call gives back 10 MiB'''
+    rss_bytes = {'value': 0}
+    monkeypatch.setattr(memory_budget, 'get_rss_bytes', lambda: rss_bytes['value'])
+
+    def free_memory():
+        rss_bytes['value'] -= 10 * mib
+
+    monkeypatch.setattr(memory_budget, 'free_memory', free_memory)
+    return rss_bytes
+
+
+def test_batches_shrink_to_the_headroom_under_the_soft_limit(rss_bytes):
+    memory = RequestMemory(budget_bytes=100 * mib, soft_limit_bytes=80 * mib)
+    rss_bytes['value'] = 40 * mib
+
+    assert memory.get_batch_size('trial_batch', 500, column_nbytes=mib) == 40
+    assert memory.get_batch_size('trial_batch', 10, column_nbytes=mib) == 10
+    assert memory.to_dict()['min_batch_size'] == 40
+    assert memory.cache_evictions == 0
+
+
+def test_caches_are_evicted_before_failing_fast(rss_bytes):
+    memory = RequestMemory(budget_bytes=100 * mib, soft_limit_bytes=80 * mib)
+    memory.account('data', 30 * mib)
+
+    rss_bytes['value'] = 85 * mib
+    memory.ensure_headroom('fetch')
+    assert memory.cache_evictions == 1 and memory.evicted_bytes == 10 * mib
+
+    rss_bytes['value'] = 95 * mib
+    with pytest.raises(MemoryBudgetExceededError, match='at trial_batch.*data 30 MiB'):
+        memory.get_batch_size('trial_batch', 500, column_nbytes=get_column_nbytes(10 ** 6))
+    assert memory.peak_rss_bytes == 95 * mib
+
+
+def test_worker_accounting_merges_peaks():
+    memory = RequestMemory()
+    memory.account('data', 5)
+    worker_memory = RequestMemory()
+    worker_memory.account('data', 3)
+    worker_memory.account('portfolios', 7)
+    worker_memory.min_batch_size = 4
+
+    memory.merge(worker_memory.to_dict())
+
+    assert memory.to_dict()['peak_held_bytes'] == {'data': 5, 'portfolios': 7}
+    assert memory.min_batch_size == 4
+
+
+def test_worker_budgets_split_what_the_request_has_left(rss_bytes):
+    memory = RequestMemory(budget_bytes=100 * mib, soft_limit_bytes=80 * mib)
+    rss_bytes['value'] = 20 * mib
+
+    assert memory.get_worker_budget_bytes(4) == 20 * mib
+    assert RequestMemory().get_worker_budget_bytes(4) is None
+
+
+def test_shared_processes_count_only_the_request_bytes_and_never_evict(rss_bytes):
+    memory = RequestMemory(budget_bytes=100 * mib, soft_limit_bytes=80 * mib, shared_process=True)
+    rss_bytes['value'] = 500 * mib
+    memory.account('data', 30 * mib)
+
+    assert memory.get_batch_size('trial_batch', 500, column_nbytes=mib) == 50
+    with pytest.raises(MemoryBudgetExceededError, match='at top_trials'):
+        memory.ensure_headroom('top_trials', 80 * mib)
+    assert memory.cache_evictions == 0 and rss_bytes['value'] == 500 * mib
@@ -0,0 +1,30 @@
+import pytest
+
+from models import BtRequest
+
+
+def get_bt_request(**kwargs) -> BtRequest:
+    return BtRequest(testing_period={'start': '2022-01-01 00:00', 'end': '2022-02-01 00:00'},
+                     indicators=[],
+                     custom_ranges={},
+                     trigger_pairs=[{'alias': 'level', 'entry': 'close > 100', 'exit': 'close < 100'}],
+                     **kwargs)
+
+
+def test_default_multi_symbol_request_is_valid():
+    bt_request = get_bt_request(symbol=['BTCUSDT', 'ETHUSDT'])
+
+    assert bt_request.is_multi_symbol()
+    assert not bt_request.is_cross_validated()
+
+
+@pytest.mark.parametrize('kwargs', [{'cross_validate': 'standard'}, {'pruner': 'median'}])
+def test_multi_symbol_request_rejects_cross_validation_and_pruning(kwargs):
+    with pytest.raises(ValueError):
+        get_bt_request(symbol=['BTCUSDT', 'ETHUSDT'], **kwargs)
+
+
+def test_pruned_request_is_valid():
+    assert get_bt_request(symbol='BTCUSDT', pruner='median').pruner == 'median'
+    with pytest.raises(ValueError):
+        get_bt_request(symbol='BTCUSDT', pruner='patient')
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine.objective_metrics import get_objective_metric
+
+ann_factor = 365 * 6  # 4h bars
+
+
+def get_returns():
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0.001, 0.02, size=(500, 3))
+    returns[:10, 1] = np.nan
+    returns[:, 2] = 0.
+    return np.asfortranarray(returns)
+
+
+def get_vbt_reference(returns, objective_value):
+    '''The metric as vbt's returns accessor computes it, max drawdown as a positive fraction'''
+    vbt = pytest.importorskip('vectorbtpro')
+    index = pd.date_range('2024-01-01', periods=len(returns), freq='4h')
+    returns_accessor = pd.Series(returns, index=index).vbt.returns(freq='4h', year_freq='365 days')
+
+    return {'sharpe_ratio': lambda: returns_accessor.sharpe_ratio(),
+            'sortino': lambda: returns_accessor.sortino_ratio(),
+            'calmar': lambda: returns_accessor.calmar_ratio(),
+            'omega': lambda: returns_accessor.omega_ratio(),
+            'max_drawdown': lambda: -returns_accessor.max_drawdown(),
+            'total_return': lambda: returns_accessor.total()}[objective_value]()
+
+
+@pytest.mark.parametrize('objective_value', ['sharpe_ratio', 'sortino', 'calmar', 'omega', 'max_drawdown',
+                                             'total_return'])
+def test_kernels_match_vbt(objective_value):
+    returns = get_returns()
+    values = get_objective_metric(returns, objective_value, ann_factor)
+
+    assert values[0] == pytest.approx(get_vbt_reference(returns[:, 0], objective_value))
+    # vbt's accessor starts at the first return, the leading NaNs of an unlisted symbol are dropped
+    assert values[1] == pytest.approx(get_vbt_reference(returns[10:, 1], objective_value))
+
+
+def test_known_values():
+    returns = np.asfortranarray([[0.1], [-0.5], [0.2]])
+
+    # equity 1.1, 0.55, 0.66
+    assert get_objective_metric(returns, 'total_return', ann_factor)[0] == pytest.approx(-0.34)
+    assert get_objective_metric(returns, 'max_drawdown', ann_factor)[0] == pytest.approx(0.5)
+    assert get_objective_metric(returns, 'omega', ann_factor)[0] == pytest.approx(0.6)
+
+
+def test_flat_returns():
+    returns = get_returns()
+    assert np.isnan(get_objective_metric(returns, 'sharpe_ratio', ann_factor)[2])
+    assert get_objective_metric(returns, 'total_return', ann_factor)[2] == 0
+    assert get_objective_metric(returns, 'max_drawdown', ann_factor)[2] == 0
+
+
+def test_invalid_objective():
+    with pytest.raises(ValueError):
+        get_objective_metric(get_returns(), 'profit_factor', ann_factor)
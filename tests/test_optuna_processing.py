@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import optuna
+
+from engine.optuna_processing import get_top_trials, split_n_trials, get_study_pruner, get_persistent_study, \
+    fail_stale_running_trials, get_n_remaining_trials
+
+
+def test_top_trials_follow_direction():
+    for direction, expected_values in (('maximize', [4, 3]), ('minimize', [0, 1])):
+        study = optuna.create_study(direction=direction)
+        for x in [2, 0, 4, 1, 3]:
+            study.enqueue_trial({'x': x})
+        study.optimize(lambda trial: trial.suggest_int('x', 0, 4), n_trials=5)
+
+        assert [trial.value for trial in get_top_trials(study, 2)] == expected_values
+
+
+def test_split_n_trials():
+    assert sum(split_n_trials(10, 3)) == 10
+
+
+def test_study_pruner_follows_request():
+    assert isinstance(get_study_pruner(SimpleNamespace(pruner=None, pruning_segments=4)), optuna.pruners.NopPruner)
+    pruner = get_study_pruner(SimpleNamespace(pruner='hyperband', pruning_segments=4))
+    assert isinstance(pruner, optuna.pruners.HyperbandPruner)
+
+    study = optuna.create_study(pruner=get_study_pruner(SimpleNamespace(pruner='median', pruning_segments=4)))
+    for value in range(10):
+        trial = study.ask()
+        trial.report(value, step=0)
+        study.tell(trial, state=optuna.trial.TrialState.PRUNED) if trial.should_prune() else study.tell(trial, value)
+
+    assert any(trial.state == optuna.trial.TrialState.PRUNED for trial in study.trials)
+
+
+def test_resuming_fails_trials_a_dead_worker_left_running(tmp_path):
+    bt_request = SimpleNamespace(seed=0, pruner=None, pruning_segments=4)
+    study = get_persistent_study('study', tmp_path / 'study.log', 'maximize', bt_request)
+    study.tell(study.ask(), 1.)
+    study.ask()  # its worker dies before telling
+
+    resumed_study = get_persistent_study('study', tmp_path / 'study.log', 'maximize', bt_request)
+    assert fail_stale_running_trials(resumed_study) == 1
+    assert [trial.state for trial in resumed_study.trials] == [optuna.trial.TrialState.COMPLETE,
+                                                               optuna.trial.TrialState.FAIL]
+    assert get_n_remaining_trials(resumed_study, 3) == 2
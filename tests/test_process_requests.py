@@ -0,0 +1,90 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import optuna
+import pandas as pd
+
+from base_config import BaseConfig
+from benchmarks.synthetic_data import benchmark_symbol, write_synthetic_data
+from engine.data.data_manager import fetch_datas
+from engine.optuna_processing import get_study_pruner
+import engine.process_requests as process_requests
+from engine.process_requests import std_objective, get_kwargs_to_add, run_persistent_study, get_study_request_hash
+from models import BtRequest, RestIndicator, TestingPeriod
+
+
+def get_bt_request(start_ns: int, end_ns: int, **kwargs) -> BtRequest:
+    testing_period = TestingPeriod(start=pd.Timestamp(start_ns, tz='UTC').strftime('%Y-%m-%d %H:%M'),
+                                   end=pd.Timestamp(end_ns - 1, tz='UTC').strftime('%Y-%m-%d %H:%M'),
+                                   tz='UTC')
+
+    return BtRequest(symbol=benchmark_symbol,
+                     testing_period=testing_period,
+                     indicators=[RestIndicator(alias='fast_ma', indicator='ma', timeframe='1h',
+                                               run_kwargs={'window': [5, 50]})],
+                     custom_ranges={},
+                     trigger_pairs=[{'alias': 'cross', 'entry': 'close > fast_ma', 'exit': 'close < fast_ma'}],
+                     **kwargs)
+
+
+def test_pruned_study_reports_every_segment(tmp_path, monkeypatch):
+    monkeypatch.setattr(BaseConfig.resources, 'local_data', tmp_path)
+    start_ns, end_ns = write_synthetic_data(2000, ['1h'], base_folder=tmp_path)
+    bt_request = get_bt_request(start_ns, end_ns, cross_validate=None, pruner='median', pruning_segments=4,
+                                n_trials=12)
+    timeframed_data = fetch_datas(source=bt_request.source, symbol=bt_request.symbol, timeframes=['1h'],
+                                  testing_period=bt_request.testing_period)
+    kwargs_to_add = get_kwargs_to_add(bt_request)
+
+    study = optuna.create_study(direction='maximize', pruner=get_study_pruner(bt_request),
+                                sampler=optuna.samplers.TPESampler(seed=0))
+    study.optimize(lambda trial: std_objective(trial, timeframed_data, bt_request, kwargs_to_add),
+                   n_trials=bt_request.n_trials)
+
+    completed = study.get_trials(states=[optuna.trial.TrialState.COMPLETE])
+    assert len(completed) + len(study.get_trials(states=[optuna.trial.TrialState.PRUNED])) == bt_request.n_trials
+    assert completed
+    # a trial that runs to the end reported its objective after every segment but the last
+    assert all(len(trial.intermediate_values) == bt_request.pruning_segments - 1 for trial in completed)
+
+
+def test_concurrent_runs_of_a_study_run_its_trials_once(tmp_path, monkeypatch):
+    def std_objective(trial, action_data, bt_request, kwargs_to_add):
+        time.sleep(0.01)
+        return trial.suggest_float('x', 0, 1)
+
+    monkeypatch.setattr(process_requests, 'std_objective', std_objective)
+    bt_request = SimpleNamespace(objective_value='sharpe_ratio', n_trials=8, trial_batch_size=1, seed=None,
+                                 pruner=None, pruning_segments=4, is_multi_symbol=lambda: False)
+
+    errors = []
+
+    def run():
+        try:
+            run_persistent_study('study', tmp_path / 'study.log', timeframed_data=None, bt_request=bt_request,
+                                 kwargs_to_add=[])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    study = optuna.load_study(study_name='study', storage=optuna.storages.JournalStorage(
+        optuna.storages.JournalFileStorage(str(tmp_path / 'study.log'))))
+    assert [trial.state for trial in study.trials] == [optuna.trial.TrialState.COMPLETE] * bt_request.n_trials
+
+
+def test_study_hash_ignores_how_much_work_runs():
+    start_ns = pd.Timestamp('2022-01-01', tz='UTC').value
+    end_ns = pd.Timestamp('2022-02-01', tz='UTC').value
+    study_hash = get_study_request_hash(get_bt_request(start_ns, end_ns, n_trials=10), timeframed_data=None)
+
+    assert get_study_request_hash(get_bt_request(start_ns, end_ns, n_trials=50, trial_batch_size=8),
+                                  timeframed_data=None) == study_hash
+    assert get_study_request_hash(get_bt_request(start_ns, end_ns, n_trials=10, fee=0.001),
+                                  timeframed_data=None) != study_hash
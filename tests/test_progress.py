@@ -0,0 +1,30 @@
+import optuna
+
+from engine.progress import set_job_progress_path, set_progress_phase, emit_trial_progress, read_progress_events
+
+
+def test_trial_events_carry_phase_and_best_value(tmp_path):
+    progress_path = tmp_path / 'job.progress.jsonl'
+    set_job_progress_path(progress_path)
+    try:
+        set_progress_phase('train_study', fold=1)
+        study = optuna.create_study(direction='maximize')
+        study.optimize(lambda trial: trial.suggest_int('x', 0, 10), n_trials=3, callbacks=[emit_trial_progress])
+    finally:
+        set_job_progress_path(None)
+
+    events = read_progress_events(progress_path)
+    assert [event['type'] for _, event in events] == ['phase', 'trial', 'trial', 'trial']
+    assert all(event['fold'] == 1 and event['phase'] == 'train_study' for _, event in events)
+
+    trial_events = [event for _, event in events if event['type'] == 'trial']
+    assert [event['trial'] for event in trial_events] == [0, 1, 2]
+    assert trial_events[-1]['best_value'] == max(event['value'] for event in trial_events)
+
+    resume_offset = events[1][0]
+    assert [event['trial'] for _, event in read_progress_events(progress_path, resume_offset)] == [1, 2]
+
+
+def test_no_events_outside_jobs(tmp_path):
+    set_progress_phase('study')
+    assert read_progress_events(tmp_path / 'missing.jsonl') == []
@@ -0,0 +1,55 @@
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from base_config import BaseConfig
+from engine.data.local_store import get_local_store, ohlcv_fields
+from engine.result_cache import ResultCache, get_data_version
+
+minute_ns = 60 * 10 ** 9
+
+
+def test_get_set_and_ttl(tmp_path):
+    result_cache = ResultCache(tmp_path, max_bytes=10 ** 6)
+    assert result_cache.get('missing') is None
+
+    result_cache.set('closed', {'best_value': 1.5})
+    assert result_cache.get('closed') == {'best_value': 1.5}
+
+    result_cache.set('open_ended', {'best_value': 2.}, ttl_seconds=-1)
+    assert result_cache.get('open_ended') is None
+    assert not (tmp_path / 'open_ended.json').exists()
+
+
+def test_size_eviction_drops_least_recently_used(tmp_path):
+    result_cache = ResultCache(tmp_path, max_bytes=10 ** 6)
+    result_cache.set('a', 'x' * 80)
+    # slack for the created_at timestamps serializing to a few more digits
+    result_cache.max_bytes = 2 * (tmp_path / 'a.json').stat().st_size + 8
+
+    for key in ('a', 'b'):
+        result_cache.set(key, 'x' * 80)
+        past = time.time() - (10 if key == 'a' else 5)
+        os.utime(tmp_path / f'{key}.json', (past, past))
+
+    assert result_cache.get('a') is not None
+    result_cache.set('c', 'x' * 80)
+
+    assert sorted(path.stem for path in tmp_path.glob('*.json')) == ['a', 'c']
+
+
+def test_data_version_covers_every_ohlcv_column(tmp_path, monkeypatch):
+    monkeypatch.setattr(BaseConfig.resources, 'local_data', tmp_path)
+    bt_request = SimpleNamespace(testing_period=SimpleNamespace(start='1970-01-01 00:00', end='1970-01-01 01:00'),
+                                 indicators=[SimpleNamespace(timeframe='1m')], get_symbols=lambda: ['BTCUSDT'])
+    local_store = get_local_store('BTCUSDT', '1m', tmp_path)
+    timestamps = np.arange(120) * minute_ns
+    local_store.write(timestamps, {field: np.ones(120) for field in ohlcv_fields},
+                      covered_intervals=[[0, 120 * minute_ns]])
+    data_version = get_data_version(bt_request)
+
+    local_store.write(timestamps[30:31], {field: np.full(1, 2. if field == 'high' else 1.) for field in ohlcv_fields})
+
+    assert data_version is not None and get_data_version(bt_request) != data_version
@@ -0,0 +1,40 @@
+from base_config import BaseConfig
+from engine.tracing import trace_span, request_trace, null_span, get_trace_dict, merge_worker_trace, \
+    get_trace_diagnostics, MetricsRegistry
+
+
+def test_spans_are_totalled_per_request_and_merge_worker_traces():
+    with request_trace() as worker_trace:
+        with trace_span('simulate'):
+            pass
+    worker_trace_dict = get_trace_dict(worker_trace)
+
+    with request_trace() as trace:
+        for _ in range(3):
+            with trace_span('simulate'):
+                pass
+        merge_worker_trace(worker_trace_dict)
+
+    diagnostics = get_trace_diagnostics(get_trace_dict(trace))
+    assert diagnostics['spans']['simulate']['count'] == 4
+    assert diagnostics['spans']['request']['count'] == 2
+    assert set(diagnostics['counters']) == {'indicator_cache_hits', 'indicator_cache_misses'}
+
+
+def test_spans_are_no_ops_outside_requests_and_when_disabled(monkeypatch):
+    assert trace_span('simulate') is null_span
+
+    monkeypatch.setattr(BaseConfig, 'tracing_enabled', False)
+    with request_trace() as trace:
+        assert trace is None
+        assert trace_span('simulate') is null_span
+
+
+def test_metrics_registry_rolls_its_histograms():
+    metrics_registry = MetricsRegistry(buckets=(0.1, 1), window_len=2)
+    for seconds in (5., 0.05, 0.5):
+        metrics_registry.observe({'spans': {'fetch': [seconds, 1]}, 'counters': {'indicator_cache_hits': 1}})
+
+    assert metrics_registry.get_histograms()['fetch'] == {'buckets': [(0.1, 1), (1, 2), ('+Inf', 2)],
+                                                          'sum': 0.55, 'count': 2}
+    assert metrics_registry.get_counters() == {'traced_requests': 3, 'indicator_cache_hits': 3}
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from engine.trigger_parsing import compile_trigger, get_compiled_trigger, parse_trigger, get_processed_array, \
+    get_crossed
+
+indicator_values = {'fast_macd': ('hist', ['macd', 'signal', 'hist']),
+                    'slow_ma': ('ma', ['ma'])}
+parameter_names = {'macd_hist_long', 'diff_diffs'}
+
+
+def get_operands(length=6):
+    return {'close': np.arange(length, dtype=float),
+            'fast_macd.hist': np.array([-2., -1., 1., 2., 1., -1.])[:length],
+            'fast_macd.macd': np.zeros(length),
+            'slow_ma.ma': np.full(length, 2.5)}
+
+
+def test_compile_and_evaluate():
+    compiled = compile_trigger('(fast_macd.hist#diff.diff_diffs >= macd_hist_long) and (close > slow_ma)',
+                               indicator_values, parameter_names)
+
+    assert compiled.operand_keys == {'fast_macd.hist', 'close', 'slow_ma.ma'}
+    assert compiled.referenced_aliases == {'fast_macd', 'slow_ma'}
+    assert compiled.parameter_names == {'diff_diffs', 'macd_hist_long'}
+
+    entries = compiled.evaluate(get_operands(), params={'diff_diffs': 1, 'macd_hist_long': 0.5}, length=6)
+    assert entries.tolist() == [False, False, False, True, False, False]
+
+
+def test_default_value_and_crosses():
+    compiled = compile_trigger('fast_macd |> 0 or not fast_macd.macd == 0', indicator_values, parameter_names)
+    assert compiled.operand_keys == {'fast_macd.hist', 'fast_macd.macd'}
+
+    entries = compiled.evaluate(get_operands(), params={}, length=6)
+    assert entries.tolist() == [False, False, True, False, False, False]
+
+
+# left against a right of 0: touches before crossing, after crossing and around NaN
+touching_left = np.array([-1., 0., 1., 0., 1., -1., 0., 0., -1., np.nan, 1., 2., 0., -1.])
+touching_crossed_above = [False, False, True, False, False, False, False, False, False, False, False, False, False,
+                          False]
+touching_crossed_below = [False, False, False, False, False, True, False, False, False, False, False, False, False,
+                          True]
+
+
+def test_crosses_carry_the_relation_over_touches():
+    assert get_crossed(touching_left, 0., above=True).tolist() == touching_crossed_above
+    assert get_crossed(touching_left, 0., above=False).tolist() == touching_crossed_below
+
+
+def test_crosses_match_vbt():
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('vectorbtpro')
+    left = np.random.default_rng(3).integers(-2, 3, 500).astype(float)
+    left[[50, 51, 300]] = np.nan
+    right = np.random.default_rng(4).integers(-2, 3, 500).astype(float)
+
+    np.testing.assert_array_equal(get_crossed(left, right, above=True),
+                                  pd.Series(left).vbt.crossed_above(pd.Series(right)).to_numpy())
+    np.testing.assert_array_equal(get_crossed(left, right, above=False),
+                                  pd.Series(left).vbt.crossed_below(pd.Series(right)).to_numpy())
+
+
+def test_arithmetic_precedence():
+    compiled = compile_trigger('close - 1 * 2 > -close % 4', indicator_values, parameter_names)
+    close = get_operands()['close']
+    assert compiled.evaluate(get_operands(), params={}, length=6).tolist() == (close - 2 > -close % 4).tolist()
+
+
+def test_processes():
+    array = np.array([1., 2., 4., 7.])
+    np.testing.assert_array_equal(get_processed_array(array, 'diff', 2), [np.nan, np.nan, 3., 5.])
+    np.testing.assert_array_equal(get_processed_array(array, 'mean', 2), [np.nan, 1.5, 3., 5.5])
+    np.testing.assert_array_equal(get_processed_array(array, 'median', 3), [np.nan, np.nan, 2., 4.])
+
+
+@pytest.mark.parametrize('trigger', ['close >', '(close > 1', 'close > 1 1', 'close + 1', 'close > 1 and 2',
+                                     'fast_macd.hist#sum.2 > 0', '__import__("os")', 'close > 1; 2'])
+def test_invalid_syntax(trigger):
+    with pytest.raises(ValueError):
+        compile_trigger(trigger, indicator_values, parameter_names)
+
+
+@pytest.mark.parametrize('trigger', ['unknown > 1', 'fast_macd.upper > 1', 'macd_hist_long#diff.2 > 1',
+                                     'close#diff.unknown > 1'])
+def test_unknown_names(trigger):
+    parse_trigger(trigger)
+    with pytest.raises(ValueError):
+        compile_trigger(trigger, indicator_values, parameter_names)
+
+
+def test_compiled_trigger_is_cached():
+    first = get_compiled_trigger('close > slow_ma', indicator_values, parameter_names)
+    assert get_compiled_trigger('close > slow_ma', indicator_values, parameter_names) is first
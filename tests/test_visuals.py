@@ -0,0 +1,19 @@
+import numpy as np
+
+from engine.visuals import get_lttb_indices
+
+
+def test_lttb_keeps_ends_and_extremes():
+    y = np.zeros(1000)
+    y[500] = 10.
+    y[:3] = np.nan
+
+    indices = get_lttb_indices(y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert 500 in indices
+
+
+def test_lttb_short_series_untouched():
+    np.testing.assert_array_equal(get_lttb_indices(np.arange(5.), 10), np.arange(5))